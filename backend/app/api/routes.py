@@ -1,5 +1,6 @@
 import os
 import os
+import asyncio
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from typing import List
 import logging
@@ -20,10 +21,14 @@ from app.services.conversation_service import conversation_service
 from app.services.rag_service import get_rag_service
 from datetime import datetime
 from pydantic import BaseModel
+import orjson
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Saved CAD analyses: indented like json.dump(indent=2); numpy values stay numbers
+ANALYSIS_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
 class UpdateDocumentsRequest(BaseModel):
     document_ids: List[str]
 
@@ -86,7 +91,7 @@ async def get_documents():
 async def delete_document(doc_id: str):
     """Delete a document"""
     try:
-        success = document_service.delete_document(doc_id)
+        success = await document_service.delete_document(doc_id)
         if not success:
             raise HTTPException(status_code=404, detail="Document not found")
         return {"message": "Document deleted successfully", "id": doc_id}
@@ -302,12 +307,10 @@ async def get_cad_manifest(doc_id: str):
     """Get CAD manifest for a document"""
     try:
         from pathlib import Path
-        import json
         
         manifest_path = Path(f"cad_manifests/{doc_id}_Model.json")
         if manifest_path.exists():
-            with open(manifest_path) as f:
-                return json.load(f)
+            return orjson.loads(manifest_path.read_bytes())
         else:
             raise HTTPException(status_code=404, detail="Manifest not found")
     except HTTPException:
@@ -354,9 +357,8 @@ async def regenerate_cad_analysis(doc_id: str):
     """Regenerate advanced CAD analysis for a document"""
     try:
         from pathlib import Path
-        from app.cad.advanced_visual_analyzer import AdvancedCADVisualAnalyzer
+        from app.cad.advanced_visual_analyzer import get_analyzer
         from app.core.config import get_settings
-        import json
         
         settings = get_settings()
         
@@ -375,14 +377,13 @@ async def regenerate_cad_analysis(doc_id: str):
         
         logger.info(f"Regenerating CAD analysis for {doc_id}")
         
-        # Run analysis
-        analyzer = AdvancedCADVisualAnalyzer(settings.GOOGLE_API_KEY)
-        results = analyzer.comprehensive_analysis(str(png_path))
+        # Run analysis (the analyzer is shared process-wide, not built per request)
+        analyzer = get_analyzer(settings.GOOGLE_API_KEY)
+        results = await analyzer.comprehensive_analysis_async(str(png_path))
         
         # Save results
         analysis_path = Path(f"cad_manifests/{doc_id}_analysis.json")
-        with open(analysis_path, 'w') as f:
-            json.dump(results, f, indent=2)
+        analysis_path.write_bytes(orjson.dumps(results, option=ANALYSIS_JSON_OPTIONS))
         
         logger.info(f"CAD analysis saved to {analysis_path}")
         
@@ -438,7 +439,6 @@ async def run_advanced_analysis(conv_id: str, request: ChatRequest):
         from app.cad.multi_model_analyzer import MultiModelCADAnalyzer
         from app.core.config import get_settings
         from pathlib import Path
-        import json
         
         settings = get_settings()
         analyzer = MultiModelCADAnalyzer(
@@ -453,32 +453,32 @@ async def run_advanced_analysis(conv_id: str, request: ChatRequest):
         
         all_analyses = []
         
-        for doc in cad_docs:
-            doc_id = doc['id']
-            doc_name = doc['name']
-            
-            logger.info(f"Running advanced analysis for: {doc_name} with {selected_model}")
-            
-            # Find PNG
-            png_path = Path(f"cad_renders/{doc_id}_analysis.png")
-            
-            if not png_path.exists():
-                logger.warning(f"PNG not found for {doc_id}, skipping")
-                all_analyses.append(f"⚠️ **{doc_name}**: Analysis PNG not available. Please re-upload this file.")
-                continue
-            
-            try:
-                # Run comprehensive analysis
-                analysis_results = await analyzer.comprehensive_analysis(str(png_path), selected_model)
+        try:
+            for doc in cad_docs:
+                doc_id = doc['id']
+                doc_name = doc['name']
                 
-                # Save analysis
-                analysis_path = Path(f"cad_manifests/{doc_id}_analysis.json")
-                with open(analysis_path, 'w') as f:
-                    json.dump(analysis_results, f, indent=2)
+                logger.info(f"Running advanced analysis for: {doc_name} with {selected_model}")
                 
-                # Format response
-                model_info = analyzer.MODELS[selected_model]
-                formatted = f"""
+                # Find PNG
+                png_path = Path(f"cad_renders/{doc_id}_analysis.png")
+                
+                if not png_path.exists():
+                    logger.warning(f"PNG not found for {doc_id}, skipping")
+                    all_analyses.append(f"⚠️ **{doc_name}**: Analysis PNG not available. Please re-upload this file.")
+                    continue
+                
+                try:
+                    # Run comprehensive analysis
+                    analysis_results = await analyzer.comprehensive_analysis(str(png_path), selected_model)
+                    
+                    # Save analysis
+                    analysis_path = Path(f"cad_manifests/{doc_id}_analysis.json")
+                    analysis_path.write_bytes(orjson.dumps(analysis_results, option=ANALYSIS_JSON_OPTIONS))
+                    
+                    # Format response
+                    model_info = analyzer.MODELS[selected_model]
+                    formatted = f"""
 # 🔍 ADVANCED CAD ANALYSIS: {doc_name}
 
 **Model**: {model_info['name']} ({model_info['provider'].upper()})
@@ -486,11 +486,13 @@ async def run_advanced_analysis(conv_id: str, request: ChatRequest):
 
 {analyzer.format_for_rag(analysis_results)}
 """
-                all_analyses.append(formatted)
-                
-            except Exception as e:
-                logger.error(f"Error analyzing {doc_name}: {e}", exc_info=True)
-                all_analyses.append(f"❌ **{doc_name}**: Analysis failed - {str(e)}")
+                    all_analyses.append(formatted)
+                    
+                except Exception as e:
+                    logger.error(f"Error analyzing {doc_name}: {e}", exc_info=True)
+                    all_analyses.append(f"❌ **{doc_name}**: Analysis failed - {str(e)}")
+        finally:
+            await analyzer.aclose()
         
         if not all_analyses:
             combined_response = "⚠️ No analyses could be completed. Please ensure CAD files have been properly uploaded."
@@ -574,7 +576,6 @@ async def run_hybrid_analysis(conv_id: str, request: ChatRequest):
         from app.cad.hybrid_analyzer import HybridCADAnalyzer
         from app.core.config import get_settings
         from pathlib import Path
-        import json
         
         settings = get_settings()
         analyzer = HybridCADAnalyzer(
@@ -584,40 +585,47 @@ async def run_hybrid_analysis(conv_id: str, request: ChatRequest):
         
         all_analyses = []
         
-        for doc in cad_docs:
-            doc_id = doc['id']
-            doc_name = doc['name']
-            
-            logger.info(f"Running hybrid analysis for: {doc_name} with {selected_model}")
-            
-            # Find PNG
-            png_path = f"cad_renders/{doc_id}_analysis.png"
-            
-            if not Path(png_path).exists():
-                logger.warning(f"PNG not found for {doc_id}, skipping")
-                all_analyses.append(f"⚠️ **{doc_name}**: Analysis PNG not available.")
-                continue
+        try:
+            # CV features for all drawings at once, in worker processes
+            await asyncio.to_thread(
+                analyzer.prefetch_cv_features,
+                [f"cad_renders/{doc['id']}_analysis.png" for doc in cad_docs]
+            )
             
-            try:
-                # Determine if model supports vision
-                model_info = analyzer.llm_analyzer.MODELS.get(selected_model)
-                include_vision = model_info and 'vision' in model_info.get('capabilities', [])
+            for doc in cad_docs:
+                doc_id = doc['id']
+                doc_name = doc['name']
                 
-                # Run hybrid analysis
-                result = await analyzer.analyze_with_cv_assistance(
-                    png_path,
-                    selected_model,
-                    include_vision=include_vision
-                )
+                logger.info(f"Running hybrid analysis for: {doc_name} with {selected_model}")
                 
-                # Save analysis
-                analysis_file = f"cad_manifests/{doc_id}_hybrid_analysis.json"
-                with open(analysis_file, 'w') as f:
-                    json.dump(result, f, indent=2, default=str)
+                # Find PNG
+                png_path = f"cad_renders/{doc_id}_analysis.png"
                 
-                # Format response
-                cv_summary = result['cv_features']['summary']
-                formatted = f"""
+                if not Path(png_path).exists():
+                    logger.warning(f"PNG not found for {doc_id}, skipping")
+                    all_analyses.append(f"⚠️ **{doc_name}**: Analysis PNG not available.")
+                    continue
+                
+                try:
+                    # Determine if model supports vision
+                    model_info = analyzer.llm_analyzer.MODELS.get(selected_model)
+                    include_vision = model_info and 'vision' in model_info.get('capabilities', [])
+                    
+                    # Run hybrid analysis
+                    result = await analyzer.analyze_with_cv_assistance(
+                        png_path,
+                        selected_model,
+                        include_vision=include_vision
+                    )
+                    
+                    # Save analysis
+                    analysis_file = f"cad_manifests/{doc_id}_hybrid_analysis.json"
+                    with open(analysis_file, 'wb') as f:
+                        f.write(orjson.dumps(result, default=str, option=ANALYSIS_JSON_OPTIONS))
+                    
+                    # Format response
+                    cv_summary = result['cv_features']['summary']
+                    formatted = f"""
 # 🤖 HYBRID CAD ANALYSIS: {doc_name}
 
 **Model**: {result['model_used']}
@@ -632,11 +640,13 @@ async def run_hybrid_analysis(conv_id: str, request: ChatRequest):
 ## AI Analysis
 {result['llm_analysis']}
 """
-                all_analyses.append(formatted)
-                
-            except Exception as e:
-                logger.error(f"Hybrid analysis failed for {doc_id}: {e}")
-                all_analyses.append(f"❌ **{doc_name}**: {str(e)}")
+                    all_analyses.append(formatted)
+                    
+                except Exception as e:
+                    logger.error(f"Hybrid analysis failed for {doc_id}: {e}")
+                    all_analyses.append(f"❌ **{doc_name}**: {str(e)}")
+        finally:
+            await analyzer.aclose()
         
         if not all_analyses:
             combined_response = "⚠️ No analyses could be completed."
@@ -742,7 +752,6 @@ async def run_hybrid_analysis(conv_id: str, request: ChatRequest):
         from app.cad.hybrid_analyzer import HybridCADAnalyzer
         from app.core.config import get_settings
         from pathlib import Path
-        import json
         
         settings = get_settings()
         analyzer = HybridCADAnalyzer(
@@ -752,49 +761,58 @@ async def run_hybrid_analysis(conv_id: str, request: ChatRequest):
         
         all_analyses = []
         
-        for doc in cad_docs:
-            doc_id = doc['id']
-            png_path = f"cad_renders/{doc_id}_analysis.png"
-            
-            if not Path(png_path).exists():
-                logger.warning(f"PNG not found for {doc_id}, skipping")
-                continue
-            
-            logger.info(f"  Analyzing {doc['filename']} with {selected_model}")
+        try:
+            # CV features for all drawings at once, in worker processes
+            await asyncio.to_thread(
+                analyzer.prefetch_cv_features,
+                [f"cad_renders/{doc['id']}_analysis.png" for doc in cad_docs]
+            )
             
-            try:
-                # Determine if model supports vision
-                model_info = analyzer.llm_analyzer.MODELS.get(selected_model)
-                include_vision = model_info and 'vision' in model_info.get('capabilities', [])
-                
-                # Run hybrid analysis
-                result = await analyzer.analyze_with_cv_assistance(
-                    png_path,
-                    selected_model,
-                    include_vision=include_vision
-                )
+            for doc in cad_docs:
+                doc_id = doc['id']
+                png_path = f"cad_renders/{doc_id}_analysis.png"
                 
-                # Save analysis
-                analysis_file = f"cad_manifests/{doc_id}_hybrid_analysis.json"
-                with open(analysis_file, 'w') as f:
-                    json.dump(result, f, indent=2, default=str)
+                if not Path(png_path).exists():
+                    logger.warning(f"PNG not found for {doc_id}, skipping")
+                    continue
                 
-                all_analyses.append({
-                    "document_id": doc_id,
-                    "filename": doc['filename'],
-                    "analysis": result['combined_analysis'],
-                    "method": result['method'],
-                    "model_used": result['model_used'],
-                    "cv_summary": result['cv_features']['summary']
-                })
+                logger.info(f"  Analyzing {doc['filename']} with {selected_model}")
                 
-            except Exception as e:
-                logger.error(f"Analysis failed for {doc_id}: {e}")
-                all_analyses.append({
-                    "document_id": doc_id,
-                    "filename": doc['filename'],
-                    "error": str(e)
-                })
+                try:
+                    # Determine if model supports vision
+                    model_info = analyzer.llm_analyzer.MODELS.get(selected_model)
+                    include_vision = model_info and 'vision' in model_info.get('capabilities', [])
+                    
+                    # Run hybrid analysis
+                    result = await analyzer.analyze_with_cv_assistance(
+                        png_path,
+                        selected_model,
+                        include_vision=include_vision
+                    )
+                    
+                    # Save analysis
+                    analysis_file = f"cad_manifests/{doc_id}_hybrid_analysis.json"
+                    with open(analysis_file, 'wb') as f:
+                        f.write(orjson.dumps(result, default=str, option=ANALYSIS_JSON_OPTIONS))
+                    
+                    all_analyses.append({
+                        "document_id": doc_id,
+                        "filename": doc['filename'],
+                        "analysis": result['combined_analysis'],
+                        "method": result['method'],
+                        "model_used": result['model_used'],
+                        "cv_summary": result['cv_features']['summary']
+                    })
+                    
+                except Exception as e:
+                    logger.error(f"Analysis failed for {doc_id}: {e}")
+                    all_analyses.append({
+                        "document_id": doc_id,
+                        "filename": doc['filename'],
+                        "error": str(e)
+                    })
+        finally:
+            await analyzer.aclose()
         
         if not all_analyses:
             raise HTTPException(status_code=500, detail="All analyses failed")
@@ -4,23 +4,254 @@ Uses Gemini 2.5 Flash for superior vision capabilities
 """
 
 import os
+import asyncio
 import base64
+import functools
+import hashlib
 import json
+import random
+import re
+import multiprocessing
+import tempfile
+import threading
 import time
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple, Type
+import httpx
 from google import genai
 from google.genai import types
 from PIL import Image, ImageEnhance, ImageFilter
 import numpy as np
 from io import BytesIO
+from pydantic import BaseModel, ValidationError
+
+from app.cad.analysis_schemas import PASS_SCHEMAS, ConsolidatedAnalysis, render_markdown
+
+# Sampling parameters shared by the interactive and batch analysis paths
+PASS_GENERATION_CONFIG = {
+    'temperature': 0.4,
+    'top_p': 0.95,
+    'top_k': 40,
+    # Structured JSON answers are much denser than free-form Markdown
+    'max_output_tokens': 4096,
+}
+
+# One response carries every pass in consolidated mode
+CONSOLIDATED_GENERATION_CONFIG = {**PASS_GENERATION_CONFIG, 'max_output_tokens': 8192}
+
+# Static instructions shared verbatim by every analysis pass. Each pass prompt is
+# this preamble followed by a short task suffix, so the image + preamble prefix is
+# byte-identical across passes and can be served from Gemini's context cache.
+_COMMON_PREAMBLE = """You are a senior CAD drafter and design reviewer examining a single rendered CAD drawing.
+The drawing may be architectural, mechanical, electrical, civil, piping, or a mixture of
+disciplines. It was exported from a DXF/DWG file and rasterized, so thin lines, small text,
+and hatch patterns can look softer than on the original sheet.
+
+GENERAL RULES:
+- Describe only what is actually visible in the drawing. Do not invent dimensions, part
+  numbers, materials, or standards that you cannot read.
+- When something is partially legible, give your best reading and mark it as "(uncertain)".
+- When something is not present at all, say so in one short sentence instead of guessing.
+- Quote text, labels, and dimension values exactly as they appear, including units and
+  tolerance notation (for example "Ø12 H7", "R5", "150 ±0.1 mm", "SCALE 1:50").
+- Use standard drafting terminology (orthographic view, section, detail, datum, fillet,
+  chamfer, centerline, hidden line, title block, revision block, GD&T frame).
+- Prefer concrete counts and measurements over vague adjectives.
+- Do not repeat these instructions or restate the question in your answer.
+
+OUTPUT FORMAT:
+- Answer in the JSON structure defined by the response schema; the numbered items in the
+  task map onto its fields. Fill every field.
+- Keep each list entry to one fact. Use an empty list when nothing applies.
+- Put extracted values (dimensions, counts, labels) in backticks.
+- In the "confidence" field give High/Medium/Low and explain any limits of the
+  rendering, such as low resolution, clipped edges, or overlapping annotations.
+
+TASK:
+"""
+
+# Receives (pass_name, text_chunk) as pass output streams in
+ChunkCallback = Callable[[str, str], None]
+
+# Server-suggested delay in 429 messages, e.g. "Please retry in 12.5s"
+_RETRY_RE = re.compile(r'retry in (\d+(?:\.\d+)?)', re.IGNORECASE)
+
+# Base delay (seconds) for exponential backoff on rate limits without a server hint
+RETRY_BASE_DELAY = 5
+
+# Bump whenever pass prompts or generation settings change to invalidate cached results
+PROMPT_VERSION = '2'
+
+# Persistent per-pass result cache, keyed by image bytes + prompt + model
+ANALYSIS_CACHE_DIR = Path.home() / '.cache' / 'documind' / 'cad_analyses'
+
+# Batch job states that will not change any further
+BATCH_TERMINAL_STATES = {
+    'JOB_STATE_SUCCEEDED',
+    'JOB_STATE_FAILED',
+    'JOB_STATE_CANCELLED',
+    'JOB_STATE_EXPIRED',
+}
+
+def _new_client(api_key: str) -> genai.Client:
+    """Gemini client with a keepalive connection pool"""
+    limits = httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            client_args={'limits': limits},
+            async_client_args={'limits': limits}
+        )
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def _get_client(api_key: str) -> genai.Client:
+    """
+    Process-wide Gemini client per API key, for synchronous calls
+    Sharing one client keeps its HTTP connection pool (and TLS sessions) warm
+    across passes, analyzers and files instead of re-handshaking every time.
+    """
+    return _new_client(api_key)
+
+
+# Clients for async calls, per event loop and API key. httpx async connections
+# belong to the loop that opened them, and every asyncio.run() wrapper below runs a
+# new loop, so a pooled connection must never be reused on another loop.
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, genai.Client]]" = weakref.WeakKeyDictionary()
+_loop_clients_lock = threading.Lock()
+
+
+def _get_loop_client(api_key: str) -> genai.Client:
+    """Gemini client for api_key bound to the running event loop (dropped with the loop)"""
+    loop = asyncio.get_running_loop()
+    with _loop_clients_lock:
+        clients = _loop_clients.setdefault(loop, {})
+        client = clients.get(api_key)
+        if client is None:
+            client = clients[api_key] = _new_client(api_key)
+    return client
+
+
+def _load_downscaled(image_path: str, max_size: int = 4096) -> Image.Image:
+    """
+    Open an image already reduced to max_size on its longest side (Gemini's limit)
+    Downscaling happens before any enhancement or encoding so later steps touch
+    as few pixels as possible.
+    """
+    img = Image.open(image_path)
+    # JPEG sources decode directly at reduced resolution (no-op for other formats)
+    img.draft('RGB', (max_size, max_size))
+    
+    # Convert to RGB if needed
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    # In place; uses a cheap reducing pass before the final LANCZOS resample
+    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    return img
+
+
+def _is_achromatic(colors: Optional[List[Tuple[int, Tuple[int, int, int]]]], tolerance: int = 8) -> bool:
+    """True when every (count, rgb) entry from getcolors() is (near) gray"""
+    return colors is not None and all(max(rgb) - min(rgb) <= tolerance for _, rgb in colors)
+
+
+# One preprocessing pool for every analyzer in the process, started on first use
+_preprocess_pool: Optional[ProcessPoolExecutor] = None
+_preprocess_pool_lock = threading.Lock()
+
+
+def _get_preprocess_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by all analyzers for CPU-bound image preprocessing
+    Workers are spawned rather than forked: the server process runs threads
+    (uvicorn, loader pools), and forking a threaded process is unsafe.
+    """
+    global _preprocess_pool
+    with _preprocess_pool_lock:
+        if _preprocess_pool is None:
+            _preprocess_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn')
+            )
+        return _preprocess_pool
+
+
+def _encode_primary_image(image_path: str) -> Tuple[bytes, str]:
+    """Module-level so it can run in a ProcessPoolExecutor worker"""
+    img = _load_downscaled(image_path)
+    
+    original_buffer = BytesIO()
+    colors = img.getcolors(maxcolors=256)
+    is_line_art = colors is not None
+    if is_line_art:
+        # Monochrome line art loses nothing as a single 8-bit channel
+        if _is_achromatic(colors):
+            img = img.convert('L')
+        img.save(original_buffer, format='PNG', optimize=True)
+        mime_type = 'image/png'
+    else:
+        img.save(original_buffer, format='JPEG', quality=92, optimize=True, progressive=True)
+        mime_type = 'image/jpeg'
+    
+    return original_buffer.getvalue(), mime_type
+
+
+_HEADING_RE = re.compile(r'^\s*(#{1,6}\s|\*\*)')
+_LIST_ITEM_RE = re.compile(r'^\s*([-*+]|\d+[.)])\s')
+
+
+def _truncate(text: str, limit: int) -> str:
+    """Cut text to about limit chars, preferring a line break, then a word break"""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    idx = cut.rfind("\n")
+    if idx < limit // 2:
+        idx = cut.rfind(" ")
+    return (cut[:idx] if idx > 0 else cut).rstrip() + " …"
+
+
+def _compress(text: str, max_chars: int = 1500, max_items: int = 20, section_chars: int = 600) -> str:
+    """
+    Heuristically shrink one pass analysis before it is fed into synthesis
+    Keeps every heading, drops list items beyond the first max_items per section,
+    truncates long sections and finally caps the whole text at max_chars.
+    """
+    sections: List[List[str]] = [[]]
+    for line in text.splitlines():
+        if _HEADING_RE.match(line) and sections[-1]:
+            sections.append([])
+        sections[-1].append(line)
+    
+    compressed = []
+    for section in sections:
+        kept, items = [], 0
+        for line in section:
+            if _LIST_ITEM_RE.match(line):
+                items += 1
+                if items > max_items:
+                    continue
+            kept.append(line)
+        
+        body = _truncate("\n".join(kept).strip(), section_chars)
+        if body:
+            compressed.append(body)
+    
+    return _truncate("\n".join(compressed), max_chars)
+
 
 class AdvancedCADVisualAnalyzer:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, max_workers: int = 5):
         """Initialize with Gemini 2.5 Flash (best available)"""
-        self.client = genai.Client(api_key=api_key)
+        self.api_key = api_key
+        self.client = _get_client(api_key)
         # Use Gemini 2.5 Flash - superior model with good quota
         self.model_id = 'gemini-2.5-flash'
+        # Number of analysis passes dispatched concurrently
+        self.max_workers = max_workers
         
         # Multi-pass analysis configuration
         self.analysis_passes = {
@@ -31,8 +262,13 @@ class AdvancedCADVisualAnalyzer:
             'quality': self._get_quality_prompt()
         }
         
+    @property
+    def _aio(self):
+        """Async Gemini API of the client bound to the running event loop"""
+        return _get_loop_client(self.api_key).aio
+
     def _get_overview_prompt(self) -> str:
-        return """Analyze this CAD drawing and provide a comprehensive overview:
+        return _COMMON_PREAMBLE + """Analyze this CAD drawing and provide a comprehensive overview:
 
 1. **Drawing Type & Purpose**: What type of drawing is this (architectural, mechanical, electrical, civil, etc.)? What is its primary purpose?
 
@@ -47,7 +283,7 @@ class AdvancedCADVisualAnalyzer:
 Be detailed and specific. Use technical terminology where appropriate."""
 
     def _get_technical_prompt(self) -> str:
-        return """Provide a detailed technical analysis of this CAD drawing:
+        return _COMMON_PREAMBLE + """Provide a detailed technical analysis of this CAD drawing:
 
 1. **Dimensions & Scale**: 
    - Identify all visible dimensions and their units
@@ -75,7 +311,7 @@ Be detailed and specific. Use technical terminology where appropriate."""
 Be extremely thorough and technical."""
 
     def _get_components_prompt(self) -> str:
-        return """Analyze the components and features in this CAD drawing:
+        return _COMMON_PREAMBLE + """Analyze the components and features in this CAD drawing:
 
 1. **Component Inventory**:
    - List every distinct component, part, or feature
@@ -105,7 +341,7 @@ Be extremely thorough and technical."""
 Provide a complete inventory with technical details."""
 
     def _get_measurements_prompt(self) -> str:
-        return """Extract and analyze all measurements and specifications:
+        return _COMMON_PREAMBLE + """Extract and analyze all measurements and specifications:
 
 1. **Dimensional Data**:
    - Extract ALL numerical dimensions with their units
@@ -135,7 +371,7 @@ Provide a complete inventory with technical details."""
 Create a comprehensive dimensional database from this drawing."""
 
     def _get_quality_prompt(self) -> str:
-        return """Assess the quality and completeness of this CAD drawing:
+        return _COMMON_PREAMBLE + """Assess the quality and completeness of this CAD drawing:
 
 1. **Drawing Clarity**:
    - Rate line clarity and visibility (1-10)
@@ -165,59 +401,55 @@ Create a comprehensive dimensional database from this drawing."""
 
 Provide a professional quality assessment."""
 
-    def preprocess_image(self, image_path: str) -> List[Tuple[bytes, str]]:
+    def preprocess_image(self, image_path: str) -> Tuple[bytes, str]:
         """
-        Create multiple preprocessed versions of the image for better analysis
+        Prepare the primary high-resolution image sent to Gemini
+        Line art (few distinct colors) stays lossless PNG so thin lines and small
+        text survive; anything photographic is sent as a much smaller JPEG.
+        Returns (image_bytes, mime_type)
+        """
+        return _encode_primary_image(image_path)
+
+    def preprocess_image_async(self, image_path: str) -> Future:
+        """
+        Run preprocess_image in the shared worker process pool
+        PIL's resample/encode holds the GIL, so a process pool lets preprocessing
+        of the next drawing overlap with network-bound Gemini calls for this one.
+        The pool is module-level, so short-lived analyzers don't each start one.
+        """
+        return _get_preprocess_pool().submit(_encode_primary_image, image_path)
+
+    def preprocess_image_variants(self, image_path: str) -> List[Tuple[bytes, str]]:
+        """
+        Create additional enhanced versions of the image for multi-variant analysis
+        Only needed when a pass consumes them; the default pipeline sends just the
+        primary image from preprocess_image()
         Returns list of (image_bytes, description) tuples
         """
-        img = Image.open(image_path)
+        img = _load_downscaled(image_path)
         
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
+        colors = img.getcolors(maxcolors=256)
+        if _is_achromatic(colors):
+            img = img.convert('L')
         
         versions = []
         
-        # 1. Original high-resolution
-        original_buffer = BytesIO()
-        # Resize if too large (max 4096px on longest side for Gemini)
-        max_size = 4096
-        if max(img.size) > max_size:
-            ratio = max_size / max(img.size)
-            new_size = tuple(int(dim * ratio) for dim in img.size)
-            img_resized = img.resize(new_size, Image.Resampling.LANCZOS)
-            img_resized.save(original_buffer, format='PNG', quality=95)
-        else:
-            img.save(original_buffer, format='PNG', quality=95)
-        
-        versions.append((
-            original_buffer.getvalue(),
-            "original_high_resolution"
-        ))
-        
-        # 2. Enhanced contrast version (better for faint lines)
-        enhancer = ImageEnhance.Contrast(img)
-        enhanced = enhancer.enhance(2.0)
-        enhanced_buffer = BytesIO()
-        if max(enhanced.size) > max_size:
-            ratio = max_size / max(enhanced.size)
-            new_size = tuple(int(dim * ratio) for dim in enhanced.size)
-            enhanced = enhanced.resize(new_size, Image.Resampling.LANCZOS)
-        enhanced.save(enhanced_buffer, format='PNG', quality=95)
-        
-        versions.append((
-            enhanced_buffer.getvalue(),
-            "enhanced_contrast"
-        ))
+        # 1. Enhanced contrast version (better for faint lines);
+        # pure two-tone drawings are already at full contrast
+        if colors is None or len(colors) > 2:
+            enhanced = ImageEnhance.Contrast(img).enhance(2.0)
+            enhanced_buffer = BytesIO()
+            enhanced.save(enhanced_buffer, format='PNG')
+            
+            versions.append((
+                enhanced_buffer.getvalue(),
+                "enhanced_contrast"
+            ))
         
-        # 3. Sharpened version (better for text and fine details)
+        # 2. Sharpened version (better for text and fine details)
         sharpened = img.filter(ImageFilter.SHARPEN)
         sharp_buffer = BytesIO()
-        if max(sharpened.size) > max_size:
-            ratio = max_size / max(sharpened.size)
-            new_size = tuple(int(dim * ratio) for dim in sharpened.size)
-            sharpened = sharpened.resize(new_size, Image.Resampling.LANCZOS)
-        sharpened.save(sharp_buffer, format='PNG', quality=95)
+        sharpened.save(sharp_buffer, format='PNG')
         
         versions.append((
             sharp_buffer.getvalue(),
@@ -226,37 +458,155 @@ Provide a professional quality assessment."""
         
         return versions
 
-    def analyze_single_pass(self, image_bytes: bytes, prompt: str, pass_name: str, retry_count: int = 3) -> Dict:
-        """Perform a single analysis pass with retry logic and rate limit handling"""
+    def _split_prompt(self, prompt: str) -> Tuple[Optional[str], str]:
+        """Split a pass prompt into (shared preamble, task suffix)"""
+        if prompt.startswith(_COMMON_PREAMBLE):
+            return _COMMON_PREAMBLE, prompt[len(_COMMON_PREAMBLE):]
+        return None, prompt
+
+    async def _upload_image(self, image_bytes: bytes, mime_type: str = 'image/png') -> Optional[types.File]:
+        """
+        Upload the image once via the Files API so passes can reference it by URI
+        Returns the uploaded file, or None to fall back to inline image bytes
+        """
+        try:
+            return await self._aio.files.upload(
+                file=BytesIO(image_bytes),
+                config=types.UploadFileConfig(mime_type=mime_type)
+            )
+        except Exception as e:
+            print(f"   ℹ️  Files API upload failed ({str(e)[:80]}), sending image inline")
+            return None
+
+    @staticmethod
+    def _image_part(image_bytes: bytes, mime_type: str, file_ref: Optional[types.File] = None) -> types.Part:
+        """Reference the uploaded file when available, otherwise inline the bytes"""
+        if file_ref is not None:
+            return types.Part.from_uri(file_uri=file_ref.uri, mime_type=mime_type)
+        return types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+
+    async def _create_pass_cache(self, image_bytes: bytes, mime_type: str = 'image/png',
+                                 file_ref: Optional[types.File] = None) -> Optional[str]:
+        """
+        Explicitly cache the image + shared preamble for the passes of one drawing
+        Returns the cache name, or None to fall back to implicit prefix caching
+        (e.g. when the prefix is below the model's minimum cacheable token count)
+        """
+        try:
+            cache = await self._aio.caches.create(
+                model=self.model_id,
+                config=types.CreateCachedContentConfig(
+                    contents=[types.Content(role='user', parts=[
+                        self._image_part(image_bytes, mime_type, file_ref),
+                        types.Part.from_text(text=_COMMON_PREAMBLE)
+                    ])],
+                    ttl='600s'
+                )
+            )
+            return cache.name
+        except Exception as e:
+            print(f"   ℹ️  Explicit context cache unavailable ({str(e)[:80]}), using implicit caching")
+            return None
+
+    def _pass_cache_path(self, image_bytes: bytes, prompt: str) -> Path:
+        """On-disk cache location for one (image, prompt, model) pass result"""
+        key = hashlib.sha256(
+            image_bytes + prompt.encode() + self.model_id.encode() + PROMPT_VERSION.encode()
+        ).hexdigest()
+        return ANALYSIS_CACHE_DIR / f"{key}.json"
+
+    def _load_cached_pass(self, cache_path: Path) -> Optional[Dict]:
+        try:
+            with open(cache_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store_cached_pass(self, cache_path: Path, result: Dict):
+        """Atomically write a pass result (tmp file + os.replace)"""
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"   ⚠️  Could not write analysis cache: {e}")
+
+    async def analyze_single_pass(self, image_bytes: bytes, prompt: str, pass_name: str, retry_count: int = 3,
+                            cached_content: Optional[str] = None, use_cache: bool = True,
+                            response_schema: Optional[Type[BaseModel]] = None,
+                            generation_config: Optional[Dict] = None,
+                            mime_type: str = 'image/png',
+                            file_ref: Optional[types.File] = None,
+                            on_chunk: Optional[ChunkCallback] = None) -> Dict:
+        """
+        Perform a single analysis pass with retry logic and rate limit handling
+        When response_schema is given the model answers in JSON mode, the answer is
+        kept under result['structured'] and result['analysis'] holds it rendered
+        as Markdown (chunks passed to on_chunk are then raw JSON fragments); when
+        file_ref is given the image is referenced by its Files API URI instead
+        of being sent inline (image_bytes is still used as the disk-cache key).
+        The response is streamed and each text chunk is forwarded to on_chunk.
+        """
+        
+        cache_path = self._pass_cache_path(image_bytes, prompt) if use_cache else None
+        if cache_path:
+            cached = self._load_cached_pass(cache_path)
+            if cached:
+                if on_chunk and cached['success']:
+                    on_chunk(pass_name, cached['analysis'])
+                return cached
+        
+        preamble, task = self._split_prompt(prompt)
         
         for attempt in range(retry_count):
             try:
-                # Create Parts
-                image_part = types.Part.from_bytes(
-                    data=image_bytes,
-                    mime_type='image/png'
-                )
+                config = types.GenerateContentConfig(**(generation_config or PASS_GENERATION_CONFIG))
+                if response_schema is not None:
+                    config.response_mime_type = 'application/json'
+                    config.response_schema = response_schema
                 
-                text_part = types.Part.from_text(text=prompt)
+                if cached_content and preamble:
+                    # Image + preamble already live in the explicit cache
+                    config.cached_content = cached_content
+                    contents = [types.Part.from_text(text=task)]
+                else:
+                    # Image first, then the byte-identical preamble, then the task,
+                    # so consecutive passes share the longest possible prefix
+                    contents = [self._image_part(image_bytes, mime_type, file_ref)]
+                    if preamble:
+                        contents.append(types.Part.from_text(text=preamble))
+                    contents.append(types.Part.from_text(text=task))
                 
-                # Generate content with both parts
-                response = self.client.models.generate_content(
+                chunks = []
+                async for chunk in await self._aio.models.generate_content_stream(
                     model=self.model_id,
-                    contents=[image_part, text_part],
-                    config=types.GenerateContentConfig(
-                        temperature=0.4,
-                        top_p=0.95,
-                        top_k=40,
-                        max_output_tokens=8192,
-                    )
-                )
+                    contents=contents,
+                    config=config
+                ):
+                    if chunk.text:
+                        chunks.append(chunk.text)
+                        if on_chunk:
+                            on_chunk(pass_name, chunk.text)
                 
-                return {
+                result = {
                     'pass_name': pass_name,
                     'success': True,
-                    'analysis': response.text,
+                    'analysis': ''.join(chunks),
+                    'structured': None,
                     'error': None
                 }
+                if response_schema is not None:
+                    try:
+                        result['structured'] = response_schema.model_validate_json(result['analysis']).model_dump()
+                        result['analysis'] = render_markdown(result['structured'])
+                    except ValidationError as e:
+                        # e.g. truncated at max_output_tokens; keep the raw text for RAG
+                        print(f"   ⚠️  {pass_name} returned invalid structured output: {str(e)[:80]}")
+                if cache_path:
+                    self._store_cached_pass(cache_path, result)
+                return result
                 
             except Exception as e:
                 error_msg = str(e)
@@ -264,20 +614,19 @@ Provide a professional quality assessment."""
                 # Check if rate limit error
                 if '429' in error_msg or 'RESOURCE_EXHAUSTED' in error_msg:
                     if attempt < retry_count - 1:
-                        # Extract retry delay if available
-                        wait_time = 10  # shorter default for 2.5-flash
-                        if 'retry in' in error_msg.lower():
+                        # Exponential backoff unless the server tells us how long to wait
+                        wait_time = min(60, 2 ** attempt * RETRY_BASE_DELAY)
+                        match = _RETRY_RE.search(error_msg)
+                        if match:
                             try:
-                                # Try to parse delay
-                                import re
-                                match = re.search(r'retry in (\d+(?:\.\d+)?)', error_msg.lower())
-                                if match:
-                                    wait_time = min(float(match.group(1)), 60)  # cap at 60s
-                            except:
+                                wait_time = min(float(match.group(1)), 60)  # cap at 60s
+                            except ValueError:
                                 pass
                         
+                        # Jitter so concurrent passes don't retry in lockstep
+                        wait_time += random.uniform(0, wait_time * 0.25)
                         print(f"   ⏸️  Rate limit hit, waiting {wait_time:.0f}s before retry...")
-                        time.sleep(wait_time)
+                        await asyncio.sleep(wait_time)
                         continue
                 
                 return {
@@ -294,69 +643,382 @@ Provide a professional quality assessment."""
             'error': f'Failed after {retry_count} attempts'
         }
 
-    def comprehensive_analysis(self, png_path: str) -> Dict:
+    def _get_consolidated_prompt(self) -> str:
+        """Single prompt covering every pass rubric, answered as one JSON object"""
+        keys = ", ".join(f"'{name}'" for name in self.analysis_passes)
+        rubrics = "\n\n".join(
+            f"=== {name.upper()} ===\n{self._split_prompt(prompt)[1]}"
+            for name, prompt in self.analysis_passes.items()
+        )
+        return _COMMON_PREAMBLE + f"""Return a single JSON object with keys {keys}.
+Each value answers the matching rubric below using that key's fields in the schema.
+Do not repeat information across keys; reference the relevant section instead.
+
+{rubrics}"""
+
+    async def _run_passes(self, primary_image: bytes, mime_type: str, cache: bool,
+                          on_chunk: Optional[ChunkCallback] = None) -> Dict[str, Dict]:
+        """Run every analysis pass concurrently, returning results by pass name"""
+        # Perform all analysis passes concurrently (I/O-bound, independent).
+        # Rate-limit contention is handled by the 429 retry in analyze_single_pass.
+        total_passes = len(self.analysis_passes)
+        print(f"🎯 Dispatching {total_passes} analysis passes (up to {self.max_workers} in flight)...")
+        
+        # Only pay for an explicit context cache if some pass actually needs the API
+        all_cached = cache and all(
+            self._pass_cache_path(primary_image, prompt).exists()
+            for prompt in self.analysis_passes.values()
+        )
+        # Upload the image once and reference it by URI from the cache or every pass
+        file_ref = None if all_cached else await self._upload_image(primary_image, mime_type)
+        cache_name = None if all_cached else await self._create_pass_cache(primary_image, mime_type, file_ref)
+        
+        semaphore = asyncio.Semaphore(self.max_workers)
+        
+        async def run_pass(pass_name: str, prompt: str) -> Dict:
+            async with semaphore:
+                result = await self.analyze_single_pass(
+                    primary_image, prompt, pass_name,
+                    cached_content=cache_name, use_cache=cache, mime_type=mime_type,
+                    response_schema=PASS_SCHEMAS.get(pass_name),
+                    file_ref=file_ref, on_chunk=on_chunk
+                )
+            if result['success']:
+                print(f"   ✅ {pass_name} complete ({len(result['analysis'])} chars)")
+            else:
+                print(f"   ❌ {pass_name} failed: {result['error'][:100]}...")
+            return result
+        
+        try:
+            results = await asyncio.gather(*(
+                run_pass(pass_name, prompt)
+                for pass_name, prompt in self.analysis_passes.items()
+            ))
+        finally:
+            if cache_name:
+                try:
+                    await self._aio.caches.delete(name=cache_name)
+                except Exception:
+                    pass  # expires on its own after the TTL
+            if file_ref is not None:
+                try:
+                    await self._aio.files.delete(name=file_ref.name)
+                except Exception:
+                    pass  # uploaded files expire after 48 hours
+        
+        return {result['pass_name']: result for result in results}
+
+    async def _run_consolidated(self, primary_image: bytes, mime_type: str, cache: bool) -> Dict[str, Dict]:
+        """Answer every pass rubric with one JSON-mode call, split back into pass results"""
+        print("🎯 Running consolidated single-call analysis...")
+        
+        result = await self.analyze_single_pass(
+            primary_image, self._get_consolidated_prompt(), 'consolidated',
+            use_cache=cache, response_schema=ConsolidatedAnalysis,
+            generation_config=CONSOLIDATED_GENERATION_CONFIG, mime_type=mime_type
+        )
+        
+        sections = result.get('structured') or {}
+        error = result['error']
+        if result['success'] and not sections:
+            error = "Invalid JSON in consolidated response"
+        
+        pass_results = {}
+        for pass_name in self.analysis_passes:
+            structured = sections.get(pass_name)
+            if structured:
+                content = render_markdown(structured)
+                pass_results[pass_name] = {
+                    'pass_name': pass_name, 'success': True, 'analysis': content,
+                    'structured': structured, 'error': None
+                }
+                print(f"   ✅ {pass_name} complete ({len(content)} chars)")
+            else:
+                pass_results[pass_name] = {
+                    'pass_name': pass_name, 'success': False, 'analysis': None,
+                    'error': error or 'Missing from consolidated response'
+                }
+        
+        return pass_results
+
+    def comprehensive_analysis(self, png_path: str, cache: bool = True, mode: str = 'passes',
+                               on_chunk: Optional[ChunkCallback] = None) -> Dict:
+        """
+        Synchronous wrapper around comprehensive_analysis_async()
+        Must not be called from inside a running event loop; async callers
+        should await comprehensive_analysis_async() directly.
+        """
+        return asyncio.run(self.comprehensive_analysis_async(png_path, cache=cache, mode=mode, on_chunk=on_chunk))
+
+    async def comprehensive_analysis_async(self, png_path: str, cache: bool = True, mode: str = 'passes',
+                                           on_chunk: Optional[ChunkCallback] = None) -> Dict:
         """
         Perform comprehensive multi-pass analysis
         Returns structured analysis results
+        
+        Pass results are cached on disk by image content, prompt and model, so
+        re-analyzing an identical render costs no API calls. Set cache=False to
+        force fresh analysis.
+        
+        mode='passes' sends one request per analysis pass; mode='consolidated'
+        asks for all passes in a single JSON response (one round trip, one image
+        upload). The per-pass mode is kept for quality comparison.
+        
+        on_chunk, if given, is called with (pass_name, text) as each pass
+        streams in, so callers can show partial output before all passes finish.
         """
+        if mode not in ('passes', 'consolidated'):
+            raise ValueError(f"Unknown analysis mode: {mode}")
+        
         print(f"\n🔍 Starting comprehensive CAD analysis...")
         print(f"📊 Model: {self.model_id}")
         
-        # Preprocess image into multiple versions
-        print("📸 Preprocessing image (creating enhanced versions)...")
-        image_versions = self.preprocess_image(png_path)
+        print("📸 Preprocessing image...")
+        primary_image, mime_type = await asyncio.wrap_future(self.preprocess_image_async(png_path))
+        
+        return await self._analyze_preprocessed(png_path, primary_image, mime_type, cache, mode, on_chunk)
+
+    def comprehensive_analysis_many(self, png_paths: List[str], cache: bool = True, mode: str = 'passes') -> Dict[str, Dict]:
+        """
+        Analyze several drawings interactively, pipelining preprocessing
+        All preprocessing jobs are submitted to the process pool up front and each
+        one is awaited just before its drawing's Gemini passes are dispatched.
+        
+        Returns:
+            Mapping of png_path to comprehensive_analysis() results
+        """
+        if mode not in ('passes', 'consolidated'):
+            raise ValueError(f"Unknown analysis mode: {mode}")
         
-        # Use the original high-res version for analysis
-        primary_image = image_versions[0][0]
+        async def run_all() -> Dict[str, Dict]:
+            preprocessed = {
+                png_path: asyncio.wrap_future(self.preprocess_image_async(png_path))
+                for png_path in png_paths
+            }
+            
+            all_results = {}
+            for png_path, future in preprocessed.items():
+                print(f"\n🔍 Starting comprehensive CAD analysis of {Path(png_path).name}...")
+                primary_image, mime_type = await future
+                all_results[png_path] = await self._analyze_preprocessed(
+                    png_path, primary_image, mime_type, cache, mode
+                )
+            return all_results
         
+        return asyncio.run(run_all())
+
+    async def _analyze_preprocessed(self, png_path: str, primary_image: bytes, mime_type: str,
+                                    cache: bool, mode: str,
+                                    on_chunk: Optional[ChunkCallback] = None) -> Dict:
+        """Run the analysis passes and synthesis for an already preprocessed image"""
         results = {
             'image_path': png_path,
             'model_used': self.model_id,
+            'mode': mode,
             'preprocessing': {
-                'versions_created': len(image_versions),
-                'version_types': [v[1] for v in image_versions]
+                'versions_created': 1,
+                'version_types': ['original_high_resolution']
             },
             'analyses': {},
+            'structured': {},
             'summary': {},
             'errors': []
         }
         
-        # Perform each analysis pass
-        total_passes = len(self.analysis_passes)
-        for idx, (pass_name, prompt) in enumerate(self.analysis_passes.items(), 1):
-            print(f"🎯 Pass {idx}/{total_passes}: {pass_name.upper()} analysis...")
-            
-            result = self.analyze_single_pass(primary_image, prompt, pass_name)
-            
+        if mode == 'consolidated':
+            pass_results = await self._run_consolidated(primary_image, mime_type, cache)
+        else:
+            pass_results = await self._run_passes(primary_image, mime_type, cache, on_chunk)
+        
+        # Collect in pass order so downstream formatting stays deterministic
+        for pass_name in self.analysis_passes:
+            result = pass_results[pass_name]
             if result['success']:
                 results['analyses'][pass_name] = result['analysis']
-                print(f"   ✅ {pass_name} complete ({len(result['analysis'])} chars)")
+                if result.get('structured'):
+                    results['structured'][pass_name] = result['structured']
             else:
                 results['errors'].append({
                     'pass': pass_name,
                     'error': result['error']
                 })
-                print(f"   ❌ {pass_name} failed: {result['error'][:100]}...")
-            
-            # Small delay between passes to avoid rate limiting
-            if idx < total_passes:
-                time.sleep(1)
         
         # Generate final synthesis
         if len(results['analyses']) > 0:
             print("🔄 Generating synthesis...")
-            results['summary'] = self._generate_synthesis(results['analyses'])
+            results['summary'] = await self._generate_synthesis_async(results['analyses'])
         
         print(f"✨ Analysis complete! Generated {len(results['analyses'])} detailed analyses.\n")
         
         return results
 
-    def _generate_synthesis(self, analyses: Dict[str, str]) -> Dict:
-        """Generate a synthesis of all analysis passes"""
+    def comprehensive_analysis_batch(self, png_paths: List[str], poll_interval: float = 30.0) -> Dict[str, Dict]:
+        """
+        Run every analysis pass for several drawings as one Gemini Batch Mode job
+        
+        Batch jobs are billed at half the interactive rate and are not subject to
+        the synchronous rate limits, at the cost of higher (non-interactive) latency.
+        
+        Args:
+            png_paths: Paths to PNG renders of CAD drawings
+            poll_interval: Seconds between job status checks
+            
+        Returns:
+            Mapping of png_path to a results dict shaped like comprehensive_analysis()
+        """
+        print(f"\n📦 Starting batch CAD analysis for {len(png_paths)} drawing(s)...")
+        print(f"📊 Model: {self.model_id}")
+        
+        all_results = {}
+        request_keys = {}
+        image_files = []
         
-        # Combine all analyses
+        # Preprocess every input in parallel while the JSONL is being written
+        preprocessed = [self.preprocess_image_async(png_path) for png_path in png_paths]
+        
+        # One JSONL line per (image, pass) pair across all inputs
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as jsonl_file:
+            jsonl_path = jsonl_file.name
+            for image_idx, png_path in enumerate(png_paths):
+                image_bytes, mime_type = preprocessed[image_idx].result()
+                image_part, file_name = self._batch_image_part(image_bytes, mime_type)
+                if file_name:
+                    image_files.append(file_name)
+                
+                all_results[png_path] = {
+                    'image_path': png_path,
+                    'model_used': self.model_id,
+                    'preprocessing': {
+                        'versions_created': 1,
+                        'version_types': ['original_high_resolution']
+                    },
+                    'analyses': {},
+                    'structured': {},
+                    'summary': {},
+                    'errors': []
+                }
+                
+                for pass_name, prompt in self.analysis_passes.items():
+                    # Index prefix keeps keys unique when two inputs share a stem
+                    key = f"{image_idx}_{Path(png_path).stem}_{pass_name}"
+                    request_keys[key] = (png_path, pass_name)
+                    jsonl_file.write(json.dumps({
+                        'key': key,
+                        'request': {
+                            'contents': [{
+                                'parts': [
+                                    image_part,
+                                    {'text': prompt}
+                                ]
+                            }],
+                            'generation_config': {
+                                **PASS_GENERATION_CONFIG,
+                                'response_mime_type': 'application/json',
+                                'response_json_schema': PASS_SCHEMAS[pass_name].model_json_schema()
+                            }
+                        }
+                    }) + "\n")
+        
+        try:
+            uploaded = self.client.files.upload(
+                file=jsonl_path,
+                config=types.UploadFileConfig(mime_type='jsonl')
+            )
+        finally:
+            os.remove(jsonl_path)
+        
+        job = self.client.batches.create(model=self.model_id, src=uploaded.name)
+        print(f"🚀 Batch job submitted: {job.name} ({len(request_keys)} requests)")
+        
+        while job.state.name not in BATCH_TERMINAL_STATES:
+            time.sleep(poll_interval)
+            job = self.client.batches.get(name=job.name)
+        
+        for file_name in image_files:
+            try:
+                self.client.files.delete(name=file_name)
+            except Exception:
+                pass  # uploaded files expire after 48 hours
+        
+        if job.state.name != 'JOB_STATE_SUCCEEDED':
+            error = f"Batch job {job.name} ended in state {job.state.name}"
+            print(f"❌ {error}")
+            for results in all_results.values():
+                results['errors'].append({'pass': 'batch', 'error': error})
+            return all_results
+        
+        # Demultiplex the output file back into per-image results
+        output = self.client.files.download(file=job.dest.file_name).decode('utf-8')
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get('key') not in request_keys:
+                continue
+            png_path, pass_name = request_keys[item['key']]
+            
+            try:
+                parts = item['response']['candidates'][0]['content']['parts']
+                text = "".join(part.get('text', '') for part in parts)
+            except (KeyError, IndexError, TypeError):
+                all_results[png_path]['errors'].append({
+                    'pass': pass_name,
+                    'error': str(item.get('error', 'Empty batch response'))
+                })
+                continue
+            
+            try:
+                structured = PASS_SCHEMAS[pass_name].model_validate_json(text).model_dump()
+                all_results[png_path]['structured'][pass_name] = structured
+                text = render_markdown(structured)
+            except ValidationError as e:
+                print(f"   ⚠️  {pass_name} returned invalid structured output: {str(e)[:80]}")
+            
+            all_results[png_path]['analyses'][pass_name] = text
+        
+        for png_path, results in all_results.items():
+            failed_passes = {err['pass'] for err in results['errors']}
+            for pass_name in self.analysis_passes:
+                if pass_name not in results['analyses'] and pass_name not in failed_passes:
+                    results['errors'].append({'pass': pass_name, 'error': 'Missing from batch output'})
+
+            # Restore pass order for deterministic formatting
+            results['analyses'] = {
+                name: results['analyses'][name]
+                for name in self.analysis_passes
+                if name in results['analyses']
+            }
+            if len(results['analyses']) > 0:
+                print(f"🔄 Generating synthesis for {Path(png_path).name}...")
+                results['summary'] = self._generate_synthesis(results['analyses'])
+        
+        print(f"✨ Batch analysis complete for {len(all_results)} drawing(s).\n")
+        
+        return all_results
+
+    def _batch_image_part(self, image_bytes: bytes, mime_type: str) -> Tuple[Dict, Optional[str]]:
+        """
+        Upload one image for a batch job and reference it from every pass line
+        Keeps the JSONL free of base64 copies; falls back to inline data on failure
+        Returns (request part, uploaded file name or None)
+        """
+        try:
+            uploaded = self.client.files.upload(
+                file=BytesIO(image_bytes),
+                config=types.UploadFileConfig(mime_type=mime_type)
+            )
+            return {'file_data': {'file_uri': uploaded.uri, 'mime_type': mime_type}}, uploaded.name
+        except Exception as e:
+            print(f"   ℹ️  Files API upload failed ({str(e)[:80]}), inlining image in batch requests")
+            return {'inline_data': {'mime_type': mime_type, 'data': base64.b64encode(image_bytes).decode('utf-8')}}, None
+
+    def _build_synthesis_prompt(self, analyses: Dict[str, str]) -> Tuple[str, int]:
+        """Build the synthesis prompt; returns (prompt, combined analysis length)"""
+        
+        # Combine compressed analyses; the full text stays available for RAG
+        combined_length = sum(len(content) for content in analyses.values())
         combined_text = "\n\n".join([
-            f"=== {name.upper()} ===\n{content}"
+            f"=== {name.upper()} ===\n{_compress(content)}"
             for name, content in analyses.items()
         ])
         
@@ -373,21 +1035,43 @@ Provide:
 
 Be concise but complete. This should be the "executive briefing" on this drawing."""
 
-        try:
-            text_part = types.Part.from_text(text=synthesis_prompt)
-            
-            response = self.client.models.generate_content(
-                model=self.model_id,
-                contents=[text_part],
-                config=types.GenerateContentConfig(
-                    temperature=0.3,
-                    max_output_tokens=2048,
-                )
+        return synthesis_prompt, combined_length
+
+    def _synthesis_request(self, synthesis_prompt: str) -> Dict:
+        return {
+            'model': self.model_id,
+            'contents': [types.Part.from_text(text=synthesis_prompt)],
+            'config': types.GenerateContentConfig(
+                temperature=0.3,
+                max_output_tokens=2048,
             )
-            
+        }
+
+    def _generate_synthesis(self, analyses: Dict[str, str]) -> Dict:
+        """Generate a synthesis of all analysis passes (blocking; used by batch mode)"""
+        synthesis_prompt, combined_length = self._build_synthesis_prompt(analyses)
+        try:
+            response = self.client.models.generate_content(**self._synthesis_request(synthesis_prompt))
             return {
                 'executive_summary': response.text,
-                'total_analysis_length': len(combined_text),
+                'total_analysis_length': combined_length,
+                'synthesis_success': True
+            }
+        except Exception as e:
+            return {
+                'executive_summary': 'Synthesis generation failed',
+                'error': str(e),
+                'synthesis_success': False
+            }
+
+    async def _generate_synthesis_async(self, analyses: Dict[str, str]) -> Dict:
+        """Generate a synthesis of all analysis passes"""
+        synthesis_prompt, combined_length = self._build_synthesis_prompt(analyses)
+        try:
+            response = await self._aio.models.generate_content(**self._synthesis_request(synthesis_prompt))
+            return {
+                'executive_summary': response.text,
+                'total_analysis_length': combined_length,
                 'synthesis_success': True
             }
         except Exception as e:
@@ -442,18 +1126,125 @@ Be concise but complete. This should be the "executive briefing" on this drawing
         return "\n".join(formatted)
 
 
-def analyze_cad_drawing(png_path: str, api_key: str) -> Dict:
+class BatchDispatcher:
+    """
+    Coalesces concurrent analysis requests into batch jobs
+    
+    Requests queue up until either max_batch_size is reached or max_wait has
+    elapsed since the first one arrived. Batching is eager: when the previous
+    batch finishes, whatever has accumulated is dispatched straight away
+    regardless of fill level.
+    """
+    
+    def __init__(self, analyzer: AdvancedCADVisualAnalyzer, max_batch_size: int = 16, max_wait: float = 0.1):
+        self.analyzer = analyzer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def submit(self, png_path: str) -> Dict:
+        """Queue a drawing for analysis and wait for its results"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((png_path, future))
+        return await future
+    
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        """Block for the first request, then gather more until full or timed out"""
+        batch = [await self._queue.get()]
+        
+        # Eager path: requests that piled up during the previous batch go out now
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if len(batch) > 1:
+            return batch
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            png_paths = list(dict.fromkeys(path for path, _ in batch))
+            
+            try:
+                all_results = await asyncio.to_thread(
+                    self.analyzer.comprehensive_analysis_batch, png_paths
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for png_path, future in batch:
+                if not future.done():
+                    future.set_result(all_results[png_path])
+
+
+_dispatchers: Dict[str, BatchDispatcher] = {}
+
+# Process-wide analyzers by API key, for request handlers
+_analyzers: Dict[str, AdvancedCADVisualAnalyzer] = {}
+
+
+def get_analyzer(api_key: str) -> AdvancedCADVisualAnalyzer:
+    """Shared analyzer for api_key, so request handlers don't build one per call"""
+    analyzer = _analyzers.get(api_key)
+    if analyzer is None:
+        analyzer = _analyzers.setdefault(api_key, AdvancedCADVisualAnalyzer(api_key))
+    return analyzer
+
+
+async def submit_cad_drawing(png_path: str, api_key: str) -> Dict:
+    """
+    Batched entry point for advanced CAD analysis
+    
+    Concurrent callers sharing an API key are coalesced into batch jobs by a
+    process-wide BatchDispatcher. Batch jobs are polled until done, so this suits
+    bulk or offline re-analysis; interactive handlers should use get_analyzer().
+    
+    Args:
+        png_path: Path to PNG render of CAD drawing
+        api_key: Google AI API key
+        
+    Returns:
+        Complete analysis results dictionary
+    """
+    dispatcher = _dispatchers.get(api_key)
+    if dispatcher is None:
+        dispatcher = BatchDispatcher(get_analyzer(api_key))
+        _dispatchers[api_key] = dispatcher
+    return await dispatcher.submit(png_path)
+
+
+def analyze_cad_drawing(png_path: str, api_key: str,
+                        analyzer: Optional[AdvancedCADVisualAnalyzer] = None) -> Dict:
     """
     Main entry point for advanced CAD analysis
     
     Args:
         png_path: Path to PNG render of CAD drawing
         api_key: Google AI API key
+        analyzer: Optional analyzer to reuse across calls
         
     Returns:
         Complete analysis results dictionary
     """
-    analyzer = AdvancedCADVisualAnalyzer(api_key)
+    analyzer = analyzer or get_analyzer(api_key)
     return analyzer.comprehensive_analysis(png_path)
 
 
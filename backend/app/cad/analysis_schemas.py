@@ -0,0 +1,140 @@
+"""
+CAD Analysis Response Schemas
+Structured output models for the Gemini analysis passes
+"""
+
+from typing import Dict, List, Type
+
+from pydantic import BaseModel, Field
+
+
+class Dimension(BaseModel):
+    feature: str = Field(description="What the dimension measures (e.g. 'overall width', 'bore diameter')")
+    value: str = Field(description="Value exactly as written, including units (e.g. '150 mm', 'Ø12')")
+    tolerance: str = Field(description="Tolerance notation as written, or an empty string if none")
+
+
+class Component(BaseModel):
+    name: str = Field(description="Component, part or feature name or label")
+    description: str = Field(description="Appearance and notable geometry")
+    function: str = Field(description="Likely role in the assembly or system")
+
+
+class OverviewAnalysis(BaseModel):
+    drawing_type: str = Field(description="Architectural, mechanical, electrical, civil, etc.")
+    purpose: str = Field(description="Primary purpose of the drawing")
+    overall_layout: str = Field(description="Composition, organization and structure of the sheet")
+    key_elements: List[str] = Field(description="The 5-10 most important elements, one per entry")
+    complexity: str = Field(description="One of Simple, Moderate, Complex, Very Complex")
+    complexity_reason: str = Field(description="Why the drawing has that complexity")
+    industry_context: str = Field(description="Industry or field that would use this drawing")
+    confidence: str = Field(description="High/Medium/Low followed by any limits of the rendering")
+
+
+class TechnicalAnalysis(BaseModel):
+    dimensions: List[Dimension] = Field(description="Every visible dimension")
+    scale: str = Field(description="Scale or scale indicator, if shown")
+    dimension_styles: List[str] = Field(description="Dimension styles used")
+    line_types: List[str] = Field(description="Line types and weights with their purpose")
+    annotations: List[str] = Field(description="Text annotations, labels, callouts and notes")
+    title_block: str = Field(description="Title block and revision block contents")
+    identifiers: List[str] = Field(description="Part numbers, reference designators, identifiers")
+    symbols: List[str] = Field(description="Standard symbols (welding, surface finish, GD&T, electrical)")
+    standards: List[str] = Field(description="Drawing standards followed (ISO, ANSI, DIN, ...)")
+    projection: str = Field(description="Projection method (orthographic, isometric, perspective)")
+    views: List[str] = Field(description="Views shown (plan, elevation, section, detail)")
+    section_indicators: List[str] = Field(description="Cutting planes and section indicators")
+    confidence: str = Field(description="High/Medium/Low followed by any limits of the rendering")
+
+
+class ComponentsAnalysis(BaseModel):
+    components: List[Component] = Field(description="Every distinct component, part or feature")
+    assembly_relationships: List[str] = Field(description="Assembly relationships and connections")
+    geometric_features: List[str] = Field(description="Shapes, holes, slots, chamfers, fillets")
+    feature_patterns: List[str] = Field(description="Patterns or arrays of features")
+    materials: List[str] = Field(description="Material callouts, hatch patterns and specifications")
+    surface_finishes: List[str] = Field(description="Surface finish indicators")
+    assemblies: List[str] = Field(description="Main assemblies, sub-assemblies and groupings")
+    spatial_relationships: List[str] = Field(description="Spatial relationships between components")
+    special_features: List[str] = Field(description="Unique features, modifications or variations")
+    ambiguous_areas: List[str] = Field(description="Incomplete or ambiguous areas")
+    confidence: str = Field(description="High/Medium/Low followed by any limits of the rendering")
+
+
+class MeasurementsAnalysis(BaseModel):
+    dimensions: List[Dimension] = Field(description="ALL numerical dimensions, listed systematically")
+    critical_dimensions: List[str] = Field(description="Most critical or tightly toleranced dimensions")
+    reference_dimensions: List[str] = Field(description="Reference dimensions or calculated values")
+    datums: List[str] = Field(description="Coordinate systems, datum references and origin points")
+    grid_systems: List[str] = Field(description="Grid systems or reference lines")
+    counts: List[str] = Field(description="Counts of holes, fasteners, components, etc.")
+    area_estimates: List[str] = Field(description="Surface area estimates, if possible")
+    volume_estimates: List[str] = Field(description="Enclosed volume estimates, if applicable")
+    specifications: List[str] = Field(description="Weights, capacities, ratings, performance specs")
+    inspection_requirements: List[str] = Field(description="Inspection or quality control requirements")
+    confidence: str = Field(description="High/Medium/Low followed by any limits of the rendering")
+
+
+class QualityAnalysis(BaseModel):
+    line_clarity_score: int = Field(description="Line clarity and visibility from 1 to 10")
+    text_readability: str = Field(description="Assessment of text readability")
+    image_issues: List[str] = Field(description="Smudging, fading or other rendering quality issues")
+    missing_views: List[str] = Field(description="Views that appear to be missing")
+    title_block_complete: bool = Field(description="Whether the title block is complete")
+    missing_dimensions: List[str] = Field(description="Dimensions or details that are missing")
+    standards_compliance: str = Field(description="Drafting standards, symbol use and dimensioning practice")
+    issues: List[str] = Field(description="Errors, inconsistencies, conflicts or ambiguities")
+    recommendations: List[str] = Field(description="Improvements, extra views or items to verify")
+    confidence: str = Field(description="High/Medium/Low followed by any limits of the rendering")
+
+
+# Response schema for each analysis pass, keyed by pass name
+PASS_SCHEMAS: Dict[str, Type[BaseModel]] = {
+    'overview': OverviewAnalysis,
+    'technical': TechnicalAnalysis,
+    'components': ComponentsAnalysis,
+    'measurements': MeasurementsAnalysis,
+    'quality': QualityAnalysis,
+}
+
+
+class ConsolidatedAnalysis(BaseModel):
+    """Every pass answered in one response"""
+    overview: OverviewAnalysis
+    technical: TechnicalAnalysis
+    components: ComponentsAnalysis
+    measurements: MeasurementsAnalysis
+    quality: QualityAnalysis
+
+
+def _format_value(value) -> str:
+    if isinstance(value, dict):
+        return "; ".join(f"{key.replace('_', ' ')}: {item}" for key, item in value.items() if item not in ('', None))
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    return str(value)
+
+
+def render_markdown(data: Dict) -> str:
+    """
+    Render one structured pass result as Markdown text
+    Keeps the analyses consumed by synthesis and RAG indexing as plain text
+
+    Args:
+        data: model_dump() of a pass schema
+
+    Returns:
+        Markdown with one bold heading per field
+    """
+    lines = []
+    for key, value in data.items():
+        title = key.replace('_', ' ').title()
+        if isinstance(value, list):
+            lines.append(f"**{title}**:")
+            if value:
+                lines.extend(f"- {_format_value(item)}" for item in value)
+            else:
+                lines.append("- None visible")
+        else:
+            lines.append(f"**{title}**: {_format_value(value)}")
+    return "\n".join(lines)
@@ -3,8 +3,11 @@ DWG to DXF Converter Module
 Handles conversion of DWG files to DXF format
 """
 
+import functools
 import os
+import shutil
 import subprocess
+import tempfile
 from pathlib import Path
 import logging
 
@@ -32,10 +35,14 @@ def convert_dwg_to_dxf(dwg_path: str, output_dir: str) -> str:
     return None
 
 
+@functools.lru_cache(maxsize=1)
 def is_dwg_converter_available() -> bool:
     """
     Check if DWG conversion tools are available
     
+    The result is memoized for the lifetime of the process; call
+    is_dwg_converter_available.cache_clear() after installing a converter.
+    
     Returns:
         True if conversion is possible, False otherwise
     """
@@ -89,41 +96,42 @@ def convert_dwg_with_oda(dwg_path: str, output_dir: str) -> str:
     if not oda_path:
         raise FileNotFoundError("ODA File Converter not found")
     
-    # Create temp directory for conversion
-    temp_dir = Path(output_dir) / "temp_oda"
-    temp_dir.mkdir(exist_ok=True, parents=True)
-    
-    # Run conversion
-    # ODA syntax: ODAFileConverter input_folder output_folder output_version output_format
-    result = subprocess.run([
-        oda_path,
-        str(Path(dwg_path).parent),
-        str(temp_dir),
-        'ACAD2018',
-        'DXF',
-        '0',  # Recurse subdirectories: 0=no
-        '1',  # Audit: 1=yes
-        ''    # Input filter (empty = all)
-    ], capture_output=True, text=True, timeout=60)
-    
-    if result.returncode != 0:
-        raise RuntimeError(f"ODA conversion failed: {result.stderr}")
-    
-    # Find the converted DXF
-    dwg_name = Path(dwg_path).stem
-    dxf_path = temp_dir / f"{dwg_name}.dxf"
-    
-    if not dxf_path.exists():
-        raise FileNotFoundError(f"Converted DXF not found: {dxf_path}")
-    
-    # Move to output directory
-    final_path = Path(output_dir) / f"{dwg_name}.dxf"
-    dxf_path.rename(final_path)
+    # Create a temp directory for this conversion only; uploads load in worker
+    # threads, so a shared directory could be cleaned up under another conversion
+    Path(output_dir).mkdir(exist_ok=True, parents=True)
+    temp_dir = Path(tempfile.mkdtemp(prefix="temp_oda_", dir=output_dir))
     
-    # Cleanup temp directory
     try:
-        temp_dir.rmdir()
-    except:
-        pass
+        # Run conversion
+        # ODA syntax: ODAFileConverter input_folder output_folder output_version output_format
+        result = subprocess.run([
+            oda_path,
+            str(Path(dwg_path).parent),
+            str(temp_dir),
+            'ACAD2018',
+            'DXF',
+            '0',  # Recurse subdirectories: 0=no
+            '1',  # Audit: 1=yes
+            ''    # Input filter (empty = all)
+        ], capture_output=True, text=True, timeout=60)
+        
+        if result.returncode != 0:
+            raise RuntimeError(f"ODA conversion failed: {result.stderr}")
+        
+        # Find the converted DXF
+        dwg_name = Path(dwg_path).stem
+        dxf_path = temp_dir / f"{dwg_name}.dxf"
+        
+        if not dxf_path.exists():
+            raise FileNotFoundError(f"Converted DXF not found: {dxf_path}")
+        
+        # Move to output directory
+        final_path = Path(output_dir) / f"{dwg_name}.dxf"
+        # shutil.move copes with temp_dir and output_dir on different filesystems
+        shutil.move(str(dxf_path), str(final_path))
+    finally:
+        # ODA may leave auxiliary files behind, so rmdir() alone would leak the directory;
+        # temp_dir is private to this call, so removing it can't affect other conversions
+        shutil.rmtree(temp_dir, ignore_errors=True)
     
     return str(final_path)
@@ -3,52 +3,131 @@ CAD Feature Extractor using Computer Vision
 Extracts text, shapes, dimensions, and structure from CAD images
 """
 
+import os
+import hashlib
+import multiprocessing
+import tempfile
 import cv2
 import numpy as np
 import pytesseract
 from PIL import Image
 from pathlib import Path
 from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import json
 import re
+import threading
+
+try:
+    import tesserocr
+except ImportError:  # optional; falls back to one tesseract subprocess per image
+    tesserocr = None
 
 logger = logging.getLogger(__name__)
 
+# Dimension callouts in OCR text (e.g. '150mm', '30°', 'R15', 'Ø12', '150 x 75')
+_DIM_RE = re.compile(
+    r'\d+\.?\d*\s*(?:mm|cm|m\b)'  # millimeters, centimeters, meters
+    r'|\d+\.?\d*\s*°'             # degrees
+    r'|R\d+\.?\d*'                # radius
+    r'|Ø\d+\.?\d*'                # diameter
+    r'|\d+\.?\d*\s*x\s*\d+\.?\d*',  # dimensions like "150 x 75"
+    re.IGNORECASE
+)
+
+# Bump whenever extraction logic changes to invalidate cached features
+FEATURES_VERSION = '3'
+
+# Persistent feature cache, keyed by image bytes + extractor settings
+FEATURES_CACHE_DIR = Path.home() / '.cache' / 'documind' / 'cv_features'
+
+# Slope bound for "within 10° of horizontal/vertical" line classification
+TAN_10_DEG = 0.17632698
+
+TECHNICAL_KEYWORDS = [
+    'ISO', 'DIN', 'ANSI', 'ASTM', 'SCALE', 'SECTION',
+    'VIEW', 'DETAIL', 'ASSEMBLY', 'PART', 'REV',
+    'MATERIAL', 'FINISH', 'TOLERANCE', 'THREAD'
+]
+# Anchored at a word start so e.g. 'holding' doesn't count as DIN
+_TECH_RE = re.compile(r'\b(' + '|'.join(TECHNICAL_KEYWORDS) + ')', re.IGNORECASE)
+
 class CADFeatureExtractor:
     """Extract features from CAD drawings using OpenCV"""
     
     def __init__(self):
         self.min_line_length = 20
         self.min_circle_radius = 5
+        # Longest edge processed; larger renders are downscaled first (~150 DPI on A3)
+        self.max_dimension = 2000
+        # Below this many edge pixels there is nothing legible, so OCR is skipped.
+        # An absolute count: sparse but real drawings can have <0.1% edge density
+        self.min_ocr_edge_pixels = 50
+        # Persistent tesserocr handle (language data loaded once), created on first OCR
+        self._tess_api = None
+        self._tess_lock = threading.Lock()
     
-    def extract_features(self, image_path: str) -> Dict:
+    def extract_features(self, image_path: str, use_cache: bool = True) -> Dict:
         """
         Main extraction method - extracts all features from CAD image
         
+        Args:
+            image_path: Path to CAD image
+            use_cache: Reuse features from a previous run on identical image bytes
+        
         Returns:
             Dict with extracted features including text, shapes, complexity metrics
         """
         try:
             logger.info(f"🔍 Extracting CV features from: {image_path}")
             
-            # Load image
-            img = cv2.imread(image_path)
+            # Load image (bytes are read once for both the cache key and decoding)
+            image_bytes = Path(image_path).read_bytes()
+            cache_path = self._features_cache_path(image_bytes) if use_cache else None
+            if cache_path:
+                cached = self._load_cached_features(cache_path)
+                if cached:
+                    logger.info(f"♻️  Using cached CV features for: {image_path}")
+                    cached["image_path"] = image_path
+                    return cached
+            
+            img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
             if img is None:
                 raise ValueError(f"Failed to load image: {image_path}")
             
+            # Work on a downscaled copy; positions are mapped back via scale
+            height, width = img.shape[:2]
+            scale = min(1.0, self.max_dimension / max(height, width))
+            if scale < 1.0:
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            
             gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
             
+            # Shared intermediates, computed once for all detectors
+            edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+            blurred = cv2.GaussianBlur(gray, (9, 9), 2)
+            
+            # OCR dominates the cost; don't run it on blank pages
+            if cv2.countNonZero(edges) < self.min_ocr_edge_pixels:
+                text = self._empty_text_result()
+            else:
+                text = self._extract_text(gray, scale)
+            # A failed OCR run (e.g. tesseract missing) must not be cached as "no text"
+            ocr_failed = text is None
+            if ocr_failed:
+                text = self._empty_text_result()
+            
             # Run all extraction methods
             features = {
                 "image_path": image_path,
-                "image_size": {"width": img.shape[1], "height": img.shape[0]},
-                "text": self._extract_text(img),
-                "shapes": self._detect_shapes(gray),
-                "lines": self._detect_lines(gray),
-                "complexity": self._calculate_complexity(gray),
+                "image_size": {"width": width, "height": height},
+                "text": text,
+                "shapes": self._detect_shapes(edges, blurred, scale),
+                "lines": self._detect_lines(edges),
+                "complexity": self._calculate_complexity(gray, edges),
                 "color_analysis": self._analyze_colors(img),
-                "dimensions": self._extract_dimensions(img),
+                "dimensions": self._extract_dimensions(edges),
             }
             
             # Calculate summary stats
@@ -58,20 +137,27 @@ class CADFeatureExtractor:
                        f"{features['shapes']['circles']} circles, "
                        f"{features['lines']['total_lines']} lines")
             
+            if cache_path and not ocr_failed:
+                self._store_cached_features(cache_path, features)
+            
             return features
             
         except Exception as e:
             logger.error(f"❌ CV extraction failed: {e}")
             return self._empty_features(image_path, str(e))
     
-    def _extract_text(self, img) -> Dict:
-        """Extract text using OCR"""
+    def _extract_text(self, gray, scale: float = 1.0) -> Optional[Dict]:
+        """
+        Extract text using OCR; positions are divided by scale to map back to the original image
+        Returns None if OCR itself failed, so the caller can tell that apart from "no text".
+        """
         try:
-            # Convert to PIL Image for pytesseract
-            pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            # Tesseract binarizes a grayscale image internally anyway, so hand it the
+            # shared gray array (zero-copy PIL view) rather than a fresh RGB copy
+            pil_img = Image.fromarray(gray)
             
             # Extract text with bounding boxes
-            data = pytesseract.image_to_data(pil_img, output_type=pytesseract.Output.DICT)
+            data = self._ocr_words(pil_img)
             
             # Filter out low confidence text
             texts = []
@@ -81,10 +167,10 @@ class CADFeatureExtractor:
                         "text": data['text'][i].strip(),
                         "confidence": conf,
                         "position": {
-                            "x": data['left'][i],
-                            "y": data['top'][i],
-                            "width": data['width'][i],
-                            "height": data['height'][i]
+                            "x": round(data['left'][i] / scale),
+                            "y": round(data['top'][i] / scale),
+                            "width": round(data['width'][i] / scale),
+                            "height": round(data['height'][i] / scale)
                         }
                     })
             
@@ -106,16 +192,124 @@ class CADFeatureExtractor:
             }
         except Exception as e:
             logger.warning(f"Text extraction failed: {e}")
-            return {
-                "all_text": "",
-                "text_items": [],
-                "text_count": 0,
-                "dimensions_found": [],
-                "technical_terms": []
-            }
+            return None
+    
+    def _empty_text_result(self) -> Dict:
+        """Text result with nothing found, same shape as a successful _extract_text"""
+        return {
+            "all_text": "",
+            "text_items": [],
+            "text_count": 0,
+            "dimensions_found": [],
+            "technical_terms": []
+        }
+    
+    def _ocr_words(self, pil_img) -> Dict:
+        """
+        Run word-level OCR, returning pytesseract.image_to_data style columns
+        Uses a persistent tesserocr handle when installed so the language model is
+        loaded once per extractor rather than once per image.
+        """
+        if tesserocr is None:
+            return pytesseract.image_to_data(pil_img, output_type=pytesseract.Output.DICT)
+        
+        data = {"text": [], "conf": [], "left": [], "top": [], "width": [], "height": []}
+        level = tesserocr.RIL.WORD
+        with self._tess_lock:
+            if self._tess_api is None:
+                self._tess_api = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.AUTO)
+            api = self._tess_api
+            api.SetImage(pil_img)
+            api.Recognize()
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                text = word.GetUTF8Text(level)
+                if not text:
+                    continue
+                x1, y1, x2, y2 = word.BoundingBox(level)
+                data["text"].append(text)
+                data["conf"].append(word.Confidence(level))
+                data["left"].append(x1)
+                data["top"].append(y1)
+                data["width"].append(x2 - x1)
+                data["height"].append(y2 - y1)
+        return data
+    
+    def extract_features_batch(self, image_paths: List[str], max_workers: Optional[int] = None) -> List[Dict]:
+        """
+        Extract features from several images in parallel worker processes
+        Each worker builds one extractor (and OCR handle) and reuses it for all
+        images it is given; max_workers=1 runs in-process on this extractor.
+        Workers are spawned, not forked: callers are threaded (the API server), and a
+        fork could copy a held lock, such as the one guarding the tesserocr handle.
+        
+        Args:
+            image_paths: Paths to CAD images
+            max_workers: Worker processes (default: one per CPU)
+        
+        Returns:
+            List of extract_features() results in input order
+        """
+        max_workers = min(max_workers or os.cpu_count() or 1, len(image_paths))
+        if max_workers <= 1:
+            return [self.extract_features(image_path) for image_path in image_paths]
+        
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(self._settings(),)) as executor:
+            return list(executor.map(_extract_in_worker, image_paths, chunksize=4))
     
-    def _detect_shapes(self, gray) -> Dict:
-        """Detect circles, rectangles, and other shapes"""
+    def _settings(self) -> Dict:
+        """Tunable parameters that affect extraction results"""
+        return {
+            "min_line_length": self.min_line_length,
+            "min_circle_radius": self.min_circle_radius,
+            "max_dimension": self.max_dimension,
+            "min_ocr_edge_pixels": self.min_ocr_edge_pixels,
+        }
+    
+    def _features_cache_path(self, image_bytes: bytes) -> Path:
+        """On-disk cache location for one (image, settings) features result"""
+        key = hashlib.sha256(
+            image_bytes + json.dumps(self._settings(), sort_keys=True).encode() + FEATURES_VERSION.encode()
+        ).hexdigest()
+        return FEATURES_CACHE_DIR / f"{key}.json"
+    
+    def _load_cached_features(self, cache_path: Path) -> Optional[Dict]:
+        try:
+            with open(cache_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _store_cached_features(self, cache_path: Path, features: Dict):
+        """Atomically write a features result (tmp file + os.replace)"""
+        tmp_path = None
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(features, f)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            # Caching is best-effort: a write or serialization error must not lose the features
+            logger.warning(f"⚠️  Could not write CV features cache: {e}")
+            if tmp_path:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+    
+    def close(self):
+        """Release the persistent OCR handle, if one was created"""
+        with self._tess_lock:
+            if self._tess_api is not None:
+                self._tess_api.End()
+                self._tess_api = None
+    
+    def _detect_shapes(self, edges, blurred, scale: float = 1.0) -> Dict:
+        """
+        Detect circles, rectangles, and other shapes from the Canny edge map and blurred gray image
+        Reported coordinates are divided by scale to map back to the original image
+        """
         try:
             shapes = {
                 "circles": 0,
@@ -125,32 +319,37 @@ class CADFeatureExtractor:
                 "rectangle_list": []
             }
             
-            # Detect circles using Hough Circle Transform
-            blurred = cv2.GaussianBlur(gray, (9, 9), 2)
+            # Detect circles using Hough Circle Transform. The ALT variant is faster
+            # and far less prone to phantom circles on dense line work; param2 is
+            # then a circle "perfectness" threshold rather than an accumulator count
             circles = cv2.HoughCircles(
                 blurred,
-                cv2.HOUGH_GRADIENT,
-                dp=1,
+                cv2.HOUGH_GRADIENT_ALT,
+                dp=1.5,
                 minDist=20,
-                param1=50,
-                param2=30,
+                param1=300,
+                param2=0.9,
                 minRadius=self.min_circle_radius,
-                maxRadius=200
+                maxRadius=min(200, min(blurred.shape[:2]) // 4)
             )
             
             if circles is not None:
                 circles = np.uint16(np.around(circles))
                 shapes["circles"] = len(circles[0])
                 shapes["circle_list"] = [
-                    {"x": int(c[0]), "y": int(c[1]), "radius": int(c[2])}
+                    {"x": round(c[0] / scale), "y": round(c[1] / scale), "radius": round(c[2] / scale)}
                     for c in circles[0]
                 ]
             
             # Detect rectangles/contours
-            edges = cv2.Canny(gray, 50, 150)
             contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
             for contour in contours:
+                # Skip specks before the (comparatively expensive) polygon fit
+                _, _, w, h = cv2.boundingRect(contour)
+                if w <= 10 or h <= 10:
+                    continue
+                
                 # Approximate contour to polygon
                 epsilon = 0.02 * cv2.arcLength(contour, True)
                 approx = cv2.approxPolyDP(contour, epsilon, True)
@@ -158,8 +357,10 @@ class CADFeatureExtractor:
                 if len(approx) == 4:  # Rectangle
                     shapes["rectangles"] += 1
                     x, y, w, h = cv2.boundingRect(approx)
-                    if w > 10 and h > 10:  # Filter small noise
-                        shapes["rectangle_list"].append({"x": x, "y": y, "width": w, "height": h})
+                    shapes["rectangle_list"].append({
+                        "x": round(x / scale), "y": round(y / scale),
+                        "width": round(w / scale), "height": round(h / scale)
+                    })
                 elif len(approx) > 4:  # Polygon
                     shapes["polygons"] += 1
             
@@ -168,10 +369,9 @@ class CADFeatureExtractor:
             logger.warning(f"Shape detection failed: {e}")
             return {"circles": 0, "rectangles": 0, "polygons": 0, "circle_list": [], "rectangle_list": []}
     
-    def _detect_lines(self, gray) -> Dict:
-        """Detect lines using Hough Transform"""
+    def _detect_lines(self, edges) -> Dict:
+        """Detect lines using Hough Transform on the Canny edge map"""
         try:
-            edges = cv2.Canny(gray, 50, 150, apertureSize=3)
             lines = cv2.HoughLinesP(
                 edges,
                 rho=1,
@@ -184,20 +384,16 @@ class CADFeatureExtractor:
             if lines is None:
                 return {"total_lines": 0, "horizontal": 0, "vertical": 0, "diagonal": 0}
             
-            horizontal = 0
-            vertical = 0
-            diagonal = 0
+            # Classify all segments at once: (N, 1, 4) -> (N, 4) of x1, y1, x2, y2.
+            # Within 10° of an axis <=> the off-axis delta is under tan(10°) of the
+            # on-axis one, so no trig is needed
+            seg = lines.reshape(-1, 4).astype(np.float32)
+            adx = np.abs(seg[:, 2] - seg[:, 0])
+            ady = np.abs(seg[:, 3] - seg[:, 1])
             
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
-                angle = abs(np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi)
-                
-                if angle < 10 or angle > 170:
-                    horizontal += 1
-                elif 80 < angle < 100:
-                    vertical += 1
-                else:
-                    diagonal += 1
+            horizontal = int((ady <= adx * TAN_10_DEG).sum())
+            vertical = int((adx < ady * TAN_10_DEG).sum())
+            diagonal = len(seg) - horizontal - vertical
             
             return {
                 "total_lines": len(lines),
@@ -209,18 +405,17 @@ class CADFeatureExtractor:
             logger.warning(f"Line detection failed: {e}")
             return {"total_lines": 0, "horizontal": 0, "vertical": 0, "diagonal": 0}
     
-    def _calculate_complexity(self, gray) -> Dict:
+    def _calculate_complexity(self, gray, edges) -> Dict:
         """Calculate drawing complexity metrics"""
         try:
             # Edge density
-            edges = cv2.Canny(gray, 50, 150)
-            edge_density = np.sum(edges > 0) / edges.size
+            edge_density = cv2.countNonZero(edges) / edges.size
             
-            # Gradient magnitude (detail level)
-            sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-            sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-            gradient = np.sqrt(sobelx**2 + sobely**2)
-            avg_gradient = np.mean(gradient)
+            # Gradient magnitude (detail level); float32 is plenty for uint8 input
+            sobelx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+            sobely = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+            gradient = cv2.magnitude(sobelx, sobely)
+            avg_gradient = cv2.mean(gradient)[0]
             
             # Complexity score (0-10)
             complexity_score = min(10, edge_density * 100 + avg_gradient / 10)
@@ -238,15 +433,14 @@ class CADFeatureExtractor:
     def _analyze_colors(self, img) -> Dict:
         """Analyze color usage in drawing"""
         try:
-            # Convert to HSV for better color analysis
-            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            
-            # Detect predominant colors
-            unique_colors = len(np.unique(img.reshape(-1, img.shape[2]), axis=0))
+            # Count distinct colors on one packed 24-bit key per pixel; a 1-D unique
+            # is far cheaper than the row-wise unique over (N, 3)
+            packed = (img[:, :, 0].astype(np.uint32) << 16) | (img[:, :, 1].astype(np.uint32) << 8) | img[:, :, 2]
+            unique_colors = int(np.unique(packed.ravel()).size)
             
-            # Check if mostly black/white (typical CAD)
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            is_grayscale = np.allclose(img[:,:,0], img[:,:,1]) and np.allclose(img[:,:,1], img[:,:,2])
+            # Check if mostly black/white (typical CAD); a strided sample rejects
+            # colour images cheaply before the full-resolution uint8 channel compare
+            is_grayscale = self._channels_equal(img[::8, ::8]) and self._channels_equal(img)
             
             return {
                 "unique_colors": unique_colors,
@@ -257,13 +451,15 @@ class CADFeatureExtractor:
             logger.warning(f"Color analysis failed: {e}")
             return {"unique_colors": 0, "is_grayscale": True}
     
-    def _extract_dimensions(self, img) -> Dict:
-        """Try to extract dimension markers and arrows"""
+    def _channels_equal(self, img) -> bool:
+        """True if the B, G and R channels are identical"""
+        b, g, r = cv2.split(img)
+        return cv2.countNonZero(cv2.absdiff(b, g)) == 0 and cv2.countNonZero(cv2.absdiff(g, r)) == 0
+    
+    def _extract_dimensions(self, edges) -> Dict:
+        """Try to extract dimension markers and arrows from the Canny edge map"""
         try:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
             # Detect dimension arrows (simplified)
-            edges = cv2.Canny(gray, 50, 150)
             lines = cv2.HoughLinesP(edges, 1, np.pi/180, 50, minLineLength=30, maxLineGap=10)
             
             dimension_markers = 0
@@ -281,37 +477,12 @@ class CADFeatureExtractor:
     
     def _find_dimension_patterns(self, text: str) -> List[str]:
         """Find dimension patterns in text (e.g., '150mm', '30°', 'R15')"""
-        patterns = [
-            r'\d+\.?\d*\s*mm',      # millimeters
-            r'\d+\.?\d*\s*cm',      # centimeters
-            r'\d+\.?\d*\s*m\b',     # meters
-            r'\d+\.?\d*\s*°',       # degrees
-            r'R\d+\.?\d*',          # radius
-            r'Ø\d+\.?\d*',          # diameter
-            r'\d+\.?\d*\s*x\s*\d+\.?\d*',  # dimensions like "150 x 75"
-        ]
-        
-        dimensions = []
-        for pattern in patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            dimensions.extend(matches)
-        
-        return list(set(dimensions))  # Remove duplicates
+        return list({m.group(0) for m in _DIM_RE.finditer(text)})  # Remove duplicates
     
     def _find_technical_terms(self, text: str) -> List[str]:
         """Find technical terms and standards"""
-        technical_keywords = [
-            'ISO', 'DIN', 'ANSI', 'ASTM', 'SCALE', 'SECTION',
-            'VIEW', 'DETAIL', 'ASSEMBLY', 'PART', 'REV',
-            'MATERIAL', 'FINISH', 'TOLERANCE', 'THREAD'
-        ]
-        
-        found_terms = []
-        for keyword in technical_keywords:
-            if keyword.lower() in text.lower():
-                found_terms.append(keyword)
-        
-        return found_terms
+        found = {term.upper() for term in _TECH_RE.findall(text)}
+        return [keyword for keyword in TECHNICAL_KEYWORDS if keyword in found]
     
     def _classify_complexity(self, score: float) -> str:
         """Classify complexity level"""
@@ -383,3 +554,21 @@ DRAWING CHARACTERISTICS:
 - Color mode: {features.get('color_analysis', {}).get('color_count', 'unknown')}
 """
         return prompt
+
+
+# Per-process extractor used by extract_features_batch workers
+_worker_extractor: Optional[CADFeatureExtractor] = None
+
+
+def _init_worker(settings: Dict):
+    """Process pool initializer: one extractor per worker, single-threaded tesseract"""
+    global _worker_extractor
+    # Parallelism comes from the pool; tesseract's own OpenMP threads would oversubscribe
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    _worker_extractor = CADFeatureExtractor()
+    for name, value in settings.items():
+        setattr(_worker_extractor, name, value)
+
+
+def _extract_in_worker(image_path: str) -> Dict:
+    return _worker_extractor.extract_features(image_path)
@@ -1,19 +1,58 @@
 """
 Entity Extractor - Extract structured data from DXF entities
 """
+import os
+import math
 import logging
-from typing import List, Dict, Any, Tuple, Optional
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional, Iterable
+import numpy as np
 import ezdxf
-from ezdxf.document import Drawing
-from ezdxf.layouts import Modelspace
+from ezdxf import bbox
+from ezdxf.addons import iterdxf
+from ezdxf.lldxf.tagger import ascii_tags_loader
+from ezdxf.math import Z_AXIS
 
 logger = logging.getLogger(__name__)
 
+# Files above this size are streamed entity-by-entity instead of loaded whole
+STREAMING_THRESHOLD_BYTES = 50 * 1024 * 1024
+
 class EntityExtractor:
     """Extract entities and metadata from DXF files"""
     
     def __init__(self):
         self.entity_counter = 0
+        # Per-type extractors, looked up once per entity by dxftype()
+        self._dispatch = {
+            "TEXT": self._extract_text,
+            "MTEXT": self._extract_mtext,
+            "DIMENSION": self._extract_dimension,
+            "LINE": self._extract_geometric,
+            "POLYLINE": self._extract_geometric,
+            "LWPOLYLINE": self._extract_geometric,
+            "CIRCLE": self._extract_geometric,
+            "ARC": self._extract_geometric,
+            "ELLIPSE": self._extract_geometric,
+        }
+        # Reference-point attributes used for extents, resolved once per dxftype()
+        self._extent_attrs: Dict[str, Tuple[str, ...]] = {}
+        # Closed-form bounding boxes for common types; anything else goes through ezdxf.bbox
+        self._bbox_formulas = {
+            "LINE": self._line_bbox,
+            "CIRCLE": self._circle_bbox,
+            "ARC": self._arc_bbox,
+            "LWPOLYLINE": self._lwpolyline_bbox,
+            "TEXT": self._insert_point_bbox,
+            "DIMENSION": self._dimension_bbox,
+            "INSERT": self._insert_bbox,
+        }
+        # ezdxf bounding boxes of the current walk, shared by extents and per-entity bboxes
+        self._bbox_cache = bbox.Cache()
+        # Block-space extents by block name, so each block definition is measured once per walk
+        self._block_boxes: Dict[str, Optional[bbox.BoundingBox]] = {}
+        # Last (entity, bbox) computed, reused when extraction asks again for the same entity
+        self._last_bbox: Tuple[Any, Optional[List[float]]] = (None, None)
         
     def extract_all(self, dxf_path: str) -> Dict[str, Any]:
         """
@@ -23,20 +62,19 @@ class EntityExtractor:
             Dictionary with file metadata and entities
         """
         try:
-            doc = ezdxf.readfile(dxf_path)
-            msp = doc.modelspace()
-            
-            # Get file metadata
-            metadata = self._extract_metadata(doc)
-            
-            # Get extents
-            extents = self._calculate_extents(msp)
-            
-            # Extract entities
-            entities = self._extract_entities(msp, extents)
-            
-            # Get layer list
-            layers = list(doc.layers.entries.keys())
+            if os.path.getsize(dxf_path) > STREAMING_THRESHOLD_BYTES:
+                metadata, entities, extents, layers = self._extract_streaming(dxf_path)
+            else:
+                doc = ezdxf.readfile(dxf_path)
+                
+                # Get file metadata
+                metadata = self._extract_metadata(doc.dxfversion, doc.header)
+                
+                # Extract entities and extents in one modelspace walk
+                entities, extents = self._extract_entities(doc.modelspace())
+                
+                # Get layer list
+                layers = list(doc.layers.entries.keys())
             
             # Calculate statistics
             stats = self._calculate_statistics(entities)
@@ -53,12 +91,52 @@ class EntityExtractor:
             logger.error(f"Error extracting entities: {str(e)}")
             raise
     
-    def _extract_metadata(self, doc: Drawing) -> Dict[str, Any]:
-        """Extract file-level metadata"""
-        header = doc.header
+    def _extract_streaming(self, dxf_path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, List[float]], List[str]]:
+        """
+        Extract from a large ASCII DXF without building the full document
+        Entities are read one at a time with ezdxf's iterdxf add-on, so memory
+        stays bounded by the extracted records rather than the file size.
         
+        Returns:
+            (metadata, entities, extents, layers)
+        """
+        logger.info(f"Streaming large DXF: {dxf_path}")
+        info = iterdxf.dxf_file_info(dxf_path)
+        header = self._read_header_vars(dxf_path, info.encoding, ('$AUTHOR', '$TITLE'))
+        header['$INSUNITS'] = info.insert_units
+        metadata = self._extract_metadata(info.version, header)
+        
+        doc = iterdxf.opendxf(dxf_path)
+        try:
+            # Minimal writers (e.g. ezdxf's r12writer) emit no TABLES section at all
+            if 'TABLES' in doc.sections:
+                layers = [layer.dxf.name.lower() for layer in doc.load_entities(doc.sections['TABLES'] + 1, {'LAYER'})]
+            else:
+                layers = []
+            entities, extents = self._extract_entities(doc.modelspace())
+        finally:
+            doc.close()
+        
+        return metadata, entities, extents, layers
+    
+    def _read_header_vars(self, dxf_path: str, encoding: str, names: Tuple[str, ...]) -> Dict[str, str]:
+        """Read selected HEADER variables, stopping at the end of the HEADER section"""
+        values = {}
+        current = None
+        with open(dxf_path, mode='rt', encoding=encoding, errors='ignore') as f:
+            for tag in ascii_tags_loader(f):
+                if tag.code == 0 and tag.value == 'ENDSEC':
+                    break
+                if tag.code == 9:
+                    current = tag.value
+                elif current in names and current not in values:
+                    values[current] = tag.value
+        return values
+    
+    def _extract_metadata(self, dxfversion: str, header) -> Dict[str, Any]:
+        """Extract file-level metadata from the DXF version and header variables"""
         return {
-            "dxf_version": doc.dxfversion,
+            "dxf_version": dxfversion,
             "units": self._get_units(header),
             "author": header.get('$AUTHOR', 'Unknown'),
             "title": header.get('$TITLE', 'Untitled'),
@@ -87,94 +165,213 @@ class EntityExtractor:
         
         return units_map.get(insunits, "unknown")
     
-    def _calculate_extents(self, msp: Modelspace) -> Dict[str, List[float]]:
-        """Calculate bounding box of all entities"""
-        min_x = min_y = float('inf')
-        max_x = max_y = float('-inf')
+    def _get_extent_attrs(self, entity, entity_type: str) -> Tuple[str, ...]:
+        """DXF attributes holding an entity type's reference points (cached per type)"""
+        attrs = self._extent_attrs.get(entity_type)
+        if attrs is None:
+            if entity.dxf.is_supported('insert'):
+                # INSERT (block reference), TEXT, MTEXT, ...
+                attrs = ('insert',)
+            else:
+                # Try common coordinate attributes
+                attrs = tuple(
+                    attr for attr in ('start', 'end', 'center', 'location')
+                    if entity.dxf.is_supported(attr)
+                )
+            self._extent_attrs[entity_type] = attrs
+        return attrs
+    
+    def _entity_bbox(self, entity, entity_type: Optional[str] = None) -> Optional[List[float]]:
+        """Bbox of an entity, computed once even though extents and extraction both ask for it"""
+        last_entity, box = self._last_bbox
+        if entity is not last_entity:
+            box = self._compute_bbox(entity, entity_type)
+            self._last_bbox = (entity, box)
+        return box
+    
+    def _compute_bbox(self, entity, entity_type: Optional[str] = None) -> Optional[List[float]]:
+        """
+        Geometric [min_x, min_y, max_x, max_y] of an entity, or None
+        Common types use a closed form (DIMENSION from its definition points, INSERT from
+        its block's cached extents); the rest (ELLIPSE, SPLINE, MTEXT, ...) fall back to
+        ezdxf's bbox module, which is far slower per entity.
+        """
+        formula = self._bbox_formulas.get(entity_type or entity.dxftype())
+        if formula:
+            try:
+                box = formula(entity)
+            except Exception as e:
+                logger.debug(f"Could not compute bbox for {entity.dxftype()}: {e}")
+                box = None
+            if box:
+                return box
+        try:
+            box = bbox.extents((entity,), fast=True, cache=self._bbox_cache)
+        except Exception as e:
+            logger.debug(f"Could not compute bbox for {entity.dxftype()}: {e}")
+            return None
+        if not box.has_data:
+            return None
+        return [box.extmin.x, box.extmin.y, box.extmax.x, box.extmax.y]
+    
+    def _line_bbox(self, entity) -> List[float]:
+        start = entity.dxf.start
+        end = entity.dxf.end
+        return [min(start.x, end.x), min(start.y, end.y), max(start.x, end.x), max(start.y, end.y)]
+    
+    def _circle_bbox(self, entity) -> Optional[List[float]]:
+        if not entity.dxf.extrusion.isclose(Z_AXIS):
+            return None  # tilted OCS: let ezdxf transform it
+        center = entity.dxf.center
+        radius = entity.dxf.radius
+        return [center.x - radius, center.y - radius, center.x + radius, center.y + radius]
+    
+    def _arc_bbox(self, entity) -> Optional[List[float]]:
+        """End points plus every axis extreme (0°, 90°, 180°, 270°) the counter-clockwise sweep passes"""
+        if not entity.dxf.extrusion.isclose(Z_AXIS):
+            return None
+        center = entity.dxf.center
+        radius = entity.dxf.radius
+        start = entity.dxf.start_angle % 360
+        sweep = (entity.dxf.end_angle - entity.dxf.start_angle) % 360
+        angles = [start, start + sweep] + [a for a in (0, 90, 180, 270) if (a - start) % 360 <= sweep]
+        xs = [center.x + radius * math.cos(math.radians(a)) for a in angles]
+        ys = [center.y + radius * math.sin(math.radians(a)) for a in angles]
+        return [min(xs), min(ys), max(xs), max(ys)]
+    
+    def _lwpolyline_bbox(self, entity) -> Optional[List[float]]:
+        """Vertex bounds; like ezdxf's fast mode, bulge arcs are not expanded"""
+        if not entity.dxf.extrusion.isclose(Z_AXIS):
+            return None
+        points = list(entity.vertices())
+        if not points:
+            return None
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        return [min(xs), min(ys), max(xs), max(ys)]
+    
+    def _insert_point_bbox(self, entity) -> List[float]:
+        # Extents only need the anchor; the extracted TEXT record estimates its own width
+        insert = entity.dxf.insert
+        return [insert.x, insert.y, insert.x, insert.y]
+    
+    def _dimension_bbox(self, entity) -> Optional[List[float]]:
+        """Bounds of the definition points and text position, instead of rendering the dimension block"""
+        points = [
+            point for point in (entity.dxf.get(attr) for attr in ('defpoint', 'defpoint2', 'defpoint3', 'text_midpoint'))
+            if point is not None
+        ]
+        if not points:
+            return None
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        return [min(xs), min(ys), max(xs), max(ys)]
+    
+    def _insert_bbox(self, entity) -> Optional[List[float]]:
+        """Block extents measured once per block name, transformed by the insert's matrix"""
+        if entity.mcount > 1:
+            return None  # MINSERT array: let ezdxf expand it
+        block = entity.block()
+        if block is None:
+            return None  # e.g. streamed, without block definitions
+        if block.name not in self._block_boxes:
+            box = bbox.extents(block, fast=True, cache=self._bbox_cache)
+            self._block_boxes[block.name] = box if box.has_data else None
+        box = self._block_boxes[block.name]
+        if box is None:
+            return None
+        corners = list(entity.matrix44().transform_vertices(box.cube_vertices()))
+        xs = [corner.x for corner in corners]
+        ys = [corner.y for corner in corners]
+        return [min(xs), min(ys), max(xs), max(ys)]
+    
+    def _update_extents(self, entity, entity_type: str, bounds: List[float]) -> None:
+        """Grow bounds ([min_x, min_y, max_x, max_y]) by the entity's bbox, or its reference points"""
+        box = self._entity_bbox(entity, entity_type)
+        if box:
+            bounds[0] = min(bounds[0], box[0])
+            bounds[1] = min(bounds[1], box[1])
+            bounds[2] = max(bounds[2], box[2])
+            bounds[3] = max(bounds[3], box[3])
+            return
         
-        found_entity = False
+        # No geometry ezdxf can measure (e.g. a streamed INSERT without its block)
+        for attr in self._get_extent_attrs(entity, entity_type):
+            point = getattr(entity.dxf, attr)
+            if point is not None:
+                bounds[0] = min(bounds[0], point.x)
+                bounds[1] = min(bounds[1], point.y)
+                bounds[2] = max(bounds[2], point.x)
+                bounds[3] = max(bounds[3], point.y)
+    
+    def _extract_entities(self, msp: Iterable) -> Tuple[List[Dict[str, Any]], Dict[str, List[float]]]:
+        """
+        Extract all entities and the drawing extents in a single modelspace walk
+        Accepts a Modelspace or any iterable of modelspace entities
+        
+        Returns:
+            (entities with normalized coordinates, extents)
+        """
+        entities = []
+        self.entity_counter = 0
+        self._bbox_cache = bbox.Cache()
+        self._block_boxes = {}
+        self._last_bbox = (None, None)
+        bounds = [float('inf'), float('inf'), float('-inf'), float('-inf')]
         
         for entity in msp:
+            entity_type = entity.dxftype()
             try:
-                # Try to get bounding box
-                if hasattr(entity, 'dxf') and hasattr(entity.dxf, 'insert'):
-                    # INSERT (block reference)
-                    point = entity.dxf.insert
-                    min_x = min(min_x, point.x)
-                    max_x = max(max_x, point.x)
-                    min_y = min(min_y, point.y)
-                    max_y = max(max_y, point.y)
-                    found_entity = True
-                    
-                elif hasattr(entity, 'dxf'):
-                    # Try common coordinate attributes
-                    for attr in ['start', 'end', 'center', 'location']:
-                        if hasattr(entity.dxf, attr):
-                            point = getattr(entity.dxf, attr)
-                            if hasattr(point, 'x') and hasattr(point, 'y'):
-                                min_x = min(min_x, point.x)
-                                max_x = max(max_x, point.x)
-                                min_y = min(min_y, point.y)
-                                max_y = max(max_y, point.y)
-                                found_entity = True
-                                
+                self._update_extents(entity, entity_type, bounds)
             except Exception as e:
                 logger.debug(f"Could not process entity for extents: {e}")
+            
+            try:
+                extracted = self._extract_single_entity(entity, entity_type)
+                if extracted:
+                    entities.append(extracted)
+            except Exception as e:
+                logger.debug(f"Could not extract entity: {e}")
                 continue
         
-        if not found_entity:
+        if bounds[0] == float('inf'):
             # Default extents if no entities found
-            return {"min": [0, 0], "max": [100, 100]}
+            extents = {"min": [0, 0], "max": [100, 100]}
+        else:
+            extents = {"min": bounds[:2], "max": bounds[2:]}
         
-        return {
-            "min": [min_x, min_y],
-            "max": [max_x, max_y]
-        }
+        self._normalize_entities(entities, extents)
+        return entities, extents
     
-    def _extract_entities(self, msp: Modelspace, extents: Dict) -> List[Dict[str, Any]]:
-        """Extract all entities with normalized coordinates"""
-        entities = []
-        self.entity_counter = 0
-        
+    def _normalize_entities(self, entities: List[Dict[str, Any]], extents: Dict) -> None:
+        """Fill in bbox_norm for entities extracted with a placeholder (None)"""
         # Calculate normalization factors
         min_x, min_y = extents["min"]
         max_x, max_y = extents["max"]
         width = max_x - min_x if max_x > min_x else 1
         height = max_y - min_y if max_y > min_y else 1
         
-        for entity in msp:
-            try:
-                extracted = self._extract_single_entity(
-                    entity, min_x, min_y, width, height
-                )
-                if extracted:
-                    entities.append(extracted)
-            except Exception as e:
-                logger.debug(f"Could not extract entity: {e}")
-                continue
+        pending = [entity for entity in entities if entity["bbox_norm"] is None]
+        if not pending:
+            return
         
-        return entities
+        # Normalize every bbox to the 0-1 range in one array operation
+        bboxes = np.array([entity["bbox_world"] for entity in pending], dtype=np.float64)
+        norm = (bboxes - np.array([min_x, min_y, min_x, min_y])) / np.array([width, height, width, height])
+        for entity, row in zip(pending, norm.tolist()):
+            entity["bbox_norm"] = row
     
-    def _extract_single_entity(
-        self, entity, min_x: float, min_y: float, 
-        width: float, height: float
-    ) -> Optional[Dict[str, Any]]:
-        """Extract data from a single entity"""
+    def _extract_single_entity(self, entity, entity_type: str) -> Optional[Dict[str, Any]]:
+        """Extract data from a single entity; bbox_norm is filled in once extents are known"""
         self.entity_counter += 1
         entity_id = f"ent_{self.entity_counter:06d}"
         
-        entity_type = entity.dxftype()
         layer = entity.dxf.layer if hasattr(entity.dxf, 'layer') else "0"
         
         # Extract based on entity type
-        if entity_type == "TEXT":
-            return self._extract_text(entity, entity_id, layer, min_x, min_y, width, height)
-        elif entity_type == "MTEXT":
-            return self._extract_mtext(entity, entity_id, layer, min_x, min_y, width, height)
-        elif entity_type == "DIMENSION":
-            return self._extract_dimension(entity, entity_id, layer, min_x, min_y, width, height)
-        elif entity_type in ["LINE", "POLYLINE", "LWPOLYLINE", "CIRCLE", "ARC", "ELLIPSE"]:
-            return self._extract_geometric(entity, entity_id, layer, entity_type, min_x, min_y, width, height)
+        extractor = self._dispatch.get(entity_type)
+        if extractor:
+            return extractor(entity, entity_id, layer, entity_type)
         else:
             # Generic entity
             return {
@@ -187,7 +384,7 @@ class EntityExtractor:
                 "extra": {}
             }
     
-    def _extract_text(self, entity, entity_id, layer, min_x, min_y, width, height):
+    def _extract_text(self, entity, entity_id, layer, entity_type):
         """Extract TEXT entity"""
         text = entity.dxf.text
         insert = entity.dxf.insert
@@ -197,7 +394,6 @@ class EntityExtractor:
         # Approximate bbox
         text_width = len(text) * height_val * 0.6
         bbox_world = [insert.x, insert.y, insert.x + text_width, insert.y + height_val]
-        bbox_norm = self._normalize_bbox(bbox_world, min_x, min_y, width, height)
         
         return {
             "id": entity_id,
@@ -206,7 +402,7 @@ class EntityExtractor:
             "layer": layer,
             "block": None,
             "bbox_world": bbox_world,
-            "bbox_norm": bbox_norm,
+            "bbox_norm": None,
             "extra": {
                 "height": height_val,
                 "rotation": rotation,
@@ -214,7 +410,7 @@ class EntityExtractor:
             }
         }
     
-    def _extract_mtext(self, entity, entity_id, layer, min_x, min_y, width, height):
+    def _extract_mtext(self, entity, entity_id, layer, entity_type):
         """Extract MTEXT entity"""
         text = entity.text
         insert = entity.dxf.insert
@@ -226,7 +422,6 @@ class EntityExtractor:
         text_total_height = len(lines) * text_height * 1.5
         
         bbox_world = [insert.x, insert.y, insert.x + text_width, insert.y + text_total_height]
-        bbox_norm = self._normalize_bbox(bbox_world, min_x, min_y, width, height)
         
         return {
             "id": entity_id,
@@ -235,14 +430,14 @@ class EntityExtractor:
             "layer": layer,
             "block": None,
             "bbox_world": bbox_world,
-            "bbox_norm": bbox_norm,
+            "bbox_norm": None,
             "extra": {
                 "char_height": text_height,
                 "line_count": len(lines)
             }
         }
     
-    def _extract_dimension(self, entity, entity_id, layer, min_x, min_y, width, height):
+    def _extract_dimension(self, entity, entity_id, layer, entity_type):
         """Extract DIMENSION entity"""
         text = entity.dxf.text if hasattr(entity.dxf, 'text') else ""
         
@@ -250,7 +445,6 @@ class EntityExtractor:
         defpoint = entity.dxf.defpoint if hasattr(entity.dxf, 'defpoint') else (0, 0, 0)
         
         bbox_world = [defpoint[0], defpoint[1], defpoint[0] + 50, defpoint[1] + 10]
-        bbox_norm = self._normalize_bbox(bbox_world, min_x, min_y, width, height)
         
         return {
             "id": entity_id,
@@ -259,35 +453,16 @@ class EntityExtractor:
             "layer": layer,
             "block": None,
             "bbox_world": bbox_world,
-            "bbox_norm": bbox_norm,
+            "bbox_norm": None,
             "extra": {
                 "dim_type": entity.dimtype if hasattr(entity, 'dimtype') else "UNKNOWN"
             }
         }
     
-    def _extract_geometric(self, entity, entity_id, layer, entity_type, min_x, min_y, width, height):
+    def _extract_geometric(self, entity, entity_id, layer, entity_type):
         """Extract geometric entities"""
-        bbox_world = [0, 0, 0, 0]
-        
-        try:
-            if entity_type == "LINE":
-                start = entity.dxf.start
-                end = entity.dxf.end
-                bbox_world = [
-                    min(start.x, end.x), min(start.y, end.y),
-                    max(start.x, end.x), max(start.y, end.y)
-                ]
-            elif entity_type == "CIRCLE":
-                center = entity.dxf.center
-                radius = entity.dxf.radius
-                bbox_world = [
-                    center.x - radius, center.y - radius,
-                    center.x + radius, center.y + radius
-                ]
-        except Exception as e:
-            logger.debug(f"Could not extract bbox for {entity_type}: {e}")
-        
-        bbox_norm = self._normalize_bbox(bbox_world, min_x, min_y, width, height)
+        # Closed form, or cached from the extents pass; covers arcs, ellipses and polylines too
+        bbox_world = self._entity_bbox(entity, entity_type) or [0, 0, 0, 0]
         
         return {
             "id": entity_id,
@@ -296,47 +471,24 @@ class EntityExtractor:
             "layer": layer,
             "block": None,
             "bbox_world": bbox_world,
-            "bbox_norm": bbox_norm,
+            "bbox_norm": None,
             "extra": {}
         }
     
-    def _normalize_bbox(self, bbox_world, min_x, min_y, width, height):
-        """Normalize bounding box to 0-1 range"""
-        return [
-            (bbox_world[0] - min_x) / width,
-            (bbox_world[1] - min_y) / height,
-            (bbox_world[2] - min_x) / width,
-            (bbox_world[3] - min_y) / height
-        ]
-    
     def _calculate_statistics(self, entities: List[Dict]) -> Dict[str, int]:
         """Calculate entity statistics"""
+        # Types come from dxftype(), so they are already upper-case
+        counts = Counter(entity["type"] for entity in entities)
+        
         stats = {
             "total_entities": len(entities),
-            "text_entities": 0,
-            "mtext_entities": 0,
-            "dimension_entities": 0,
-            "line_entities": 0,
-            "circle_entities": 0,
-            "arc_entities": 0,
-            "other_entities": 0
+            "text_entities": counts["TEXT"],
+            "mtext_entities": counts["MTEXT"],
+            "dimension_entities": counts["DIMENSION"],
+            "line_entities": counts["LINE"] + counts["POLYLINE"] + counts["LWPOLYLINE"],
+            "circle_entities": counts["CIRCLE"],
+            "arc_entities": counts["ARC"],
         }
-        
-        for entity in entities:
-            entity_type = entity["type"].lower()
-            if entity_type == "text":
-                stats["text_entities"] += 1
-            elif entity_type == "mtext":
-                stats["mtext_entities"] += 1
-            elif entity_type == "dimension":
-                stats["dimension_entities"] += 1
-            elif entity_type == "line" or entity_type == "polyline" or entity_type == "lwpolyline":
-                stats["line_entities"] += 1
-            elif entity_type == "circle":
-                stats["circle_entities"] += 1
-            elif entity_type == "arc":
-                stats["arc_entities"] += 1
-            else:
-                stats["other_entities"] += 1
+        stats["other_entities"] = len(entities) - sum(stats.values()) + stats["total_entities"]
         
         return stats
@@ -4,14 +4,28 @@ Combines CV feature extraction with LLM analysis
 Allows text-only models to analyze CAD drawings
 """
 
+import os
+import asyncio
 import logging
-from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from app.cad.cv_extractor import CADFeatureExtractor
 from app.cad.multi_model_analyzer import MultiModelCADAnalyzer
 
 logger = logging.getLogger(__name__)
 
+# Instructions appended after the CV feature summary
+VISION_PROMPT_TAIL = """Based on the computer vision analysis above AND the actual image, provide:
+1. What type of CAD drawing is this?
+2. What is the primary purpose?
+3. Identify key components and their relationships
+4. Any insights not captured by CV analysis?"""
+
+TEXT_PROMPT_TAIL = """Based on the computer vision analysis above, provide:
+1. What type of CAD drawing is this likely to be?
+2. What insights can you derive from the detected shapes and lines?
+3. What is the likely purpose and application?
+4. Any recommendations based on the complexity and structure?"""
+
 class HybridCADAnalyzer:
     """
     Hybrid analyzer combining:
@@ -22,6 +36,57 @@ class HybridCADAnalyzer:
     def __init__(self, gemini_api_key: str = None, openrouter_api_key: str = None):
         self.cv_extractor = CADFeatureExtractor()
         self.llm_analyzer = MultiModelCADAnalyzer(gemini_api_key, openrouter_api_key)
+        # (png_path, mtime) -> (cv_features, cv_prompt); a re-rendered PNG gets a new mtime
+        self._cv_cache: Dict[Tuple[str, float], Tuple[Dict, str]] = {}
+    
+    async def aclose(self):
+        """Release the LLM analyzer's HTTP connections"""
+        await self.llm_analyzer.aclose()
+    
+    def _get_cv_features(self, png_path: str) -> Tuple[Dict, str]:
+        """
+        CV features and their LLM prompt for a PNG, extracted once per file version
+        The single stat here doubles as the existence check for the callers.
+        """
+        try:
+            key = (png_path, os.stat(png_path).st_mtime)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"PNG not found: {png_path}")
+        cached = self._cv_cache.get(key)
+        if cached is None:
+            cv_features = self.cv_extractor.extract_features(png_path)
+            cached = (cv_features, self.cv_extractor.format_for_llm(cv_features))
+            self._cv_cache[key] = cached
+        return cached
+    
+    def prefetch_cv_features(self, png_paths: List[str]):
+        """
+        Extract CV features for several PNGs at once in worker processes
+        Fills the cache analyze_with_cv_assistance reads from; missing and
+        already-cached files are skipped.
+        """
+        pending = {}
+        for png_path in png_paths:
+            try:
+                key = (png_path, os.stat(png_path).st_mtime)
+            except FileNotFoundError:
+                continue
+            if key not in self._cv_cache:
+                pending[key] = png_path
+        
+        # A single image isn't worth starting worker processes for
+        if len(pending) < 2:
+            return
+        
+        logger.info(f"🔬 Extracting CV features for {len(pending)} drawings in parallel")
+        try:
+            features = self.cv_extractor.extract_features_batch(list(pending.values()))
+        except Exception as e:
+            # Best-effort: analyze_with_cv_assistance extracts in-process instead
+            logger.warning(f"⚠️  Parallel CV extraction failed: {e}")
+            return
+        for key, cv_features in zip(pending, features):
+            self._cv_cache[key] = (cv_features, self.cv_extractor.format_for_llm(cv_features))
     
     async def analyze_with_cv_assistance(
         self,
@@ -40,9 +105,6 @@ class HybridCADAnalyzer:
         Returns:
             Analysis results with CV features + LLM insights
         """
-        if not Path(png_path).exists():
-            raise FileNotFoundError(f"PNG not found: {png_path}")
-        
         model_info = self.llm_analyzer.MODELS.get(model_id)
         if not model_info:
             raise ValueError(f"Unknown model: {model_id}")
@@ -51,26 +113,50 @@ class HybridCADAnalyzer:
         
         # Step 1: Extract CV features (local, instant)
         logger.info("  Step 1/3: CV feature extraction...")
-        cv_features = self.cv_extractor.extract_features(png_path)
-        cv_prompt = self.cv_extractor.format_for_llm(cv_features)
+        cv_features, cv_prompt = self._get_cv_features(png_path)
+        
+        # Read image only if the model can use it
+        image_bytes = None
+        if include_vision and model_id in self.llm_analyzer.VISION_MODELS:
+            with open(png_path, 'rb') as f:
+                image_bytes = f.read()
+        
+        result = await self._analyze_features(cv_features, cv_prompt, model_id, image_bytes, model_info)
+        logger.info("  Step 3/3: Complete!")
+        return result
+    
+    async def _analyze_features(
+        self,
+        cv_features: Dict,
+        cv_prompt: str,
+        model_id: str,
+        image_bytes: Optional[bytes] = None,
+        model_info: Optional[Dict] = None
+    ) -> Dict:
+        """
+        Run one LLM analysis on already-extracted CV features
+        
+        Args:
+            cv_features: Output of CADFeatureExtractor.extract_features
+            cv_prompt: cv_features formatted for the LLM
+            model_id: LLM model to use
+            image_bytes: Image to send as well, if the model supports vision
+            model_info: MODELS entry for model_id, if the caller already resolved it
+        
+        Returns:
+            Analysis results with CV features + LLM insights
+        """
+        model_info = model_info or self.llm_analyzer.MODELS.get(model_id)
+        if not model_info:
+            raise ValueError(f"Unknown model: {model_id}")
         
         # Step 2: Decide if we can use vision
-        use_vision = include_vision and 'vision' in model_info['capabilities']
+        use_vision = image_bytes is not None and model_id in self.llm_analyzer.VISION_MODELS
         
         if use_vision:
-            logger.info("  Step 2/3: Vision-enabled analysis (CV + image)...")
-            # Read image for vision model
-            with open(png_path, 'rb') as f:
-                image_bytes = f.read()
-            
+            logger.info(f"  Step 2/3: Vision-enabled analysis (CV + image) with {model_id}...")
             # Enhanced prompt with CV hints
-            vision_prompt = f"""{cv_prompt}
-
-Based on the computer vision analysis above AND the actual image, provide:
-1. What type of CAD drawing is this?
-2. What is the primary purpose?
-3. Identify key components and their relationships
-4. Any insights not captured by CV analysis?"""
+            vision_prompt = "\n\n".join((cv_prompt, VISION_PROMPT_TAIL))
             
             response, provider = await self.llm_analyzer.analyze_with_auto_fallback(
                 image_bytes,
@@ -78,15 +164,9 @@ Based on the computer vision analysis above AND the actual image, provide:
                 model_id
             )
         else:
-            logger.info("  Step 2/3: Text-only analysis (CV features only)...")
+            logger.info(f"  Step 2/3: Text-only analysis (CV features only) with {model_id}...")
             # Text-only: just use CV features
-            text_prompt = f"""{cv_prompt}
-
-Based on the computer vision analysis above, provide:
-1. What type of CAD drawing is this likely to be?
-2. What insights can you derive from the detected shapes and lines?
-3. What is the likely purpose and application?
-4. Any recommendations based on the complexity and structure?"""
+            text_prompt = "\n\n".join((cv_prompt, TEXT_PROMPT_TAIL))
             
             response, provider = await self.llm_analyzer.analyze_with_auto_fallback(
                 None,  # No image
@@ -94,8 +174,6 @@ Based on the computer vision analysis above, provide:
                 model_id
             )
         
-        logger.info("  Step 3/3: Complete!")
-        
         return {
             "model_used": model_info['name'],
             "model_id": model_id,
@@ -117,11 +195,9 @@ Based on the computer vision analysis above, provide:
         1. One vision model (with CV hints)
         2. Multiple text-only models (CV features only)
         
-        This gives multiple perspectives on the same CAD drawing
+        This gives multiple perspectives on the same CAD drawing.
+        CV extraction runs once; all model calls are then issued concurrently.
         """
-        if not Path(png_path).exists():
-            raise FileNotFoundError(f"PNG not found: {png_path}")
-        
         if text_model_ids is None:
             # Default: use free text models
             text_model_ids = [
@@ -130,13 +206,20 @@ Based on the computer vision analysis above, provide:
                 "deepseek/deepseek-r1"
             ]
         
+        # Fail fast on a typo before any CV work or API call
+        unknown = [m for m in [vision_model_id, *text_model_ids] if m not in self.llm_analyzer.MODELS]
+        if unknown:
+            raise ValueError(f"Unknown model(s): {', '.join(unknown)}")
+        
         logger.info(f"🔬 Comprehensive hybrid analysis")
         logger.info(f"   Vision model: {vision_model_id}")
         logger.info(f"   Text models: {len(text_model_ids)}")
         
-        # Extract CV features once
+        # Extract CV features and read the image once for every model
         logger.info("  Extracting CV features...")
-        cv_features = self.cv_extractor.extract_features(png_path)
+        cv_features, cv_prompt = self._get_cv_features(png_path)
+        with open(png_path, 'rb') as f:
+            image_bytes = f.read()
         
         results = {
             "cv_features": cv_features,
@@ -144,35 +227,29 @@ Based on the computer vision analysis above, provide:
             "text_analyses": []
         }
         
-        # Vision analysis (if model available)
-        try:
-            logger.info(f"  Running vision analysis...")
-            vision_result = await self.analyze_with_cv_assistance(
-                png_path,
-                vision_model_id,
-                include_vision=True
-            )
+        # The model calls are independent network round-trips, so run them together
+        logger.info(f"  Running vision + {len(text_model_ids)} text analyses concurrently...")
+        vision_result, *text_results = await asyncio.gather(
+            self._analyze_features(cv_features, cv_prompt, vision_model_id, image_bytes),
+            *(self._analyze_features(cv_features, cv_prompt, model_id) for model_id in text_model_ids),
+            return_exceptions=True
+        )
+        
+        if isinstance(vision_result, Exception):
+            logger.error(f"  Vision analysis failed: {vision_result}")
+            results["vision_analysis"] = {"error": str(vision_result)}
+        else:
             results["vision_analysis"] = vision_result
-        except Exception as e:
-            logger.error(f"  Vision analysis failed: {e}")
-            results["vision_analysis"] = {"error": str(e)}
         
-        # Text-only analyses
-        for i, model_id in enumerate(text_model_ids, 1):
-            try:
-                logger.info(f"  Running text analysis {i}/{len(text_model_ids)}: {model_id}")
-                text_result = await self.analyze_with_cv_assistance(
-                    png_path,
-                    model_id,
-                    include_vision=False
-                )
-                results["text_analyses"].append(text_result)
-            except Exception as e:
-                logger.error(f"  Text analysis {i} failed: {e}")
+        for i, (model_id, text_result) in enumerate(zip(text_model_ids, text_results), 1):
+            if isinstance(text_result, Exception):
+                logger.error(f"  Text analysis {i} failed: {text_result}")
                 results["text_analyses"].append({
                     "model_id": model_id,
-                    "error": str(e)
+                    "error": str(text_result)
                 })
+            else:
+                results["text_analyses"].append(text_result)
         
         # Synthesize all perspectives
         results["synthesis"] = self._synthesize_analyses(results)
@@ -6,16 +6,76 @@ Updated with gemini-2.5-flash and gemini-2.5-flash-lite fallback
 
 import os
 import io
+import asyncio
 import base64
+import functools
 import httpx
+import orjson
 import logging
-from typing import Dict, Optional
-from pathlib import Path
+from typing import Dict, Optional, Tuple
 from PIL import Image
 import google.generativeai as genai
 
 logger = logging.getLogger(__name__)
 
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Max simultaneous requests per provider; fan-out beyond this trips free-tier 429s
+OPENROUTER_MAX_CONCURRENCY = int(os.getenv('OPENROUTER_MAX_CONCURRENCY', '4'))
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '2'))
+
+# Headers sent with every OpenRouter request; only Authorization depends on the key
+OPENROUTER_HEADERS = {
+    "Content-Type": "application/json",
+    "HTTP-Referer": "https://documind.app",
+    "X-Title": "DocuMind CAD Analyzer"
+}
+
+# Longest edge of images sent to OpenRouter; vision models downscale larger inputs anyway
+OPENROUTER_MAX_IMAGE_EDGE = 1536
+
+
+# Fan-out and multi-stage analyses send the same image many times; the encoding
+# is memoized on the image bytes (bytes cache their own hash after the first lookup)
+@functools.lru_cache(maxsize=4)
+def _openrouter_image_url(image_bytes: bytes) -> str:
+    """
+    PNG data URL for OpenRouter, downscaled to OPENROUTER_MAX_IMAGE_EDGE
+    Stays PNG: JPEG artifacts smear the thin lines and small text of CAD renders.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    if max(image.size) > OPENROUTER_MAX_IMAGE_EDGE:
+        image.thumbnail((OPENROUTER_MAX_IMAGE_EDGE, OPENROUTER_MAX_IMAGE_EDGE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+        image_bytes = buffer.getvalue()
+    return f"data:image/png;base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+
+@functools.lru_cache(maxsize=4)
+def _get_gemini_models(api_key: str) -> Dict[str, "genai.GenerativeModel"]:
+    """
+    Process-wide Google Studio models per API key
+    Analyzers are built per request; sharing the models skips re-running
+    genai.configure and re-creating the model objects each time.
+    """
+    genai.configure(api_key=api_key)
+    return {
+        'gemini-2.5-flash': genai.GenerativeModel('gemini-2.5-flash'),
+        'gemini-2.5-flash-lite': genai.GenerativeModel('gemini-2.5-flash-lite')
+    }
+
+
+# (result key, prompt) for each stage of comprehensive_analysis, in order
+ANALYSIS_STAGES = (
+    ("stage_1_overview", "Analyze this CAD: 1) type 2) purpose 3) complexity 4) key features"),
+    ("stage_2_technical", "Technical aspects: 1) dimensions 2) standards 3) annotations 4) units"),
+    ("stage_3_components", "Components: 1) major parts 2) relationships 3) materials 4) features"),
+    ("stage_4_measurements", "Measurements: 1) critical dims 2) tolerances 3) angles 4) constraints"),
+    ("stage_5_quality", "Quality: 1) clarity 2) completeness 3) issues 4) recommendations"),
+)
+
+
 class MultiModelCADAnalyzer:
     """Advanced CAD analyzer with multiple Gemini fallbacks"""
     
@@ -121,6 +181,9 @@ class MultiModelCADAnalyzer:
         }
     }
     
+    # Models that accept image input, for O(1) checks on the analysis paths
+    VISION_MODELS = frozenset(model_id for model_id, info in MODELS.items() if 'vision' in info['capabilities'])
+    
     def __init__(self, gemini_api_key: str = None, openrouter_api_key: str = None):
         """Initialize with both API keys"""
         self.gemini_api_key = gemini_api_key or os.getenv('GOOGLE_API_KEY')
@@ -129,11 +192,7 @@ class MultiModelCADAnalyzer:
         # Setup Google Studio Gemini models
         if self.gemini_api_key:
             try:
-                genai.configure(api_key=self.gemini_api_key)
-                self.gemini_models = {
-                    'gemini-2.5-flash': genai.GenerativeModel('gemini-2.5-flash'),
-                    'gemini-2.5-flash-lite': genai.GenerativeModel('gemini-2.5-flash-lite')
-                }
+                self.gemini_models = _get_gemini_models(self.gemini_api_key)
                 logger.info("✅ Google Studio Gemini models initialized")
             except Exception as e:
                 logger.warning(f"⚠️ Google Studio init failed: {e}")
@@ -144,6 +203,34 @@ class MultiModelCADAnalyzer:
         
         if not self.openrouter_api_key:
             logger.warning("⚠️ No OPENROUTER_API_KEY - OpenRouter fallback unavailable")
+        
+        # OpenRouter HTTP client, created on first use (needs a running event loop)
+        self._http: Optional[httpx.AsyncClient] = None
+        # Per-provider concurrency caps
+        self._openrouter_sem = asyncio.Semaphore(OPENROUTER_MAX_CONCURRENCY)
+        self._gemini_sem = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        # In-flight analyses keyed by (model_id, prompt, image_bytes)
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+    
+    def _get_http(self) -> httpx.AsyncClient:
+        """
+        Shared keep-alive client for all OpenRouter calls of this analyzer
+        Concurrent and follow-up calls reuse pooled connections instead of
+        paying a TCP + TLS handshake each.
+        """
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=60.0,
+                headers=OPENROUTER_HEADERS,
+                limits=httpx.Limits(max_keepalive_connections=32)
+            )
+        return self._http
+    
+    async def aclose(self):
+        """Close the OpenRouter HTTP client, if one was created"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
     
     async def analyze_with_gemini_direct(self, image_bytes: Optional[bytes], prompt: str, model_name: str = 'gemini-2.5-flash') -> str:
         """Google Studio Gemini (PRIMARY)"""
@@ -152,11 +239,16 @@ class MultiModelCADAnalyzer:
         
         try:
             model = self.gemini_models[model_name]
+            # Native async call: the blocking generate_content would stall the event
+            # loop (and every concurrent OpenRouter call) for the whole round-trip
             if image_bytes:
-                image = Image.open(io.BytesIO(image_bytes))
-                response = model.generate_content([prompt, image])
+                # Raw PNG blob: the SDK uploads it as-is instead of decoding to
+                # PIL and re-encoding
+                contents = [prompt, {"mime_type": "image/png", "data": image_bytes}]
             else:
-                response = model.generate_content(prompt)
+                contents = prompt
+            async with self._gemini_sem:
+                response = await model.generate_content_async(contents)
             return response.text
         except Exception as e:
             error_msg = str(e)
@@ -167,20 +259,12 @@ class MultiModelCADAnalyzer:
     async def analyze_with_openrouter(self, image_bytes: Optional[bytes], prompt: str, model_id: str) -> str:
         """OpenRouter (FALLBACK + other models)"""
         try:
-            url = "https://openrouter.ai/api/v1/chat/completions"
-            
-            headers = {
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://documind.app",
-                "X-Title": "DocuMind CAD Analyzer"
-            }
+            headers = {"Authorization": f"Bearer {self.openrouter_api_key}"}
             
             if image_bytes:
-                base64_image = base64.b64encode(image_bytes).decode('utf-8')
                 message_content = [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
+                    {"type": "image_url", "image_url": {"url": _openrouter_image_url(image_bytes)}}
                 ]
             else:
                 message_content = prompt
@@ -190,10 +274,10 @@ class MultiModelCADAnalyzer:
                 "messages": [{"role": "user", "content": message_content}]
             }
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                return response.json()['choices'][0]['message']['content']
+            async with self._openrouter_sem:
+                response = await self._get_http().post(OPENROUTER_URL, headers=headers, json=payload)
+            response.raise_for_status()
+            return orjson.loads(response.content)['choices'][0]['message']['content']
                 
         except httpx.HTTPStatusError as e:
             raise Exception(f"OpenRouter error ({e.response.status_code}): {e.response.text[:200]}")
@@ -201,7 +285,21 @@ class MultiModelCADAnalyzer:
             raise Exception(f"OpenRouter failed: {e}")
     
     async def analyze_with_auto_fallback(self, image_bytes: Optional[bytes], prompt: str, model_id: str = "gemini-2.5-flash") -> tuple[str, str]:
-        """Smart analysis with cascading fallback: Flash → Flash Lite → OpenRouter"""
+        """
+        Smart analysis with cascading fallback: Flash → Flash Lite → OpenRouter
+        Identical concurrent requests share one upstream call (singleflight).
+        """
+        # str/bytes cache their hash, so keying on the full values is cheap
+        key = (model_id, prompt, image_bytes)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_with_auto_fallback(image_bytes, prompt, model_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled caller doesn't cancel the call for the others
+        return await asyncio.shield(task)
+    
+    async def _analyze_with_auto_fallback(self, image_bytes: Optional[bytes], prompt: str, model_id: str) -> tuple[str, str]:
         model_info = self.MODELS.get(model_id)
         if not model_info:
             raise ValueError(f"Unknown model: {model_id}")
@@ -255,11 +353,8 @@ class MultiModelCADAnalyzer:
     
     async def comprehensive_analysis(self, png_path: str, model_id: str = "gemini-2.5-flash") -> Dict:
         """Run comprehensive 5-stage CAD analysis with cascading fallback"""
-        if not Path(png_path).exists():
-            raise FileNotFoundError(f"PNG not found: {png_path}")
-        
         model_info = self.MODELS.get(model_id)
-        if not model_info or 'vision' not in model_info['capabilities']:
+        if model_id not in self.VISION_MODELS:
             raise ValueError(f"Model {model_id} doesn't support vision")
         
         logger.info(f"🔍 5-stage analysis with {model_info['name']}...")
@@ -268,16 +363,8 @@ class MultiModelCADAnalyzer:
             image_bytes = f.read()
         
         provider_used = None
-        stages = {
-            "stage_1_overview": "Analyze this CAD: 1) type 2) purpose 3) complexity 4) key features",
-            "stage_2_technical": "Technical aspects: 1) dimensions 2) standards 3) annotations 4) units",
-            "stage_3_components": "Components: 1) major parts 2) relationships 3) materials 4) features",
-            "stage_4_measurements": "Measurements: 1) critical dims 2) tolerances 3) angles 4) constraints",
-            "stage_5_quality": "Quality: 1) clarity 2) completeness 3) issues 4) recommendations"
-        }
-        
         results = {}
-        for i, (stage_name, prompt) in enumerate(stages.items(), 1):
+        for i, (stage_name, prompt) in enumerate(ANALYSIS_STAGES, 1):
             logger.info(f"  Stage {i}/5: {stage_name.replace('_', ' ').title()}...")
             response, used_provider = await self.analyze_with_auto_fallback(image_bytes, prompt, model_id)
             results[stage_name] = response
@@ -1,22 +1,49 @@
 """
 CAD Renderer - Convert DXF to SVG for browser display
 """
+import hashlib
 import logging
+import os
+import shutil
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from itertools import groupby
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional, Tuple
 import ezdxf
-from ezdxf.addons.drawing import RenderContext, Frontend
+from ezdxf.addons.drawing import RenderContext, Frontend, layout
 from ezdxf.addons.drawing.matplotlib import MatplotlibBackend
-import matplotlib.pyplot as plt
+from ezdxf.addons.drawing.svg import SVGBackend
+import matplotlib
+# Server-side rendering only; never pick up an interactive backend
+matplotlib.use("Agg", force=True)
+from matplotlib.figure import Figure
 
 logger = logging.getLogger(__name__)
 
+# SVG page: fit the drawing into 12x9 inches with a 0.1 inch margin
+SVG_PAGE = layout.Page(0, 0, layout.Units.inch, margins=layout.Margins.all(0.1), max_width=12, max_height=9)
+
+# Bump whenever rendering output changes to invalidate cached renders
+RENDER_VERSION = '1'
+
+# Bytes read per step when hashing a DXF for the render cache
+HASH_CHUNK_SIZE = 1 << 20
+
 class CADRenderer:
     """Render DXF files to SVG"""
     
     def __init__(self, render_dir: str = "cad_renders"):
         self.render_dir = Path(render_dir)
         self.render_dir.mkdir(exist_ok=True)
+        # Renders keyed by DXF content hash; output_id files are hardlinks into here
+        self.cache_dir = self.render_dir / "by_hash"
+        self.cache_dir.mkdir(exist_ok=True)
+        # One Figure reused for every PNG render (cleared in between); matplotlib
+        # figures are not thread-safe, so renders are serialized on the lock
+        self._fig = Figure(figsize=(12, 9), dpi=100)
+        self._fig_lock = threading.Lock()
         
     def render_to_svg(self, dxf_path: str, output_id: str) -> Optional[str]:
         """
@@ -32,23 +59,8 @@ class CADRenderer:
         try:
             logger.info(f"Rendering DXF to SVG: {dxf_path}")
             
-            # Read DXF
-            doc = ezdxf.readfile(dxf_path)
-            msp = doc.modelspace()
-            
-            # Setup matplotlib backend
-            fig = plt.figure(figsize=(12, 9), dpi=100)
-            ax = fig.add_axes([0, 0, 1, 1])
-            ctx = RenderContext(doc)
-            out = MatplotlibBackend(ax)
-            
-            # Render
-            Frontend(ctx, out).draw_layout(msp, finalize=True)
-            
-            # Save as SVG
             output_path = self.render_dir / f"{output_id}.svg"
-            fig.savefig(output_path, format='svg', bbox_inches='tight', pad_inches=0.1)
-            plt.close(fig)
+            self._render_cached(dxf_path, output_path, 'render.svg', lambda path: self._write_svg(dxf_path, path))
             
             logger.info(f"SVG rendered successfully: {output_path}")
             return str(output_path)
@@ -72,22 +84,14 @@ class CADRenderer:
         try:
             logger.info(f"Rendering DXF to PNG: {dxf_path}")
             
-            doc = ezdxf.readfile(dxf_path)
-            msp = doc.modelspace()
-            
             # Calculate aspect ratio
             height = int(width * 0.75)  # 4:3 aspect ratio
             
-            fig = plt.figure(figsize=(width/100, height/100), dpi=100)
-            ax = fig.add_axes([0, 0, 1, 1])
-            ctx = RenderContext(doc)
-            out = MatplotlibBackend(ax)
-            
-            Frontend(ctx, out).draw_layout(msp, finalize=True)
-            
             output_path = self.render_dir / f"{output_id}.png"
-            fig.savefig(output_path, format='png', bbox_inches='tight', pad_inches=0.1)
-            plt.close(fig)
+            self._render_cached(
+                dxf_path, output_path, f'{width}w.png',
+                lambda path: self._render(dxf_path, path, 'png', (width / 100, height / 100))
+            )
             
             logger.info(f"PNG rendered successfully: {output_path}")
             return str(output_path)
@@ -95,3 +99,135 @@ class CADRenderer:
         except Exception as e:
             logger.error(f"Error rendering DXF to PNG: {str(e)}")
             return None
+    
+    def render_to_png_for_vision(self, dxf_path: str, output_id: str, dpi: int = 150) -> Optional[str]:
+        """
+        Render DXF file straight to PNG for vision analysis (no SVG intermediate)
+        
+        Args:
+            dxf_path: Path to DXF file
+            output_id: ID for output filename
+            dpi: Output resolution on the 12x9 inch figure
+            
+        Returns:
+            Path to rendered PNG file, or None if failed
+        """
+        try:
+            logger.info(f"Rendering DXF to vision PNG: {dxf_path}")
+            
+            output_path = self.render_dir / f"{output_id}_vision.png"
+            self._render_cached(
+                dxf_path, output_path, f'vision{dpi}.png',
+                lambda path: self._render(dxf_path, path, 'png', (12, 9), dpi=dpi)
+            )
+            
+            logger.info(f"Vision PNG rendered successfully: {output_path}")
+            return str(output_path)
+            
+        except Exception as e:
+            logger.error(f"Error rendering DXF to vision PNG: {str(e)}")
+            return None
+    
+    def _render_cached(self, dxf_path: str, output_path: Path, variant: str, render: Callable[[Path], None]):
+        """
+        Provide output_path from the content-addressed render cache
+        
+        The cache file is named by the DXF's sha256 (first 16 hex chars),
+        RENDER_VERSION and the variant, so an edited DXF simply misses.
+        render(path) only runs on a miss; output_path is then hardlinked to
+        the cache file (copied where links aren't supported).
+        """
+        digest = _file_sha256(dxf_path)[:16]
+        cached = self.cache_dir / f"{digest}_v{RENDER_VERSION}_{variant}"
+        
+        if cached.exists():
+            logger.info(f"♻️  Using cached render: {cached}")
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            os.close(fd)
+            # mkstemp creates 0600; renders are served like any other file
+            os.chmod(tmp_path, 0o644)
+            try:
+                render(Path(tmp_path))
+                os.replace(tmp_path, cached)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        
+        output_path.unlink(missing_ok=True)
+        try:
+            os.link(cached, output_path)
+        except OSError:
+            shutil.copyfile(cached, output_path)
+    
+    def _write_svg(self, dxf_path: str, output_path: Path):
+        """Render the DXF modelspace with ezdxf's SVG backend"""
+        doc = ezdxf.readfile(dxf_path)
+        
+        # ezdxf writes the SVG itself; no matplotlib figure or lock needed
+        backend = SVGBackend()
+        Frontend(RenderContext(doc), backend).draw_layout(doc.modelspace(), finalize=True)
+        
+        root = backend.get_xml_root_element(SVG_PAGE)
+        _group_paths_by_class(root)
+        
+        output_path.write_text(ET.tostring(root, encoding='unicode'), encoding='utf-8')
+    
+    def _render(self, dxf_path: str, output_path: Path, fmt: str, size_inches: Tuple[float, float], dpi: int = 100):
+        """Draw the DXF modelspace on the shared figure and save it in the given format"""
+        doc = ezdxf.readfile(dxf_path)
+        msp = doc.modelspace()
+        
+        with self._fig_lock:
+            fig = self._fig
+            fig.clear()
+            fig.set_size_inches(size_inches)
+            ax = fig.add_axes([0, 0, 1, 1])
+            ctx = RenderContext(doc)
+            out = MatplotlibBackend(ax)
+            
+            try:
+                Frontend(ctx, out).draw_layout(msp, finalize=True)
+                fig.savefig(output_path, format=fmt, dpi=dpi, bbox_inches='tight', pad_inches=0.1)
+            finally:
+                # Drop the drawing's artists so they don't outlive the render
+                fig.clear()
+
+
+def _file_sha256(path: str) -> str:
+    """Hex sha256 of a file, read in HASH_CHUNK_SIZE pieces (hashlib.file_digest needs Python 3.11)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _group_paths_by_class(root: ET.Element):
+    """
+    Move runs of paths sharing a style class onto one <g class> parent
+    
+    SVGBackend already emits integer viewBox coordinates and CSS style
+    classes, but repeats the class on every path. Only consecutive runs are
+    grouped so the paint order is unchanged.
+    
+    Args:
+        root: <svg> element from SVGBackend.get_xml_root_element()
+    """
+    entities = root.find('g')
+    if entities is None:
+        return
+    
+    regrouped = []
+    for css_class, run in groupby(list(entities), key=lambda child: child.get('class')):
+        run = list(run)
+        if css_class is None or len(run) < 2:
+            regrouped.extend(run)
+            continue
+        group = ET.Element('g', {'class': css_class})
+        for path in run:
+            del path.attrib['class']
+            group.append(path)
+        regrouped.append(group)
+    
+    entities[:] = regrouped
@@ -3,56 +3,127 @@ Visual Analyzer - Analyze CAD drawings using Computer Vision and Gemini Vision
 """
 import logging
 import base64
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import google.generativeai as genai
 from PIL import Image
 import io
 
 logger = logging.getLogger(__name__)
 
+# librsvg's CLI rasterizes much faster than cairosvg; used when it is on PATH
+RSVG_CONVERT = shutil.which('rsvg-convert')
+
+# Gemini downsamples large images itself; send line-art already shrunk and palettized
+VISION_MAX_IMAGE_EDGE = 768
+VISION_PALETTE_COLORS = 64
+
+VISUAL_PROMPT_TEMPLATE = """Analyze this CAD/technical drawing image. Be specific and concise.
+
+Drawing Stats:
+- Units: {units}
+- Entities: {total_entities}
+- Layers: {layer_count}
+
+Provide a clear, technical description (3-5 sentences):
+1. Drawing type (mechanical part, circuit, building plan, etc.)
+2. Main components visible
+3. Overall layout/arrangement
+4. Key features or notable elements
+
+Be direct and factual. Focus on what IS visible, not what could be there."""
+
+
+def _text_entities(manifest: Dict) -> List[str]:
+    """Annotation lines as "[layer] text", precomputed by DXFParser or derived for older manifests"""
+    precomputed = manifest.get("precomputed")
+    if precomputed is not None:
+        return precomputed["text_entities"]
+    return [
+        f"[{entity.get('layer', 'unknown')}] {entity['raw_text']}"
+        for entity in manifest.get("entities", [])
+        if entity.get("raw_text")
+    ]
+
+
+def _vision_image_bytes(image_bytes: bytes) -> bytes:
+    """Downscale a render to VISION_MAX_IMAGE_EDGE and quantize it to a small PNG palette"""
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    image.thumbnail((VISION_MAX_IMAGE_EDGE, VISION_MAX_IMAGE_EDGE), Image.LANCZOS)
+    image = image.convert('P', palette=Image.ADAPTIVE, colors=VISION_PALETTE_COLORS)
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
 class CADVisualAnalyzer:
     """Analyze CAD drawings visually using Gemini Vision"""
     
     def __init__(self, api_key: str):
         self.api_key = api_key
-        genai.configure(api_key=api_key)
-        self.vision_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # Gemini responses keyed by (PNG content hash, prompt hash)
+        self._response_cache: Dict[Tuple[str, str], str] = {}
+    
+    @functools.cached_property
+    def vision_model(self) -> "genai.GenerativeModel":
+        """Gemini Vision model, configured on first use rather than at construction"""
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel('gemini-2.0-flash-exp')
         
     def analyze_cad_visual(
         self, 
-        svg_path: str, 
+        png_path: str, 
         manifest: Dict[str, Any]
     ) -> Dict[str, Any]:
         """
         Analyze CAD drawing visually using Gemini Vision
         
         Args:
-            svg_path: Path to SVG render
+            png_path: Path to PNG render (CADRenderer.render_to_png_for_vision);
+                an SVG render is still accepted and rasterized first
             manifest: CAD manifest with entity data
             
         Returns:
             Dictionary with visual analysis
         """
         try:
-            logger.info(f"Starting visual analysis of CAD: {svg_path}")
+            logger.info(f"Starting visual analysis of CAD: {png_path}")
             
-            # Convert SVG to PNG for vision analysis
-            png_path = self._convert_svg_to_png(svg_path)
-            if not png_path:
-                return self._create_fallback_analysis(manifest)
+            if Path(png_path).suffix.lower() == '.svg':
+                png_path = self._convert_svg_to_png(png_path)
+                if not png_path:
+                    return self._create_fallback_analysis(manifest)
             
-            # Load image
-            image = Image.open(png_path)
+            image_bytes = Path(png_path).read_bytes()
             
             # Create analysis prompt
             prompt = self._create_visual_prompt(manifest)
             
-            # Analyze with Gemini Vision
-            logger.info("Calling Gemini Vision for analysis...")
-            response = self.vision_model.generate_content([prompt, image])
+            cache_key = (
+                hashlib.sha256(image_bytes).hexdigest(),
+                hashlib.sha256(prompt.encode()).hexdigest()
+            )
+            visual_description = self._response_cache.get(cache_key)
+            
+            if visual_description is None:
+                image = {"mime_type": "image/png", "data": _vision_image_bytes(image_bytes)}
+                
+                # Analyze with Gemini Vision
+                logger.info("Calling Gemini Vision for analysis...")
+                response = self.vision_model.generate_content([prompt, image])
+                
+                visual_description = response.text
+                self._response_cache[cache_key] = visual_description
+            else:
+                logger.info("♻️  Reusing cached Gemini Vision analysis")
             
-            visual_description = response.text
             logger.info(f"Visual analysis completed: {len(visual_description)} chars")
             
             # Combine with entity data
@@ -80,66 +151,82 @@ class CADVisualAnalyzer:
             }
     
     def _convert_svg_to_png(self, svg_path: str) -> Optional[str]:
-        """Convert SVG to PNG for vision analysis"""
+        """
+        Convert SVG to PNG for vision analysis
+        
+        PNGs are cached next to the SVG as <sha256 of SVG bytes>.png, so an
+        unchanged drawing is only rasterized once.
+        
+        Args:
+            svg_path: Path to SVG render
+            
+        Returns:
+            Path to the PNG, or None if conversion failed
+        """
         try:
-            import cairosvg
+            svg_data = Path(svg_path).read_bytes()
+            png_path = Path(svg_path).parent / f"{hashlib.sha256(svg_data).hexdigest()}.png"
+            
+            if png_path.exists():
+                logger.info(f"♻️  Using cached PNG: {png_path}")
+                return str(png_path)
+            
+            if RSVG_CONVERT:
+                png_data = self._rasterize_with_rsvg(svg_data)
+            else:
+                png_data = self._rasterize_with_cairosvg(svg_data)
             
-            png_path = svg_path.replace('.svg', '_analysis.png')
+            self._store_png(png_path, png_data)
+            
+            logger.info(f"Converted SVG to PNG: {png_path}")
+            return str(png_path)
             
+        except Exception as e:
+            logger.error(f"SVG to PNG conversion failed: {e}")
+            return None
+    
+    def _rasterize_with_rsvg(self, svg_data: bytes) -> bytes:
+        """Rasterize SVG bytes with rsvg-convert (stdin to stdout)"""
+        result = subprocess.run(
+            [RSVG_CONVERT, '--width', '1200', '--height', '900', '--format', 'png'],
+            input=svg_data,
+            capture_output=True,
+            check=True,
+            timeout=120
+        )
+        return result.stdout
+    
+    def _rasterize_with_cairosvg(self, svg_data: bytes) -> bytes:
+        """Rasterize SVG bytes with cairosvg, retrying at the SVG's own size"""
+        import cairosvg
+        
+        try:
             # Convert with high resolution for better analysis
-            cairosvg.svg2png(
-                url=svg_path,
-                write_to=png_path,
+            return cairosvg.svg2png(
+                bytestring=svg_data,
                 output_width=1200,
                 output_height=900
             )
-            
-            logger.info(f"Converted SVG to PNG: {png_path}")
-            return png_path
-            
         except Exception as e:
             logger.error(f"Error converting SVG to PNG: {e}")
             
-            # Fallback: Try with PIL
-            try:
-                from PIL import Image
-                from io import BytesIO
-                import cairosvg
-                
-                png_data = cairosvg.svg2png(url=svg_path)
-                image = Image.open(BytesIO(png_data))
-                
-                png_path = svg_path.replace('.svg', '_analysis.png')
-                image.save(png_path, 'PNG')
-                
-                return png_path
-            except Exception as e2:
-                logger.error(f"Fallback conversion failed: {e2}")
-                return None
+            # Fallback: let cairosvg pick the size from the SVG itself
+            return cairosvg.svg2png(bytestring=svg_data)
+    
+    def _store_png(self, png_path: Path, png_data: bytes):
+        """Atomically write a rendered PNG (tmp file + os.replace)"""
+        fd, tmp_path = tempfile.mkstemp(dir=png_path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(png_data)
+        os.replace(tmp_path, png_path)
     
     def _create_visual_prompt(self, manifest: Dict) -> str:
         """Create prompt for Gemini Vision analysis"""
-        
-        stats = manifest.get("statistics", {})
-        layers = manifest.get("layers", [])
-        units = manifest.get("units", "unknown")
-        
-        prompt = f"""Analyze this CAD/technical drawing image. Be specific and concise.
-
-Drawing Stats:
-- Units: {units}
-- Entities: {stats.get('total_entities', 0)}
-- Layers: {len(layers)}
-
-Provide a clear, technical description (3-5 sentences):
-1. Drawing type (mechanical part, circuit, building plan, etc.)
-2. Main components visible
-3. Overall layout/arrangement
-4. Key features or notable elements
-
-Be direct and factual. Focus on what IS visible, not what could be there."""
-        
-        return prompt
+        return VISUAL_PROMPT_TEMPLATE.format(
+            units=manifest.get("units", "unknown"),
+            total_entities=manifest.get("statistics", {}).get('total_entities', 0),
+            layer_count=len(manifest.get("layers", []))
+        )
     
     def _combine_analyses(
         self, 
@@ -148,13 +235,7 @@ Be direct and factual. Focus on what IS visible, not what could be there."""
     ) -> str:
         """Combine visual analysis with entity data"""
         
-        # Extract text entities
-        text_entities = []
-        for entity in manifest.get("entities", []):
-            if entity.get("raw_text"):
-                layer = entity.get("layer", "unknown")
-                text = entity["raw_text"]
-                text_entities.append(f"[{layer}] {text}")
+        text_entities = _text_entities(manifest)
         
         # Build combined description
         parts = [
@@ -200,8 +281,6 @@ Be direct and factual. Focus on what IS visible, not what could be there."""
             "Text Annotations:"
         ]
         
-        for entity in manifest.get("entities", []):
-            if entity.get("raw_text"):
-                parts.append(f"- [{entity.get('layer')}] {entity['raw_text']}")
+        parts.extend(f"- {line}" for line in _text_entities(manifest))
         
         return "\n".join(parts)
\ No newline at end of file
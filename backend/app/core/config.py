@@ -6,6 +6,8 @@ class Settings(BaseSettings):
     GOOGLE_API_KEY: str
     PINECONE_API_KEY: str
     PINECONE_INDEX_NAME: str = "documind-index"
+    # Set when the index is provisioned ahead of time to skip the startup existence check
+    PINECONE_ASSUME_INDEX_EXISTS: bool = False
     OPENROUTER_API_KEY: str = ""  # Now loaded from .env
     LLM_MODEL: str = "models/gemini-flash-latest"
     EMBEDDING_MODEL: str = "models/text-embedding-004"
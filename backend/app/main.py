@@ -4,6 +4,7 @@ from fastapi.responses import JSONResponse
 import logging
 from app.core.config import get_settings
 from app.api.routes import router
+from app.services.conversation_service import conversation_service
 
 # Configure logging
 logging.basicConfig(
@@ -42,6 +43,11 @@ async def root():
         "docs": "/docs"
     }
 
+@app.on_event("shutdown")
+async def flush_conversations():
+    """Write pending conversation changes before the process exits"""
+    conversation_service.flush()
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Global exception handler"""
@@ -1,4 +1,7 @@
-import json
+import atexit
+import orjson
+import os
+import threading
 import uuid
 from datetime import datetime
 from pathlib import Path
@@ -10,34 +13,90 @@ from app.models.conversation import Conversation, Message
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Changes are written at most this long after they happen, coalescing bursts
+FLUSH_DELAY_SECONDS = 0.5
+
 class ConversationService:
     """Service for managing conversation history"""
     
     def __init__(self):
         self.data_dir = Path(settings.UPLOAD_DIR).parent / "conversations"
         self.data_dir.mkdir(parents=True, exist_ok=True)
+        # Legacy single-file store; migrated to one file per conversation on load
         self.conversations_file = self.data_dir / "conversations.json"
         self.conversations = self._load_conversations()
+        
+        # Conversations changed since the last flush; written by a one-shot timer
+        self._dirty = set()
+        self._flush_lock = threading.Lock()
+        self._flush_timer = None
+        atexit.register(self.flush)
+        
         logger.info(f"ConversationService initialized. Data dir: {self.data_dir}")
     
+    def _conversation_path(self, conv_id: str) -> Path:
+        """File holding a single conversation"""
+        return self.data_dir / f"{conv_id}.json"
+    
     def _load_conversations(self) -> dict:
-        """Load conversations from file"""
+        """Load conversations from their per-conversation files"""
+        conversations = {}
+        for path in self.data_dir.glob("*.json"):
+            if path == self.conversations_file:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    conv = orjson.loads(f.read())
+                conversations[conv["id"]] = conv
+            except Exception as e:
+                logger.error(f"Error loading conversation {path.name}: {e}")
+        
         if self.conversations_file.exists():
             try:
-                with open(self.conversations_file, 'r') as f:
-                    return json.load(f)
+                with open(self.conversations_file, 'rb') as f:
+                    legacy = orjson.loads(f.read())
+                for conv_id, conv in legacy.items():
+                    conversations.setdefault(conv_id, conv)
+                    self._save_conversation(conv_id, conversations[conv_id])
+                self.conversations_file.unlink()
+                logger.info(f"Migrated {len(legacy)} conversations to per-conversation files")
             except Exception as e:
-                logger.error(f"Error loading conversations: {e}")
-                return {}
-        return {}
+                logger.error(f"Error migrating conversations: {e}")
+        
+        return conversations
     
-    def _save_conversations(self):
-        """Save conversations to file"""
+    def _save_conversation(self, conv_id: str, conv: dict = None):
+        """Save one conversation to its own file (other conversations are untouched)"""
         try:
-            with open(self.conversations_file, 'w') as f:
-                json.dump(self.conversations, f, indent=2)
+            # Write a sibling tmp file and swap it in, so a crash never leaves torn JSON
+            path = self._conversation_path(conv_id)
+            tmp_path = path.with_suffix('.json.tmp')
+            tmp_path.write_bytes(orjson.dumps(conv or self.conversations[conv_id]))
+            os.replace(tmp_path, path)
         except Exception as e:
-            logger.error(f"Error saving conversations: {e}")
+            logger.error(f"Error saving conversation {conv_id}: {e}")
+    
+    def _mark_dirty(self, conv_id: str):
+        """Queue a conversation for the next flush, scheduling one if none is pending"""
+        with self._flush_lock:
+            self._dirty.add(conv_id)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(FLUSH_DELAY_SECONDS, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+    
+    def flush(self):
+        """Write every conversation changed since the last flush"""
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            
+            dirty, self._dirty = self._dirty, set()
+            for conv_id in dirty:
+                conv = self.conversations.get(conv_id)
+                if conv is not None:
+                    self._save_conversation(conv_id, conv)
     
     def _generate_title(self, first_message: str) -> str:
         """Generate a title from the first message"""
@@ -61,7 +120,7 @@ class ConversationService:
         }
         
         self.conversations[conv_id] = conversation
-        self._save_conversations()
+        self._mark_dirty(conv_id)
         
         logger.info(f"Created conversation: {conv_id} with documents: {document_ids}")
         return Conversation(**conversation)
@@ -73,17 +132,18 @@ class ConversationService:
             return Conversation(**conv)
         return None
     
-    def get_all_conversations(self) -> List[Conversation]:
-        """Get all conversations sorted by updated_at"""
-        conversations = [
-            Conversation(**conv) 
-            for conv in self.conversations.values()
-        ]
-        conversations.sort(
-            key=lambda x: x.updated_at, 
+    def get_all_conversations(self) -> List[dict]:
+        """
+        Get all conversations sorted by updated_at
+        
+        Returns the stored dicts; the route's response_model validates them
+        once on serialization, so no Conversation objects are built here.
+        """
+        return sorted(
+            self.conversations.values(),
+            key=lambda conv: conv["updated_at"],
             reverse=True
         )
-        return conversations
     
     def add_message(
         self, 
@@ -104,7 +164,7 @@ class ConversationService:
         if auto_title and len(conv["messages"]) == 1 and message.role == "user":
             conv["title"] = self._generate_title(message.content)
         
-        self._save_conversations()
+        self._mark_dirty(conv_id)
         logger.info(f"Added message to conversation: {conv_id}")
         
         return Conversation(**conv)
@@ -116,7 +176,7 @@ class ConversationService:
         
         self.conversations[conv_id]["title"] = title
         self.conversations[conv_id]["updated_at"] = datetime.now().isoformat()
-        self._save_conversations()
+        self._mark_dirty(conv_id)
         
         logger.info(f"Updated title for conversation: {conv_id}")
         return Conversation(**self.conversations[conv_id])
@@ -128,7 +188,7 @@ class ConversationService:
         
         self.conversations[conv_id]["document_ids"] = document_ids
         self.conversations[conv_id]["updated_at"] = datetime.now().isoformat()
-        self._save_conversations()
+        self._mark_dirty(conv_id)
         
         logger.info(f"Updated documents for conversation: {conv_id} to {document_ids}")
         return Conversation(**self.conversations[conv_id])
@@ -137,7 +197,9 @@ class ConversationService:
         """Delete a conversation"""
         if conv_id in self.conversations:
             del self.conversations[conv_id]
-            self._save_conversations()
+            with self._flush_lock:
+                self._dirty.discard(conv_id)
+                self._conversation_path(conv_id).unlink(missing_ok=True)
             logger.info(f"Deleted conversation: {conv_id}")
             return True
         return False
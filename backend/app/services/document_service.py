@@ -1,18 +1,41 @@
+import asyncio
+import functools
 import os
 import shutil
 from datetime import datetime
 from typing import List
 import uuid
-import json
+import orjson
 import logging
 from pathlib import Path
+import aiofiles
 from app.core.config import get_settings
+from app.services.rag_service import get_rag_service
 from app.utils.document_loader import DocumentLoader
 from app.utils.document_loader import document_loader
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+@functools.lru_cache(maxsize=128)
+def _load_json(path: str, mtime_ns: int) -> dict:
+    """Parse a JSON file; mtime_ns is part of the cache key so rewrites invalidate it"""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def _unlink_if_exists(path: Path) -> bool:
+    """Remove a file without a separate exists() stat; returns whether it was there"""
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
 class DocumentService:
     """Service for document management with advanced CAD support"""
     
@@ -34,8 +57,8 @@ class DocumentService:
         """Load document metadata from file"""
         if self.metadata_file.exists():
             try:
-                with open(self.metadata_file, 'r') as f:
-                    data = json.load(f)
+                with open(self.metadata_file, 'rb') as f:
+                    data = orjson.loads(f.read())
                     logger.info(f"Loaded {len(data)} documents from metadata")
                     return data
             except Exception as e:
@@ -46,8 +69,10 @@ class DocumentService:
     def _save_metadata(self):
         """Save document metadata to file"""
         try:
-            with open(self.metadata_file, 'w') as f:
-                json.dump(self.documents, f, indent=2)
+            # Write a sibling tmp file and swap it in, so a crash never leaves torn JSON
+            tmp_path = self.metadata_file.with_suffix('.json.tmp')
+            tmp_path.write_bytes(orjson.dumps(self.documents))
+            os.replace(tmp_path, self.metadata_file)
             logger.info(f"Saved metadata for {len(self.documents)} documents")
         except Exception as e:
             logger.error(f"Error saving metadata: {e}")
@@ -61,8 +86,6 @@ class DocumentService:
         """Upload and process document with advanced CAD analysis"""
         file_path = None
         try:
-            from app.services.rag_service import get_rag_service
-            
             logger.info(f"Starting upload for file: {filename}")
             
             # Generate unique ID
@@ -73,10 +96,10 @@ class DocumentService:
             
             logger.info(f"Saving file to: {file_path}")
             
-            # Save file
-            with open(file_path, 'wb') as f:
-                content = await file.read()
-                f.write(content)
+            # Save file in 1 MiB chunks so large uploads never sit in memory whole
+            async with aiofiles.open(file_path, 'wb') as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
             
             file_size = os.path.getsize(file_path)
             logger.info(f"File saved. Size: {file_size} bytes")
@@ -87,15 +110,26 @@ class DocumentService:
             if is_cad:
                 logger.info("🔧 CAD file detected - using ADVANCED analysis pipeline")
             
+            # DXF previews don't feed the index, so render them while indexing runs
+            render_separately = file_ext.lower() == '.dxf'
+            
             # Load document (will use advanced CAD loader if CAD file)
             logger.info("Loading document...")
-            documents = document_loader.load_document(str(file_path), doc_id, filename)
+            documents = await asyncio.to_thread(
+                document_loader.load_document,
+                str(file_path), doc_id, filename, render_cad=not render_separately
+            )
             logger.info(f"Loaded {len(documents)} document(s)")
             
             # Index documents
             logger.info("Indexing documents...")
             rag_service = get_rag_service()
-            rag_service.index_documents(documents, doc_id)
+            tasks = [rag_service.aindex_documents(documents, doc_id)]
+            if render_separately:
+                tasks.append(asyncio.to_thread(
+                    document_loader.cad_loader.render_previews, str(file_path), doc_id
+                ))
+            await asyncio.gather(*tasks)
             logger.info("Documents indexed successfully")
             
             # Store metadata
@@ -117,16 +151,18 @@ class DocumentService:
                 
                 if manifest_path.exists():
                     doc_metadata["cad_manifest"] = str(manifest_path)
-                if analysis_path.exists():
+                # Opening the analysis doubles as the existence check
+                try:
+                    with open(analysis_path, 'rb') as f:
+                        analysis_data = orjson.loads(f.read())
                     doc_metadata["cad_analysis"] = str(analysis_path)
                     # Load analysis summary for quick access
-                    try:
-                        with open(analysis_path, 'r') as f:
-                            analysis_data = json.load(f)
-                            if 'summary' in analysis_data:
-                                doc_metadata["analysis_summary"] = analysis_data['summary'].get('executive_summary', '')[:500]
-                    except:
-                        pass
+                    if 'summary' in analysis_data:
+                        doc_metadata["analysis_summary"] = analysis_data['summary'].get('executive_summary', '')[:500]
+                except FileNotFoundError:
+                    pass
+                except:
+                    doc_metadata["cad_analysis"] = str(analysis_path)
                 if svg_path.exists():
                     doc_metadata["cad_render"] = str(svg_path)
             
@@ -157,6 +193,14 @@ class DocumentService:
         """Get single document"""
         return self.documents.get(doc_id)
     
+    def _read_cached_json(self, path: Path) -> dict:
+        """
+        Load a manifest/analysis JSON through the (path, mtime) LRU cache
+        
+        The returned dict is shared between callers and must be treated as read-only.
+        """
+        return _load_json(str(path), os.stat(path).st_mtime_ns)
+    
     def get_cad_manifest(self, doc_id: str) -> dict:
         """Get CAD manifest for a document"""
         if doc_id not in self.documents:
@@ -167,12 +211,11 @@ class DocumentService:
             return None
         
         manifest_path = self.cad_manifest_dir / f"{doc_id}_manifest.json"
-        if not manifest_path.exists():
-            return None
         
         try:
-            with open(manifest_path, 'r') as f:
-                return json.load(f)
+            return self._read_cached_json(manifest_path)
+        except FileNotFoundError:
+            return None
         except Exception as e:
             logger.error(f"Error loading CAD manifest: {e}")
             return None
@@ -187,21 +230,18 @@ class DocumentService:
             return None
         
         analysis_path = self.cad_manifest_dir / f"{doc_id}_analysis.json"
-        if not analysis_path.exists():
-            return None
         
         try:
-            with open(analysis_path, 'r') as f:
-                return json.load(f)
+            return self._read_cached_json(analysis_path)
+        except FileNotFoundError:
+            return None
         except Exception as e:
             logger.error(f"Error loading CAD analysis: {e}")
             return None
     
-    def delete_document(self, doc_id: str) -> bool:
+    async def delete_document(self, doc_id: str) -> bool:
         """Delete document and all associated files"""
         try:
-            from app.services.rag_service import get_rag_service
-            
             logger.info(f"Attempting to delete document: {doc_id}")
             
             if doc_id not in self.documents:
@@ -214,40 +254,26 @@ class DocumentService:
             # Delete from vector store FIRST
             logger.info("Deleting from vector store...")
             rag_service = get_rag_service()
-            rag_service.delete_document(doc_id)
-            
-            # Delete physical file
-            if file_path.exists():
-                os.remove(file_path)
-                logger.info(f"Deleted file: {file_path}")
-            else:
-                logger.warning(f"File not found: {file_path}")
+            await asyncio.to_thread(rag_service.delete_document, doc_id)
             
-            # Delete CAD-specific files if they exist
+            # Delete the upload and any CAD artifacts concurrently
+            paths = {"file": file_path}
             if doc.get('is_cad', False):
-                # Delete manifest
-                manifest_path = self.cad_manifest_dir / f"{doc_id}_manifest.json"
-                if manifest_path.exists():
-                    os.remove(manifest_path)
-                    logger.info(f"Deleted CAD manifest: {manifest_path}")
-                
-                # Delete analysis
-                analysis_path = self.cad_manifest_dir / f"{doc_id}_analysis.json"
-                if analysis_path.exists():
-                    os.remove(analysis_path)
-                    logger.info(f"Deleted CAD analysis: {analysis_path}")
-                
-                # Delete SVG render
-                svg_path = self.cad_render_dir / f"{doc_id}_render.svg"
-                if svg_path.exists():
-                    os.remove(svg_path)
-                    logger.info(f"Deleted CAD render: {svg_path}")
-                
-                # Delete PNG analysis image
-                png_path = self.cad_render_dir / f"{doc_id}_analysis.png"
-                if png_path.exists():
-                    os.remove(png_path)
-                    logger.info(f"Deleted CAD PNG: {png_path}")
+                paths.update({
+                    "CAD manifest": self.cad_manifest_dir / f"{doc_id}_manifest.json",
+                    "CAD analysis": self.cad_manifest_dir / f"{doc_id}_analysis.json",
+                    "CAD render": self.cad_render_dir / f"{doc_id}_render.svg",
+                    "CAD PNG": self.cad_render_dir / f"{doc_id}_analysis.png",
+                })
+            
+            removed = await asyncio.gather(
+                *(asyncio.to_thread(_unlink_if_exists, path) for path in paths.values())
+            )
+            for (label, path), was_removed in zip(paths.items(), removed):
+                if was_removed:
+                    logger.info(f"Deleted {label}: {path}")
+            if not removed[0]:
+                logger.warning(f"File not found: {file_path}")
             
             # Remove from metadata
             del self.documents[doc_id]
@@ -2,17 +2,184 @@ from llama_index.core import VectorStoreIndex, StorageContext, Settings
 from llama_index.vector_stores.pinecone import PineconeVectorStore
 from llama_index.embeddings.gemini import GeminiEmbedding
 from llama_index.llms.gemini import Gemini
-from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from llama_index.core.bridge.pydantic import PrivateAttr
 from pinecone import Pinecone, ServerlessSpec
+import asyncio
+import hashlib
 import logging
-from typing import List, Optional
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator, List, Optional, Tuple
 from app.core.config import get_settings
+from app.utils.text_splitter import SplitMergeSplitter
 import time
 import re
+import uuid
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Gemini's batchEmbedContents takes at most 100 texts and ~4 MB per request
+EMBED_BATCH_SIZE = 100
+EMBED_BATCH_MAX_CHARS = 3_000_000
+# Embedding requests in flight at once per indexing call (Gemini RPM limits)
+EMBED_MAX_CONCURRENCY = 8
+# Embedded batches waiting for the upsert stage; embedding pauses when it is full
+UPSERT_QUEUE_SIZE = 4
+# Answers kept per process; cleared whenever documents are indexed or deleted
+RESPONSE_CACHE_SIZE = 1024
+# Query embeddings kept per process (a pure function of the prompt text)
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+
+# Query prompts, filled in with str.format(query_text=...)
+MINDMAP_PROMPT_TEMPLATE = """Based on the document content, create a clear mind map about: {query_text}
+
+RESPONSE FORMAT (STRICT):
+First, write 2-3 sentences explaining the topic naturally.
+
+Then write exactly: MERMAID_START
+Then write the mermaid code starting with: graph TD
+Then write exactly: MERMAID_END
+
+MERMAID RULES:
+- Use simple labels (3-5 words max)
+- Use single quotes only
+- No special characters in labels
+- Use clear hierarchy
+- Maximum 10 nodes
+
+Example:
+The UAV project focuses on detecting corrosion using advanced sensors.
+
+MERMAID_START
+graph TD
+    A[UAV System] --> B[Hardware]
+    A --> C[Software]
+    B --> D[ZED2 Camera]
+    B --> E[LiDAR]
+    C --> F[AI Processing]
+MERMAID_END
+"""
+
+# Improved prompt for concise responses
+ANSWER_PROMPT_TEMPLATE = """Answer this question directly and concisely based on the document data provided.
+
+Question: {query_text}
+
+INSTRUCTIONS:
+- Give a direct, focused answer (2-4 sentences for simple questions)
+- For CAD drawings, be specific about what you see in the data
+- If asking about visual elements, use the visual analysis data
+- If asking about text/dimensions, cite specific entities
+- Don't explain what you CAN'T see - focus on what IS in the data
+- Be technical but clear
+- If the data doesn't contain the answer, say so briefly
+
+IMPORTANT: Base your answer ONLY on the document data provided. Be concise and specific."""
+
+# Code fences models like to wrap the mindmap block in
+_FENCE_RE = re.compile(r"```(?:mermaid)?\n?")
+# Queries asking for a mind map; plain substrings, so "workflow" and "charts" match too
+_MINDMAP_RE = re.compile(
+    r"mind ?map|diagram|structure|visualiz(?:e|ation)|chart|graph|relationship|overview|flow|map out"
+)
+
+
+# Longest wait for a newly created Pinecone index to report ready
+INDEX_READY_TIMEOUT = 60
+# Pinecone indexes this process has already confirmed or created
+_known_indexes = set()
+
+
+def _vector_id_prefix(doc_id: str) -> str:
+    """Prefix shared by the Pinecone vector IDs of one document"""
+    return f"{doc_id}#"
+
+
+class _LRUCache:
+    """Small thread-safe LRU mapping; query() runs on several worker threads"""
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+    
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachedQueryGeminiEmbedding(GeminiEmbedding):
+    """
+    GeminiEmbedding that remembers query embeddings, so repeated retrievals
+    skip the API call, and sends synchronous text batches as one request
+    """
+    
+    _query_cache: _LRUCache = PrivateAttr(default_factory=lambda: _LRUCache(QUERY_EMBEDDING_CACHE_SIZE))
+    
+    def _get_query_embedding(self, query: str) -> List[float]:
+        embedding = self._query_cache.get(query)
+        if embedding is None:
+            embedding = super()._get_query_embedding(query)
+            self._query_cache.put(query, embedding)
+        return embedding
+    
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        embedding = self._query_cache.get(query)
+        if embedding is None:
+            embedding = await super()._aget_query_embedding(query)
+            self._query_cache.put(query, embedding)
+        return embedding
+    
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # Upstream loops embed_content once per text; given a list, genai sends
+        # batchEmbedContents requests instead (as the async variant already does)
+        return self._model.embed_content(
+            model=self.model_name,
+            content=texts,
+            title=self.title,
+            task_type=self.task_type,
+            request_options=self._request_options,
+        )["embedding"]
+
+
+def _response_cache_key(query_text: str, doc_ids: Optional[List[str]], mindmap: bool) -> Tuple:
+    """Response cache key: hash of the case- and whitespace-normalized query, plus doc_ids and mode"""
+    normalized = " ".join(query_text.lower().split())
+    return (
+        hashlib.sha1(normalized.encode()).digest(),
+        tuple(sorted(doc_ids or ())),
+        mindmap
+    )
+
+
+def _embedding_batches(texts: List[str]) -> Iterator[slice]:
+    """Slices of texts holding at most EMBED_BATCH_SIZE texts and EMBED_BATCH_MAX_CHARS characters"""
+    start, batch_chars = 0, 0
+    for i, text in enumerate(texts):
+        if i > start and (i - start == EMBED_BATCH_SIZE or batch_chars + len(text) > EMBED_BATCH_MAX_CHARS):
+            yield slice(start, i)
+            start, batch_chars = i, 0
+        batch_chars += len(text)
+    if start < len(texts):
+        yield slice(start, len(texts))
+
+
 class RAGService:
     """Service for RAG operations using LlamaIndex and Pinecone"""
     
@@ -24,6 +191,11 @@ class RAGService:
         self.storage_context = None
         self.llm = None
         self.embed_model = None
+        self._query_index = None
+        # Query engines keyed by (similarity_top_k, response_mode)
+        self._query_engines = {}
+        # Successful query() results; see RESPONSE_CACHE_SIZE
+        self._response_cache = _LRUCache(RESPONSE_CACHE_SIZE)
         self._initialize()
     
     def _initialize(self):
@@ -36,29 +208,13 @@ class RAGService:
             self.pc = Pinecone(api_key=self.settings.PINECONE_API_KEY)
             index_name = self.settings.PINECONE_INDEX_NAME
             
-            try:
-                existing_indexes = self.pc.list_indexes()
-                if hasattr(existing_indexes, 'indexes'):
-                    index_names = [idx.name for idx in existing_indexes.indexes]
-                else:
-                    index_names = [idx['name'] for idx in existing_indexes]
-            except Exception as e:
-                logger.warning(f"Error listing indexes: {e}")
-                index_names = []
-            
-            if index_name not in index_names:
-                logger.info(f"Creating Pinecone index: {index_name}")
-                self.pc.create_index(
-                    name=index_name,
-                    dimension=768,
-                    metric="cosine",
-                    spec=ServerlessSpec(
-                        cloud="aws",
-                        region="us-east-1"
-                    )
-                )
-                logger.info("Waiting for index to be ready...")
-                time.sleep(10)
+            # Skip the list_indexes round-trip when the deployment vouches for
+            # the index (PINECONE_ASSUME_INDEX_EXISTS) or this process checked it already
+            if self.settings.PINECONE_ASSUME_INDEX_EXISTS or index_name in _known_indexes:
+                logger.info(f"Assuming Pinecone index exists: {index_name}")
+            else:
+                self._ensure_index(index_name)
+                _known_indexes.add(index_name)
             
             self.pinecone_index = self.pc.Index(index_name)
             logger.info(f"Connected to Pinecone index: {index_name}")
@@ -71,9 +227,10 @@ class RAGService:
                 vector_store=self.vector_store
             )
             
-            self.embed_model = GeminiEmbedding(
+            self.embed_model = CachedQueryGeminiEmbedding(
                 model_name=self.settings.EMBEDDING_MODEL,
-                api_key=self.settings.GOOGLE_API_KEY
+                api_key=self.settings.GOOGLE_API_KEY,
+                embed_batch_size=EMBED_BATCH_SIZE
             )
             
             # Use higher temperature for more natural responses
@@ -88,6 +245,11 @@ class RAGService:
             Settings.chunk_size = self.settings.CHUNK_SIZE
             Settings.chunk_overlap = self.settings.CHUNK_OVERLAP
             
+            # Built once (after Settings carry the embed model and LLM) and reused by every query
+            self._query_index = VectorStoreIndex.from_vector_store(
+                vector_store=self.vector_store
+            )
+            
             logger.info("RAG Service initialized successfully")
             
         except Exception as e:
@@ -95,24 +257,61 @@ class RAGService:
             logger.exception("Full traceback:")
             raise
     
+    def _ensure_index(self, index_name: str):
+        """Create the Pinecone index if it doesn't exist yet"""
+        try:
+            existing_indexes = self.pc.list_indexes()
+            if hasattr(existing_indexes, 'indexes'):
+                index_names = [idx.name for idx in existing_indexes.indexes]
+            else:
+                index_names = [idx['name'] for idx in existing_indexes]
+        except Exception as e:
+            logger.warning(f"Error listing indexes: {e}")
+            index_names = []
+        
+        if index_name not in index_names:
+            logger.info(f"Creating Pinecone index: {index_name}")
+            self.pc.create_index(
+                name=index_name,
+                dimension=768,
+                metric="cosine",
+                spec=ServerlessSpec(
+                    cloud="aws",
+                    region="us-east-1"
+                )
+            )
+            logger.info("Waiting for index to be ready...")
+            self._wait_for_index_ready(index_name)
+    
+    def _wait_for_index_ready(self, index_name: str):
+        """Poll describe_index with backoff until the index reports ready (or INDEX_READY_TIMEOUT passes)"""
+        deadline = time.monotonic() + INDEX_READY_TIMEOUT
+        delay = 0.5
+        while time.monotonic() < deadline:
+            status = getattr(self.pc.describe_index(index_name), 'status', None)
+            if getattr(status, 'ready', False):
+                return
+            time.sleep(delay)
+            delay = min(delay * 1.5, 3)
+        logger.warning(f"Index {index_name} not ready after {INDEX_READY_TIMEOUT}s; continuing")
+    
     def index_documents(self, documents: List, doc_id: str) -> bool:
-        """Index documents into Pinecone"""
+        """Index documents into Pinecone (blocking wrapper around aindex_documents)"""
+        return asyncio.run(self.aindex_documents(documents, doc_id))
+    
+    async def aindex_documents(self, documents: List, doc_id: str) -> bool:
+        """
+        Index documents into Pinecone without blocking the event loop
+        
+        Embedding batches go to Gemini concurrently (bounded by
+        EMBED_MAX_CONCURRENCY) and are upserted as they finish; chunking and
+        the Pinecone upsert, which have no async API here, run in worker threads.
+        """
         try:
             logger.info(f"Starting indexing for doc_id: {doc_id}")
             logger.info(f"Number of documents to index: {len(documents)}")
             
-            for doc in documents:
-                if not hasattr(doc, 'metadata') or doc.metadata is None:
-                    doc.metadata = {}
-                doc.metadata["doc_id"] = doc_id
-                logger.info(f"Document text length: {len(doc.text)}")
-            
-            node_parser = SentenceSplitter(
-                chunk_size=self.settings.CHUNK_SIZE,
-                chunk_overlap=self.settings.CHUNK_OVERLAP
-            )
-            
-            nodes = node_parser.get_nodes_from_documents(documents)
+            nodes = await asyncio.to_thread(self._build_nodes, documents, doc_id)
             
             logger.info(f"Created {len(nodes)} nodes from documents")
             
@@ -120,13 +319,42 @@ class RAGService:
                 logger.error("No nodes created from documents!")
                 raise ValueError("Failed to create nodes from documents")
             
-            logger.info("Creating VectorStoreIndex...")
-            index = VectorStoreIndex(
-                nodes,
-                storage_context=self.storage_context,
-                show_progress=True
-            )
-            
+            # Two overlapping stages: embedding batches go to Gemini concurrently
+            # (one request per batch) and each finished batch is queued for a
+            # single upsert worker, so Pinecone writes run while embedding continues
+            logger.info("Embedding and upserting nodes...")
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            semaphore = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
+            upsert_queue: asyncio.Queue = asyncio.Queue(maxsize=UPSERT_QUEUE_SIZE)
+            
+            async def embed(batch: slice):
+                async with semaphore:
+                    embeddings = await self.embed_model.aget_text_embedding_batch(texts[batch])
+                for node, embedding in zip(nodes[batch], embeddings):
+                    node.embedding = embedding
+                await upsert_queue.put(nodes[batch])
+            
+            async def embed_all():
+                await asyncio.gather(*(embed(batch) for batch in _embedding_batches(texts)))
+                await upsert_queue.put(None)
+            
+            async def upsert_worker():
+                while (batch_nodes := await upsert_queue.get()) is not None:
+                    await asyncio.to_thread(self.vector_store.add, batch_nodes)
+            
+            # A failure in either stage cancels the other and the original error is
+            # raised (gather + cancel rather than TaskGroup, which needs Python 3.11)
+            stages = [asyncio.create_task(embed_all()), asyncio.create_task(upsert_worker())]
+            try:
+                await asyncio.gather(*stages)
+            except BaseException:
+                for stage in stages:
+                    stage.cancel()
+                await asyncio.gather(*stages, return_exceptions=True)
+                raise
+            
+            # Cached answers were built without this document
+            self._response_cache.clear()
             logger.info(f"Successfully indexed document: {doc_id}")
             return True
             
@@ -135,28 +363,35 @@ class RAGService:
             logger.exception("Full traceback:")
             raise
     
-    def _clean_mermaid_code(self, text: str) -> Optional[str]:
-        """Extract and clean Mermaid code from response"""
+    def _build_nodes(self, documents: List, doc_id: str) -> List:
+        """Tag documents with doc_id and split them into nodes"""
+        for doc in documents:
+            if not hasattr(doc, 'metadata') or doc.metadata is None:
+                doc.metadata = {}
+            doc.metadata["doc_id"] = doc_id
+            logger.info(f"Document text length: {len(doc.text)}")
+        
+        node_parser = SplitMergeSplitter(
+            chunk_size=self.settings.CHUNK_SIZE,
+            chunk_overlap=self.settings.CHUNK_OVERLAP,
+            # Vector IDs start with the doc_id so delete_document can list them by prefix
+            id_func=lambda i, doc: f"{_vector_id_prefix(doc_id)}{uuid.uuid4()}"
+        )
+        
+        return node_parser.get_nodes_from_documents(documents)
+    
+    def _clean_mermaid_code(self, block: str) -> Optional[str]:
+        """Clean Mermaid code extracted from between MERMAID_START and MERMAID_END"""
         try:
-            if "MERMAID_START" in text and "MERMAID_END" in text:
-                parts = text.split("MERMAID_START")
-                if len(parts) > 1:
-                    mermaid_part = parts[1].split("MERMAID_END")[0]
-                    code = mermaid_part.strip()
-                    
-                    code = re.sub(r'```mermaid\n?', '', code)
-                    code = re.sub(r'```\n?', '', code)
-                    code = code.strip()
-                    
-                    if not code.startswith(('graph', 'flowchart')):
-                        code = 'graph TD\n' + code
-                    
-                    code = code.replace('"', "'")
-                    
-                    logger.info(f"Cleaned Mermaid code:\n{code}")
-                    return code
+            code = _FENCE_RE.sub('', block.strip()).strip()
             
-            return None
+            if not code.startswith(('graph', 'flowchart')):
+                code = 'graph TD\n' + code
+            
+            code = code.replace('"', "'")
+            
+            logger.info(f"Cleaned Mermaid code:\n{code}")
+            return code
         except Exception as e:
             logger.error(f"Error cleaning Mermaid code: {e}")
             return None
@@ -172,79 +407,37 @@ class RAGService:
             logger.info(f"Querying: {query_text}")
             logger.info(f"Document IDs for filtering: {doc_ids}")
             
-            index = VectorStoreIndex.from_vector_store(
-                vector_store=self.vector_store
-            )
-            
             should_mindmap = return_mindmap or self._should_generate_mindmap(query_text)
             
-            # Build query engine - simplified without filtering
-            query_engine = index.as_query_engine(
-                similarity_top_k=self.settings.TOP_K,
-                response_mode="tree_summarize"
-            )
+            cache_key = _response_cache_key(query_text, doc_ids, should_mindmap)
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("♻️  Using cached response")
+                return dict(cached, sources=list(cached["sources"]))
+            
+            # Query engine - simplified without filtering
+            query_engine = self._get_query_engine(self.settings.TOP_K, "tree_summarize")
             
             logger.info(f"Query engine created with TOP_K={self.settings.TOP_K}")
             
             if should_mindmap:
-                mindmap_query = f"""Based on the document content, create a clear mind map about: {query_text}
-
-RESPONSE FORMAT (STRICT):
-First, write 2-3 sentences explaining the topic naturally.
-
-Then write exactly: MERMAID_START
-Then write the mermaid code starting with: graph TD
-Then write exactly: MERMAID_END
-
-MERMAID RULES:
-- Use simple labels (3-5 words max)
-- Use single quotes only
-- No special characters in labels
-- Use clear hierarchy
-- Maximum 10 nodes
-
-Example:
-The UAV project focuses on detecting corrosion using advanced sensors.
-
-MERMAID_START
-graph TD
-    A[UAV System] --> B[Hardware]
-    A --> C[Software]
-    B --> D[ZED2 Camera]
-    B --> E[LiDAR]
-    C --> F[AI Processing]
-MERMAID_END
-"""
-                response = query_engine.query(mindmap_query)
+                response = query_engine.query(MINDMAP_PROMPT_TEMPLATE.format(query_text=query_text))
             else:
-                
-                # IMPROVED PROMPT FOR CONCISE RESPONSES
-                full_query = f"""Answer this question directly and concisely based on the document data provided.
-
-Question: {query_text}
-
-INSTRUCTIONS:
-- Give a direct, focused answer (2-4 sentences for simple questions)
-- For CAD drawings, be specific about what you see in the data
-- If asking about visual elements, use the visual analysis data
-- If asking about text/dimensions, cite specific entities
-- Don't explain what you CAN'T see - focus on what IS in the data
-- Be technical but clear
-- If the data doesn't contain the answer, say so briefly
-
-IMPORTANT: Base your answer ONLY on the document data provided. Be concise and specific."""
-                
-                
                 logger.info(f"Sending query to LLM...")
-                response = query_engine.query(full_query)
+                response = query_engine.query(ANSWER_PROMPT_TEMPLATE.format(query_text=query_text))
             
             response_text = str(response)
             logger.info(f"Raw response length: {len(response_text)}")
             
-            mermaid_code = self._clean_mermaid_code(response_text)
-            
+            # One pass over the response: prose before MERMAID_START, block up to MERMAID_END
+            mermaid_code = None
+            head, start, tail = response_text.partition("MERMAID_START")
+            if start:
+                block, end, _ = tail.partition("MERMAID_END")
+                if end:
+                    mermaid_code = self._clean_mermaid_code(block)
             if mermaid_code:
-                response_text = response_text.split("MERMAID_START")[0].strip()
+                response_text = head.strip()
             
             # Extract sources
             sources = []
@@ -257,17 +450,21 @@ IMPORTANT: Base your answer ONLY on the document data provided. Be concise and s
             
             logger.info(f"Query completed. Response length: {len(response_text)}, Has mindmap: {mermaid_code is not None}")
             
-            # Check for too-short responses
-            if len(response_text) < 50 and not mermaid_code:
+            # Check for too-short responses (not cached, so a retry asks the LLM again)
+            too_short = len(response_text) < 50 and not mermaid_code
+            if too_short:
                 logger.warning(f"Response too short ({len(response_text)} chars)")
                 response_text = "I apologize, but I'm having trouble generating a proper response. This could be due to API limitations or the query not matching the document content well. Could you try rephrasing your question or asking something more specific about the document?"
             
-            return {
+            result = {
                 "response": response_text,
                 "has_mindmap": mermaid_code is not None,
                 "mermaid_code": mermaid_code,
                 "sources": list(set(sources))
             }
+            if not too_short:
+                self._response_cache.put(cache_key, result)
+            return dict(result, sources=list(result["sources"]))
             
         except Exception as e:
             logger.error(f"Error querying RAG system: {str(e)}")
@@ -287,24 +484,46 @@ IMPORTANT: Base your answer ONLY on the document data provided. Be concise and s
                 "sources": []
             }
     
+    def _get_query_engine(self, similarity_top_k: int, response_mode: str):
+        """Query engine over the cached index, built once per (top_k, response_mode)"""
+        key = (similarity_top_k, response_mode)
+        engine = self._query_engines.get(key)
+        if engine is None:
+            engine = self._query_index.as_query_engine(
+                similarity_top_k=similarity_top_k,
+                response_mode=response_mode,
+                # Only node text and metadata are used; skip the vector values
+                # PineconeVectorStore fetches by default
+                vector_store_kwargs={"include_values": False}
+            )
+            self._query_engines[key] = engine
+        return engine
+    
     def _should_generate_mindmap(self, query: str) -> bool:
         """Determine if query is asking for a mind map"""
-        mindmap_keywords = [
-            'mind map', 'mindmap', 'diagram', 'structure', 
-            'visualize', 'visualization', 'chart', 'graph',
-            'relationship', 'overview', 'flow', 'map out'
-        ]
-        query_lower = query.lower()
-        return any(keyword in query_lower for keyword in mindmap_keywords)
+        return _MINDMAP_RE.search(query.lower()) is not None
     
     def delete_document(self, doc_id: str) -> bool:
         """Delete document from vector store"""
         try:
             logger.info(f"Deleting document from Pinecone: {doc_id}")
             
-            # Delete all vectors with this doc_id
-            self.pinecone_index.delete(filter={"doc_id": doc_id})
+            # Delete by ID prefix: list the document's vector IDs (a page at a
+            # time) instead of having Pinecone scan metadata for a filter match
+            deleted = 0
+            try:
+                for ids in self.pinecone_index.list(prefix=_vector_id_prefix(doc_id)):
+                    self.pinecone_index.delete(ids=ids)
+                    deleted += len(ids)
+            except Exception as e:
+                logger.warning(f"Listing vectors by prefix failed: {e}")
+            
+            # Vectors indexed before IDs carried the doc_id prefix (or on pod indexes)
+            if not deleted:
+                self.pinecone_index.delete(filter={"doc_id": doc_id})
             
+            # Cached answers may cite the deleted document
+            self._response_cache.clear()
             logger.info(f"Successfully deleted document: {doc_id}")
             return True
         except Exception as e:
@@ -3,34 +3,55 @@ CAD Document Loader - Basic entity extraction only
 Advanced vision analysis is triggered on-demand via chat
 """
 
+import io
 import os
 import json
 import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 from pathlib import Path
 from typing import List, Dict, Any
 from llama_index.core import Document
 
 from app.cad.converter import convert_dwg_to_dxf
-from app.cad.entity_extractor import EntityExtractor
 from app.cad.parser import DXFParser
 from app.cad.renderer import CADRenderer
 from app.core.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+# cairosvg once imported, False once known to be missing (None: not tried yet).
+# A failed import isn't cached in sys.modules, so it would rescan sys.path per render
+_cairosvg = None
+
+
+def _get_cairosvg():
+    """cairosvg module, imported on first use, or None if it isn't installed"""
+    global _cairosvg
+    if _cairosvg is None:
+        try:
+            import cairosvg
+            _cairosvg = cairosvg
+        except ImportError:
+            _cairosvg = False
+    return _cairosvg or None
+
 
 class CADLoader:
     """Load and process CAD files - basic extraction only"""
     
     def __init__(self):
-        self.entity_extractor = EntityExtractor()
         self.parser = DXFParser(manifest_dir="cad_manifests")
         self.renderer = CADRenderer(render_dir="cad_renders")
         
-    def load_cad_file(self, file_path: str, file_id: str, file_name: str) -> Dict[str, Any]:
+    def load_cad_file(self, file_path: str, file_id: str, file_name: str, render: bool = True) -> Dict[str, Any]:
         """
         Load and process a CAD file (basic extraction)
         Advanced vision analysis is done on-demand via chat
+        
+        With render=False the SVG/PNG previews are skipped so the caller can
+        run render_previews() alongside indexing.
         """
         
         try:
@@ -61,31 +82,26 @@ class CADLoader:
             
             logger.info(f"Using DXF file: {dxf_path}")
             
-            # Step 2: Extract entities
-            logger.info("Extracting CAD entities...")
-            entity_data = self.entity_extractor.extract_all(dxf_path)
-            entities = entity_data.get('entities', [])
-            logger.info(f"Found {len(entities)} entities")
-            
-            # Step 3: Parse and create manifest
-            logger.info("Parsing DXF structure...")
-            manifest = self.parser.parse(dxf_path, file_id, file_name)
-            logger.info(f"Manifest created with {len(manifest.get('layers', []))} layers")
+            # Step 2: Parse and create manifest, rendering the SVG/PNG previews
+            # (for later advanced analysis) alongside; both only read the DXF
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                previews = pool.submit(self.render_previews, dxf_path, file_id) if render else None
+                
+                logger.info("Parsing DXF structure...")
+                manifest = self.parser.parse(dxf_path, file_id, file_name)
+                logger.info(f"Manifest created with {len(manifest.get('layers', []))} layers")
+                
+                if previews:
+                    previews.result()
             
-            # Step 4: Render to SVG and PNG (for later advanced analysis)
-            logger.info("Rendering to SVG...")
-            svg_path = self.renderer.render_to_svg(dxf_path, f"{file_id}_render")
+            if manifest.get('conversion_status') != 'success':
+                raise RuntimeError(manifest.get('error_message', 'DXF parsing failed'))
             
-            if svg_path:
-                logger.info(f"SVG rendered: {svg_path}")
-                # Convert to PNG for future vision analysis
-                png_path = str(Path(svg_path).with_name(f"{file_id}_analysis.png"))
-                self._convert_svg_to_png(svg_path, png_path)
-                logger.info(f"PNG created: {png_path}")
-            else:
-                logger.warning(f"SVG rendering failed")
+            # Step 3: The manifest carries the extracted entities; no second extraction pass
+            entities = manifest.get('entities', [])
+            logger.info(f"Found {len(entities)} entities")
             
-            # Step 5: Create Document for RAG (entity data only)
+            # Step 4: Create Document for RAG (entity data only)
             entity_text = self._format_entities(entities, manifest)
             doc = Document(
                 text=entity_text,
@@ -120,70 +136,82 @@ class CADLoader:
     
     def _format_entities(self, entities: List[Dict], manifest: Dict) -> str:
         """Format entities into searchable text"""
-        lines = []
-        lines.append("CAD ENTITY DATA")
-        lines.append("=" * 80)
-        lines.append("")
+        # Written straight into one buffer; large drawings produce thousands of lines
+        buf = io.StringIO()
+        w = buf.write
+        w("CAD ENTITY DATA\n")
+        w("=" * 80 + "\n\n")
         
         # Basic info
-        lines.append(f"Drawing Units: {manifest.get('units', 'Unknown')}")
-        lines.append(f"Total Entities: {len(entities)}")
+        w(f"Drawing Units: {manifest.get('units', 'Unknown')}\n")
+        w(f"Total Entities: {len(entities)}\n")
         
+        # Manifest layers are plain layer names
         layers = manifest.get('layers', [])
         if layers:
-            layer_names = [layer['name'] for layer in layers[:10]]
-            lines.append(f"Layers: {', '.join(layer_names)}")
-        lines.append("")
+            w(f"Layers: {', '.join(layers[:10])}\n")
+        w("\n")
         
         # Group by type
-        from collections import defaultdict
         by_type = defaultdict(list)
         for entity in entities:
             ent_type = entity.get('type', 'UNKNOWN')
             by_type[ent_type].append(entity)
         
-        # Text content
-        text_entities = by_type.get('TEXT', []) + by_type.get('MTEXT', [])
-        if text_entities:
-            lines.append("TEXT CONTENT")
-            lines.append("-" * 80)
-            for ent in text_entities[:100]:
+        # Text content (TEXT then MTEXT, chained rather than concatenated)
+        texts, mtexts = by_type.get('TEXT', []), by_type.get('MTEXT', [])
+        if texts or mtexts:
+            w("TEXT CONTENT\n")
+            w("-" * 80 + "\n")
+            for ent in islice(chain(texts, mtexts), 100):
                 text = ent.get('content', ent.get('raw_text', ''))
-                layer = ent.get('layer', 'Unknown')
                 if text:
-                    lines.append(f"  [{layer}] {text}")
-            lines.append("")
+                    w(f"  [{ent.get('layer', 'Unknown')}] {text}\n")
+            w("\n")
         
         # Dimensions
         dimensions = by_type.get('DIMENSION', [])
         if dimensions:
-            lines.append("DIMENSIONS")
-            lines.append("-" * 80)
+            w("DIMENSIONS\n")
+            w("-" * 80 + "\n")
             for dim in dimensions[:50]:
                 text = dim.get('text', dim.get('raw_text', 'N/A'))
                 if text:
-                    lines.append(f"  {text}")
-            lines.append("")
+                    w(f"  {text}\n")
+            w("\n")
         
         # Statistics
-        lines.append("ENTITY STATISTICS")
-        lines.append("-" * 80)
-        for ent_type, items in sorted(by_type.items()):
-            lines.append(f"  {ent_type}: {len(items)}")
+        w("ENTITY STATISTICS\n")
+        w("-" * 80)
+        w("".join(f"\n  {ent_type}: {len(items)}" for ent_type, items in sorted(by_type.items())))
+        
+        return buf.getvalue()
+    
+    def render_previews(self, dxf_path: str, file_id: str):
+        """Render the DXF to SVG for display and PNG for later vision analysis"""
+        logger.info("Rendering to SVG...")
+        svg_path = self.renderer.render_to_svg(dxf_path, f"{file_id}_render")
         
-        return "\n".join(lines)
+        if svg_path:
+            logger.info(f"SVG rendered: {svg_path}")
+            # Convert to PNG for future vision analysis
+            png_path = str(Path(svg_path).with_name(f"{file_id}_analysis.png"))
+            self._convert_svg_to_png(svg_path, png_path)
+            logger.info(f"PNG created: {png_path}")
+        else:
+            logger.warning(f"SVG rendering failed")
     
     def _convert_svg_to_png(self, svg_path: str, png_path: str, dpi: int = 300):
         """Convert SVG to high-resolution PNG"""
-        try:
-            import cairosvg
+        cairosvg = _get_cairosvg()
+        if cairosvg:
             cairosvg.svg2png(
                 url=svg_path,
                 write_to=png_path,
                 dpi=dpi,
                 output_width=4096
             )
-        except ImportError:
+        else:
             logger.warning("cairosvg not installed, using fallback")
             try:
                 from PIL import Image
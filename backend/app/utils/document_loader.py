@@ -2,18 +2,19 @@
 Document Loader - Load and parse various document types including CAD and 3D files
 """
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
-from typing import List
-import fitz  # PyMuPDF
-import pymupdf4llm
-from docx import Document as DocxDocument
+from typing import List, Tuple
 from llama_index.core import Document
 from app.utils.cad_loader import CADLoader
 from app.utils.stl_loader import STLLoader
-from unstructured.partition.auto import partition
 
 logger = logging.getLogger(__name__)
 
+# Files loaded at once by load_documents
+LOAD_MAX_WORKERS = 4
+
 class DocumentLoader:
     """Load documents from various file formats"""
     
@@ -21,7 +22,7 @@ class DocumentLoader:
         self.cad_loader = CADLoader()
         self.stl_loader = STLLoader()
     
-    def load_document(self, file_path: str, file_id: str = None, file_name: str = None) -> List[Document]:
+    def load_document(self, file_path: str, file_id: str = None, file_name: str = None, render_cad: bool = True) -> List[Document]:
         """
         Load document from file
         
@@ -29,6 +30,8 @@ class DocumentLoader:
             file_path: Path to the file
             file_id: Optional file ID for metadata
             file_name: Optional original filename
+            render_cad: Render CAD previews while loading; pass False to call
+                cad_loader.render_previews() separately
             
         Returns:
             List of Document objects
@@ -37,7 +40,7 @@ class DocumentLoader:
         
         # CAD files (DWG/DXF)
         if file_ext in ['.dwg', '.dxf']:
-            return self._load_cad(file_path, file_id, file_name)
+            return self._load_cad(file_path, file_id, file_name, render_cad)
         
         # 3D model files (STL)
         elif file_ext == '.stl':
@@ -59,11 +62,32 @@ class DocumentLoader:
         else:
             return self._load_with_unstructured(file_path, file_id, file_name)
     
-    def _load_cad(self, file_path: str, file_id: str, file_name: str) -> List[Document]:
+    def load_documents(self, items: List[Tuple[str, str, str]], render_cad: bool = True) -> List[Document]:
+        """
+        Load several files concurrently
+        
+        Args:
+            items: (file_path, file_id, file_name) per file
+            render_cad: Passed through to load_document
+            
+        Returns:
+            Documents of all files, in the order of items
+        """
+        if not items:
+            return []
+        
+        # Parsers release the GIL in PyMuPDF/cairo and file I/O, so a small pool overlaps them
+        with ThreadPoolExecutor(max_workers=min(LOAD_MAX_WORKERS, len(items))) as pool:
+            results = pool.map(
+                lambda item: self.load_document(*item, render_cad=render_cad), items
+            )
+            return list(chain.from_iterable(results))
+    
+    def _load_cad(self, file_path: str, file_id: str, file_name: str, render: bool = True) -> List[Document]:
         """Load CAD file (DWG/DXF)"""
         logger.info(f"Loading CAD: {file_path}")
         
-        result = self.cad_loader.load_cad_file(file_path, file_id, file_name)
+        result = self.cad_loader.load_cad_file(file_path, file_id, file_name, render=render)
         
         if not result["success"]:
             logger.warning(f"CAD loading failed: {result['error']}")
@@ -101,29 +125,50 @@ class DocumentLoader:
         return result["documents"]
     
     def _load_pdf(self, file_path: str, file_id: str = None, file_name: str = None) -> List[Document]:
-        """Load PDF file using PyMuPDF"""
+        """Load PDF file using PyMuPDF, one Document per page"""
         logger.info(f"Loading PDF: {file_path}")
         
         try:
-            md_text = pymupdf4llm.to_markdown(file_path)
+            # Imported on first use so workers that never see a PDF don't pay for them
+            import fitz  # PyMuPDF
+            import pymupdf4llm
             
             doc = fitz.open(file_path)
-            num_pages = len(doc)
-            doc.close()
-            
-            logger.info(f"Extracted {len(md_text)} characters from {num_pages} pages")
+            try:
+                num_pages = len(doc)
+                
+                metadata = {
+                    "file_type": "pdf",
+                    "num_pages": num_pages
+                }
+                
+                if file_id:
+                    metadata["doc_id"] = file_id
+                if file_name:
+                    metadata["file_name"] = file_name
+                
+                # Heading font sizes are identified once for the whole PDF;
+                # to_markdown would otherwise rescan every page on each call
+                hdr_info = pymupdf4llm.IdentifyHeaders(doc)
+                
+                # Page by page instead of one whole-document markdown string
+                # (which to_markdown builds by repeated concatenation)
+                documents = []
+                num_chars = 0
+                for page_number in range(num_pages):
+                    md_text = pymupdf4llm.to_markdown(
+                        doc, pages=[page_number], hdr_info=hdr_info, show_progress=False
+                    )
+                    if not md_text.strip():
+                        continue
+                    num_chars += len(md_text)
+                    documents.append(Document(text=md_text, metadata={**metadata, "page": page_number + 1}))
+            finally:
+                doc.close()
             
-            metadata = {
-                "file_type": "pdf",
-                "num_pages": num_pages
-            }
+            logger.info(f"Extracted {num_chars} characters from {num_pages} pages")
             
-            if file_id:
-                metadata["doc_id"] = file_id
-            if file_name:
-                metadata["file_name"] = file_name
-            
-            return [Document(text=md_text, metadata=metadata)]
+            return documents
             
         except Exception as e:
             logger.error(f"Error loading PDF: {str(e)}")
@@ -134,9 +179,12 @@ class DocumentLoader:
         logger.info(f"Loading DOCX: {file_path}")
         
         try:
+            from docx import Document as DocxDocument
+            
             doc = DocxDocument(file_path)
             
-            paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
+            # Paragraph.text rebuilds the string from its runs on every access; read it once
+            paragraphs = [text for p in doc.paragraphs if (text := p.text).strip()]
             text = "\n\n".join(paragraphs)
             
             logger.info(f"Extracted {len(text)} characters from {len(paragraphs)} paragraphs")
@@ -1,19 +1,64 @@
 """
 STL Loader - Load and process STL 3D model files
 """
+import hashlib
 import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import numpy as np
+import orjson
 from llama_index.core import Document
 
 logger = logging.getLogger(__name__)
 
+# Binary STL: 80-byte header and a uint32 triangle count, then one 50-byte record per triangle
+STL_HEADER_BYTES = 84
+STL_TRIANGLE_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attribute', '<u2')
+])
+# Triangles per block in _mesh_stats; keeps the float64 temporaries (a few MB) in cache
+STATS_BLOCK_TRIANGLES = 16384
+# Geometry metadata kept in memory per loader (the JSON cache on disk is unbounded)
+METADATA_CACHE_SIZE = 128
+# Bump whenever the computed metadata changes to invalidate cached entries
+METADATA_VERSION = '1'
+# Bytes read per step when hashing an STL for the metadata cache
+HASH_CHUNK_SIZE = 1 << 20
+
+# RAG description of an STL; filled from _description_fields()
+DESCRIPTION_TEMPLATE = (
+    "3D Model: {file_name}\n"
+    "\n"
+    "Model Statistics:\n"
+    "- Vertices: {vertex_count:,}\n"
+    "- Faces (Triangles): {face_count:,}\n"
+    "- Dimensions: {dx:.2f} x {dy:.2f} x {dz:.2f} units\n"
+    "- Volume: {volume:.2f} cubic units\n"
+    "- Surface Area: {surface_area:.2f} square units\n"
+    "- Watertight: {watertight}\n"
+    "\n"
+    "Bounding Box:\n"
+    "- Min: ({min_x:.2f}, {min_y:.2f}, {min_z:.2f})\n"
+    "- Max: ({max_x:.2f}, {max_y:.2f}, {max_z:.2f})\n"
+    "- Center: ({cx:.2f}, {cy:.2f}, {cz:.2f})"
+)
+
 class STLLoader:
     """Load STL 3D model files and extract metadata"""
     
-    def __init__(self):
-        pass
+    def __init__(self, cache_dir: str = "stl_cache"):
+        # Geometry metadata keyed by STL content hash, so re-uploads and
+        # re-indexing skip the mesh pass entirely
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self._metadata_cache: OrderedDict = OrderedDict()
+        self._metadata_lock = threading.Lock()
     
     def load_stl(self, file_path: str, file_id: str, file_name: str) -> Dict[str, Any]:
         """
@@ -28,15 +73,10 @@ class STLLoader:
             Dictionary with documents and metadata
         """
         try:
-            import trimesh
-            
             logger.info(f"Loading STL file: {file_name}")
             
-            # Load STL mesh
-            mesh = trimesh.load(file_path)
-            
             # Extract metadata
-            metadata = self._extract_metadata(mesh, file_name)
+            metadata = self._load_metadata(file_path, file_name)
             
             # Create text description for RAG
             text_content = self._create_text_description(metadata)
@@ -66,20 +106,110 @@ class STLLoader:
                 "text_content": f"Error processing STL file: {str(e)}"
             }
     
-    def _extract_metadata(self, mesh, file_name: str) -> Dict[str, Any]:
-        """Extract metadata from STL mesh"""
+    def _load_metadata(self, file_path: str, file_name: str) -> Dict[str, Any]:
+        """
+        Metadata for the STL at file_path, from cache when its content was seen before
+        
+        Lookups go memory, then cache_dir/{sha256[:16]}_v{METADATA_VERSION}.json,
+        then the mesh itself. file_name is not part of the cached entry, so
+        the same model uploaded under another name still hits.
+        """
+        digest = _file_sha256(file_path)[:16]
+        
+        geometry = self._cached_geometry(digest)
+        if geometry is not None:
+            logger.info(f"♻️  Using cached STL metadata: {digest}")
+            return {"file_name": file_name, **geometry}
+        
+        # Binary STLs are read straight into an array; only ASCII ones need trimesh's parser
+        triangles = self._read_binary_stl(file_path)
+        if triangles is None:
+            import trimesh
+            mesh = trimesh.load(file_path)
+            vertices, faces = mesh.vertices, mesh.faces
+        else:
+            vertices, faces = _merge_vertices(triangles)
+        
+        metadata = self._extract_metadata(vertices, faces, file_name)
+        # Failed extractions are retried rather than cached
+        if "error" not in metadata:
+            self._store_geometry(digest, {k: v for k, v in metadata.items() if k != "file_name"})
+        return metadata
+    
+    def _cached_geometry(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Cached metadata (without file_name) for a content hash, or None"""
+        with self._metadata_lock:
+            geometry = self._metadata_cache.get(digest)
+            if geometry is not None:
+                self._metadata_cache.move_to_end(digest)
+                return geometry
+        
+        try:
+            geometry = orjson.loads((self.cache_dir / f"{digest}_v{METADATA_VERSION}.json").read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        self._remember_geometry(digest, geometry)
+        return geometry
+    
+    def _store_geometry(self, digest: str, geometry: Dict[str, Any]):
+        """Add metadata to the memory cache and write it atomically to cache_dir"""
+        self._remember_geometry(digest, geometry)
+        
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(orjson.dumps(geometry))
+            os.replace(tmp_path, self.cache_dir / f"{digest}_v{METADATA_VERSION}.json")
+        except OSError as e:
+            os.unlink(tmp_path)
+            logger.warning(f"Could not write STL metadata cache: {e}")
+    
+    def _remember_geometry(self, digest: str, geometry: Dict[str, Any]):
+        """Insert into the in-memory LRU, evicting the oldest entry when full"""
+        with self._metadata_lock:
+            self._metadata_cache[digest] = geometry
+            self._metadata_cache.move_to_end(digest)
+            if len(self._metadata_cache) > METADATA_CACHE_SIZE:
+                self._metadata_cache.popitem(last=False)
+    
+    def _read_binary_stl(self, file_path: str) -> Optional[np.ndarray]:
+        """
+        Read a binary STL's triangles without building a mesh object
+        
+        Returns:
+            (n_triangles, 3, 3) float32 corner coordinates, or None if the
+            file isn't a well-formed binary STL (e.g. ASCII)
+        """
+        size = os.path.getsize(file_path)
+        if size < STL_HEADER_BYTES:
+            return None
+        
+        with open(file_path, 'rb') as f:
+            f.seek(80)
+            triangle_count = int.from_bytes(f.read(4), 'little')
+        
+        # ASCII files ("solid ...") essentially never match the binary size exactly
+        if size != STL_HEADER_BYTES + triangle_count * STL_TRIANGLE_DTYPE.itemsize:
+            return None
+        if triangle_count == 0:
+            return np.empty((0, 3, 3), dtype=np.float32)
+        
+        records = np.memmap(file_path, dtype=STL_TRIANGLE_DTYPE, mode='r',
+                            offset=STL_HEADER_BYTES, shape=(triangle_count,))
+        # One strided copy out of the mapping; normals and attributes are never read
+        triangles = np.ascontiguousarray(records['vertices'])
+        del records
+        return triangles
+    
+    def _extract_metadata(self, vertices: np.ndarray, faces: np.ndarray, file_name: str) -> Dict[str, Any]:
+        """Extract metadata from STL vertices and faces"""
         try:
-            # Get mesh properties
-            vertices = mesh.vertices
-            faces = mesh.faces
-            
             # Calculate bounding box
-            bounds = mesh.bounds
+            bounds = np.array([vertices.min(axis=0), vertices.max(axis=0)])
             dimensions = bounds[1] - bounds[0]
             
             # Calculate other properties
-            volume = mesh.volume if hasattr(mesh, 'volume') else 0
-            area = mesh.area if hasattr(mesh, 'area') else 0
+            area, volume, center_of_mass = _mesh_stats(vertices, faces)
             
             metadata = {
                 "file_name": file_name,
@@ -93,8 +223,8 @@ class STLLoader:
                 },
                 "volume": float(volume),
                 "surface_area": float(area),
-                "is_watertight": mesh.is_watertight if hasattr(mesh, 'is_watertight') else False,
-                "center_of_mass": mesh.center_mass.tolist() if hasattr(mesh, 'center_mass') else [0, 0, 0]
+                "is_watertight": _is_watertight(faces),
+                "center_of_mass": center_of_mass.tolist()
             }
             
             return metadata
@@ -112,26 +242,7 @@ class STLLoader:
         if "error" in metadata:
             return f"STL file: {metadata['file_name']} (Error: {metadata['error']})"
         
-        dims = metadata["bounding_box"]["dimensions"]
-        
-        text_parts = [
-            f"3D Model: {metadata['file_name']}",
-            "",
-            "Model Statistics:",
-            f"- Vertices: {metadata['vertex_count']:,}",
-            f"- Faces (Triangles): {metadata['face_count']:,}",
-            f"- Dimensions: {dims[0]:.2f} x {dims[1]:.2f} x {dims[2]:.2f} units",
-            f"- Volume: {metadata['volume']:.2f} cubic units",
-            f"- Surface Area: {metadata['surface_area']:.2f} square units",
-            f"- Watertight: {'Yes' if metadata['is_watertight'] else 'No'}",
-            "",
-            "Bounding Box:",
-            f"- Min: ({metadata['bounding_box']['min'][0]:.2f}, {metadata['bounding_box']['min'][1]:.2f}, {metadata['bounding_box']['min'][2]:.2f})",
-            f"- Max: ({metadata['bounding_box']['max'][0]:.2f}, {metadata['bounding_box']['max'][1]:.2f}, {metadata['bounding_box']['max'][2]:.2f})",
-            f"- Center: ({metadata['center_of_mass'][0]:.2f}, {metadata['center_of_mass'][1]:.2f}, {metadata['center_of_mass'][2]:.2f})"
-        ]
-        
-        return "\n".join(text_parts)
+        return DESCRIPTION_TEMPLATE.format_map(_description_fields(metadata))
     
     def _create_documents(
         self, text_content: str, file_id: str, 
@@ -151,3 +262,127 @@ class STLLoader:
         )
         
         return [doc]
+
+
+def _file_sha256(path: str) -> str:
+    """Hex sha256 of a file, read in HASH_CHUNK_SIZE pieces (hashlib.file_digest needs Python 3.11)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _description_fields(metadata: Dict) -> Dict[str, Any]:
+    """Flatten metadata into the top-level keys DESCRIPTION_TEMPLATE refers to"""
+    bbox = metadata["bounding_box"]
+    dx, dy, dz = bbox["dimensions"]
+    min_x, min_y, min_z = bbox["min"]
+    max_x, max_y, max_z = bbox["max"]
+    cx, cy, cz = metadata["center_of_mass"]
+    return {
+        "file_name": metadata["file_name"],
+        "vertex_count": metadata["vertex_count"],
+        "face_count": metadata["face_count"],
+        "volume": metadata["volume"],
+        "surface_area": metadata["surface_area"],
+        "watertight": "Yes" if metadata["is_watertight"] else "No",
+        "dx": dx, "dy": dy, "dz": dz,
+        "min_x": min_x, "min_y": min_y, "min_z": min_z,
+        "max_x": max_x, "max_y": max_y, "max_z": max_z,
+        "cx": cx, "cy": cy, "cz": cz
+    }
+
+
+def _merge_vertices(triangles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Shared vertices and faces from per-triangle corners, merging identical
+    coordinates like trimesh.load does
+    
+    Binary STL repeats every shared corner (typically ~6 times on a closed
+    mesh), so the compact arrays are several times smaller than the corner
+    soup. They stay in the file's float32, with int32 indices.
+    
+    Returns:
+        (vertices (n, 3) float32, faces (n_triangles, 3) int32)
+    """
+    corners = np.ascontiguousarray(triangles.reshape(-1, 3))
+    # Compare each corner's 12 bytes as one opaque value
+    keys = corners.view(np.dtype((np.void, corners.dtype.itemsize * 3))).ravel()
+    _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    vertices = corners[first_index]
+    faces = inverse.reshape(-1, 3).astype(np.int32)
+    return vertices, faces
+
+
+def _mesh_stats(vertices: np.ndarray, faces: np.ndarray) -> Tuple[float, float, np.ndarray]:
+    """
+    Surface area, enclosed volume and center of mass of a triangle mesh
+    
+    Volume and center of mass sum the signed tetrahedra spanned by the
+    origin and each triangle (the same definition trimesh uses), so they are
+    only meaningful for closed meshes. Open surfaces with no enclosed volume
+    fall back to the area-weighted centroid.
+    
+    Triangles are processed in blocks of STATS_BLOCK_TRIANGLES so the
+    per-triangle temporaries stay in cache instead of each costing a full
+    pass over memory on large meshes. Coordinates are laid out component-major
+    (3, n) so every operation runs on contiguous rows; np.cross on (n, 3)
+    arrays is several times slower.
+    
+    Returns:
+        (area, volume, center_of_mass)
+    """
+    area = 0.0
+    signed_volume = 0.0
+    # Running sums of per-triangle (a + b + c) weighted by volume and by area
+    volume_moment = np.zeros(3)
+    area_moment = np.zeros(3)
+    coords = np.ascontiguousarray(vertices.T, dtype=np.float64)
+    
+    for start in range(0, len(faces), STATS_BLOCK_TRIANGLES):
+        block = faces[start:start + STATS_BLOCK_TRIANGLES]
+        a, b, c = coords[:, block[:, 0]], coords[:, block[:, 1]], coords[:, block[:, 2]]
+        
+        bxc = _cross(b, c)
+        # (b - a) x (c - a) == a x b + b x c + c x a, reusing b x c
+        normals = _cross(a, b - c) + bxc
+        areas = 0.5 * np.sqrt(np.einsum('ij,ij->j', normals, normals))
+        tetra_volumes = np.einsum('ij,ij->j', a, bxc) / 6.0
+        corner_sums = a + b + c
+        
+        area += float(areas.sum())
+        signed_volume += float(tetra_volumes.sum())
+        volume_moment += corner_sums @ tetra_volumes
+        area_moment += corner_sums @ areas
+    
+    if signed_volume != 0.0:
+        # Each tetrahedron's centroid is (origin + a + b + c) / 4
+        center_of_mass = volume_moment / (4.0 * signed_volume)
+    elif area > 0.0:
+        center_of_mass = area_moment / (3.0 * area)
+    else:
+        center_of_mass = np.zeros(3)
+    
+    # Inside-out meshes (reversed winding) have negative signed volume
+    return area, abs(signed_volume), center_of_mass
+
+
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """Cross products of (3, n) component-major vector arrays"""
+    return np.stack([
+        u[1] * v[2] - u[2] * v[1],
+        u[2] * v[0] - u[0] * v[2],
+        u[0] * v[1] - u[1] * v[0]
+    ])
+
+
+def _is_watertight(faces: np.ndarray) -> bool:
+    """Whether every edge is shared by exactly two faces"""
+    if len(faces) == 0:
+        return False
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1).astype(np.int64)
+    # One integer per undirected edge so np.unique works on a flat array
+    keys = edges[:, 0] * (int(faces.max()) + 1) + edges[:, 1]
+    _, counts = np.unique(keys, return_counts=True)
+    return bool((counts == 2).all())
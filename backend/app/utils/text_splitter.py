@@ -0,0 +1,115 @@
+"""
+Text Splitter - Split-then-merge chunking for indexing
+"""
+from typing import List, Tuple
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.node_parser.text.sentence import _Split
+from llama_index.core.node_parser.text.utils import split_by_sep
+
+# Chunks with fewer new tokens than this are folded into the previous chunk
+MIN_CHUNK_SIZE = 100
+# How far past chunk_size a chunk may grow when a small tail is folded into it
+CHUNK_SIZE_SLACK = 1.05
+# Texts longer than chunk_size * this many characters are split without being
+# tokenized first; tokens average ~4 characters, so they can't fit anyway
+SPLIT_UNCOUNTED_CHARS_PER_TOKEN = 8
+
+
+class SplitMergeSplitter(SentenceSplitter):
+    """
+    SentenceSplitter that splits on blank lines, then single lines, then
+    sentences, and never leaves a tiny tail chunk
+
+    Pass 1 (inherited) recursively splits text into pieces no larger than
+    chunk_size. Pass 2 greedily merges adjacent pieces up to chunk_size with
+    chunk_overlap, as SentenceSplitter does, except that a final chunk adding
+    fewer than min_chunk_size tokens is folded into the previous one when that
+    stays within CHUNK_SIZE_SLACK * chunk_size. PDF pages and CAD entity
+    listings otherwise end in many overlap-only chunks that cost a vector each.
+    """
+
+    min_chunk_size: int = Field(
+        default=MIN_CHUNK_SIZE,
+        description="Minimum number of new tokens in a trailing chunk.",
+        ge=0,
+    )
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, min_chunk_size: int = MIN_CHUNK_SIZE, **kwargs):
+        # pymupdf4llm markdown and docx text separate paragraphs with one blank line
+        super().__init__(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, paragraph_separator="\n\n", **kwargs
+        )
+        self.min_chunk_size = min_chunk_size
+        # Line breaks sit between paragraphs and sentences: CAD entity dumps
+        # and markdown tables are one record per line
+        self._split_fns = [split_by_sep("\n\n"), split_by_sep("\n"), self._chunking_tokenizer_fn]
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SplitMergeSplitter"
+
+    def _split(self, text: str, chunk_size: int) -> List[_Split]:
+        """
+        Break text into splits no larger than chunk_size, as SentenceSplitter
+        does, but skip token counts for text that is obviously too large
+
+        Tokenizing is most of the splitting cost; the inherited version counts
+        the whole document, then every piece again at each level of recursion.
+        """
+        max_uncounted_chars = chunk_size * SPLIT_UNCOUNTED_CHARS_PER_TOKEN
+        if len(text) <= max_uncounted_chars:
+            return super()._split(text, chunk_size)
+
+        pieces, is_sentence = self._get_splits_by_fns(text)
+        splits: List[_Split] = []
+        for piece in pieces:
+            if len(piece) <= max_uncounted_chars:
+                token_size = self._token_size(piece)
+                if token_size <= chunk_size:
+                    splits.append(_Split(piece, is_sentence=is_sentence, token_size=token_size))
+                    continue
+            splits.extend(self._split(piece, chunk_size))
+        return splits
+
+    def _merge(self, splits: List[_Split], chunk_size: int) -> List[str]:
+        """Greedily merge splits into overlapping chunks, folding a small tail into its predecessor"""
+        chunks: List[List[Tuple[str, int]]] = []
+        current: List[Tuple[str, int]] = []
+        current_len = 0
+        # Number of leading entries of current carried over as overlap
+        overlap_count = 0
+
+        for split in splits:
+            if split.token_size > chunk_size:
+                raise ValueError("Single token exceeded chunk size")
+            if len(current) > overlap_count and current_len + split.token_size > chunk_size:
+                chunks.append(current)
+                current = self._overlap(current)
+                current_len = sum(length for _, length in current)
+                overlap_count = len(current)
+            current.append((split.text, split.token_size))
+            current_len += split.token_size
+
+        if len(current) > overlap_count:
+            tail = current[overlap_count:]
+            tail_len = sum(length for _, length in tail)
+            if chunks and tail_len < self.min_chunk_size and (
+                sum(length for _, length in chunks[-1]) + tail_len <= chunk_size * CHUNK_SIZE_SLACK
+            ):
+                chunks[-1].extend(tail)
+            else:
+                chunks.append(current)
+
+        return self._postprocess_chunks(["".join(text for text, _ in chunk) for chunk in chunks])
+
+    def _overlap(self, chunk: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Trailing splits of chunk that fit in chunk_overlap, to start the next chunk"""
+        overlap: List[Tuple[str, int]] = []
+        overlap_len = 0
+        for text, length in reversed(chunk):
+            if overlap_len + length > self.chunk_overlap:
+                break
+            overlap.insert(0, (text, length))
+            overlap_len += length
+        return overlap
@@ -1,7 +1,13 @@
 import google.generativeai as genai
+import argparse
 import os
 from dotenv import load_dotenv
 
+parser = argparse.ArgumentParser(description="List the Gemini models available to GOOGLE_API_KEY")
+parser.add_argument('--probe', action='store_true',
+                    help="also send a test prompt to the first generation model")
+args = parser.parse_args()
+
 # Load environment variables
 load_dotenv()
 
@@ -23,12 +29,14 @@ try:
     
     generation_models = []
     embedding_models = []
+    # Output is collected and written once rather than several prints per model
+    lines = []
     
     for model in models:
-        print(f"\nModel: {model.name}")
-        print(f"  Display Name: {model.display_name}")
-        print(f"  Description: {model.description[:100]}...")
-        print(f"  Supported Methods: {model.supported_generation_methods}")
+        lines.append(f"\nModel: {model.name}")
+        lines.append(f"  Display Name: {model.display_name}")
+        lines.append(f"  Description: {model.description[:100]}...")
+        lines.append(f"  Supported Methods: {model.supported_generation_methods}")
         
         # Categorize models
         if 'generateContent' in model.supported_generation_methods:
@@ -36,24 +44,24 @@ try:
         if 'embedContent' in model.supported_generation_methods:
             embedding_models.append(model.name)
     
-    print("\n" + "=" * 80)
-    print("RECOMMENDED MODELS FOR YOUR APP")
-    print("=" * 80)
+    lines.append("\n" + "=" * 80)
+    lines.append("RECOMMENDED MODELS FOR YOUR APP")
+    lines.append("=" * 80)
     
-    print("\n📝 GENERATION MODELS (for chat/responses):")
-    for model in generation_models:
-        print(f"  - {model}")
+    lines.append("\n📝 GENERATION MODELS (for chat/responses):")
+    lines.extend(f"  - {model}" for model in generation_models)
     
-    print("\n🔍 EMBEDDING MODELS (for document indexing):")
-    for model in embedding_models:
-        print(f"  - {model}")
+    lines.append("\n🔍 EMBEDDING MODELS (for document indexing):")
+    lines.extend(f"  - {model}" for model in embedding_models)
     
-    print("\n" + "=" * 80)
-    print("TESTING A SIMPLE GENERATION")
-    print("=" * 80)
+    print("\n".join(lines))
     
-    # Try to use a model
-    if generation_models:
+    # Listing already proves the key works; a test generation is an extra round-trip
+    if args.probe and generation_models:
+        print("\n" + "=" * 80)
+        print("TESTING A SIMPLE GENERATION")
+        print("=" * 80)
+        
         test_model_name = generation_models[0]
         print(f"\nTesting: {test_model_name}")
         
@@ -1,4 +1,4 @@
-from pinecone import Pinecone
+import asyncio
 import os
 from dotenv import load_dotenv
 import shutil
@@ -6,44 +6,72 @@ from pathlib import Path
 
 load_dotenv()
 
-print("🧹 Starting complete cleanup...")
-
-# 1. Clear Pinecone
-pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
 index_name = os.getenv('PINECONE_INDEX_NAME', 'documind-index')
+uploads_dir = Path('./uploads')
+conv_dir = Path('./conversations')
+
 
-try:
+def clear_pinecone():
+    """Delete every vector in the index"""
+    # Imported here so the SDK's import cost overlaps the local deletes too
+    from pinecone import Pinecone
+
+    pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
     index = pc.Index(index_name)
     stats_before = index.describe_index_stats()
     print(f"📊 Pinecone vectors before: {stats_before.total_vector_count}")
-    
-    # Delete all vectors
+
+    # Deletes are eventually consistent, so a stats call right after would
+    # still report the old count
     index.delete(delete_all=True)
-    
-    stats_after = index.describe_index_stats()
-    print(f"✅ Pinecone vectors after: {stats_after.total_vector_count}")
-except Exception as e:
-    print(f"⚠️  Pinecone cleanup: {e}")
+    print("✅ Deleted all Pinecone vectors")
 
-# 2. Clear uploads
-uploads_dir = Path('./uploads')
-if uploads_dir.exists():
-    for file in uploads_dir.glob('*'):
-        if file.is_file():
-            file.unlink()
+
+def clear_uploads():
+    """Delete uploaded files, including the document metadata"""
+    if not uploads_dir.exists():
+        return
+    had_metadata = False
+    # DirEntry.is_file() uses the type from the directory listing (no stat per file)
+    with os.scandir(uploads_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                had_metadata |= entry.name == 'documents_metadata.json'
+                os.unlink(entry.path)
     print("✅ Cleared uploads directory")
+    if had_metadata:
+        print("✅ Cleared document metadata")
 
-# 3. Clear conversations
-conv_dir = Path('./conversations')
-if conv_dir.exists():
-    shutil.rmtree(conv_dir)
-    conv_dir.mkdir(parents=True, exist_ok=True)
+
+def clear_conversations():
+    """Empty the conversations directory in place"""
+    if not conv_dir.exists():
+        return
+    with os.scandir(conv_dir) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
     print("✅ Cleared conversations")
 
-# 4. Clear document metadata
-metadata_file = uploads_dir / 'documents_metadata.json'
-if metadata_file.exists():
-    metadata_file.unlink()
-    print("✅ Cleared document metadata")
 
-print("\n🎉 Complete cleanup finished!")
+async def main():
+    print("🧹 Starting complete cleanup...")
+
+    # Pinecone round-trips overlap with the local deletes
+    results = await asyncio.gather(
+        asyncio.to_thread(clear_pinecone),
+        asyncio.to_thread(clear_uploads),
+        asyncio.to_thread(clear_conversations),
+        return_exceptions=True
+    )
+    for step, result in zip(("Pinecone", "Uploads", "Conversations"), results):
+        if isinstance(result, Exception):
+            print(f"⚠️  {step} cleanup: {result}")
+
+    print("\n🎉 Complete cleanup finished!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
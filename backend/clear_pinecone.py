@@ -18,10 +18,7 @@ print(f"Total vectors: {stats.total_vector_count}")
 
 # Delete all vectors
 print("\nDeleting all vectors...")
+# Deletes are eventually consistent; stats read right after would still show
+# the old count, so they aren't re-read here
 index.delete(delete_all=True)
-
-# Get stats after deletion
-stats = index.describe_index_stats()
-print(f"\nAfter deletion:")
-print(f"Total vectors: {stats.total_vector_count}")
 print("\n✅ Pinecone index cleared successfully!")
@@ -5,6 +5,7 @@ Generate missing PNG files for existing CAD documents
 
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 # Add current directory to path
@@ -13,9 +14,11 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from app.services.document_service import document_service
 
 def convert_svg_to_png(svg_path: str, png_path: str, dpi: int = 300):
-    """Convert SVG to high-resolution PNG"""
+    """Convert SVG to high-resolution PNG (runs in a worker process)"""
     try:
+        # Imported in the worker so no native cairo state crosses the fork
         import cairosvg
+        # Full 4096px: the vision and CV extraction passes read fine detail from this PNG
         cairosvg.svg2png(
             url=svg_path,
             write_to=png_path,
@@ -45,6 +48,7 @@ def main():
     print(f"Found {len(cad_docs)} CAD documents")
     
     generated = 0
+    pending = []
     
     for doc in cad_docs:
         doc_id = doc['id']
@@ -62,9 +66,22 @@ def main():
             print(f"✓ {doc_name}: PNG already exists")
             continue
         
-        print(f"🎨 {doc_name}: Generating PNG from SVG...")
-        if convert_svg_to_png(str(svg_path), str(png_path)):
-            generated += 1
+        pending.append((doc_name, svg_path, png_path))
+    
+    # Rasterizing is CPU-bound and documents are independent, so convert them in parallel
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+            futures = {}
+            for doc_name, svg_path, png_path in pending:
+                print(f"🎨 {doc_name}: Generating PNG from SVG...")
+                futures[executor.submit(convert_svg_to_png, str(svg_path), str(png_path))] = doc_name
+            
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        generated += 1
+                except Exception as e:
+                    print(f"❌ {futures[future]}: {e}")
     
     print(f"\n✨ Complete! Generated {generated} new PNG files")
 
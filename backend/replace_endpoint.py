@@ -1,27 +1,11 @@
 #!/usr/bin/env python3
+import ast
 import sys
 
 # Read current routes.py
 with open('app/api/routes.py', 'r') as f:
     content = f.read()
 
-# Find and extract everything before the advanced-analysis endpoint
-start_marker = '@router.post("/conversations/{conv_id}/advanced-analysis")'
-start_pos = content.find(start_marker)
-
-if start_pos == -1:
-    print("ERROR: Could not find advanced-analysis endpoint!")
-    sys.exit(1)
-
-# Find the next @router after this endpoint
-next_router_pos = content.find('\n@router.', start_pos + 100)
-if next_router_pos == -1:
-    next_router_pos = len(content)
-
-# Extract parts
-before_endpoint = content[:start_pos]
-after_endpoint = content[next_router_pos:]
-
 # New endpoint code
 new_endpoint = '''@router.post("/conversations/{conv_id}/advanced-analysis")
 async def run_advanced_analysis(conv_id: str, request: ChatRequest):
@@ -58,7 +42,6 @@ async def run_advanced_analysis(conv_id: str, request: ChatRequest):
         from app.cad.multi_model_analyzer import MultiModelCADAnalyzer
         from app.core.config import get_settings
         from pathlib import Path
-        import json
         
         settings = get_settings()
         analyzer = MultiModelCADAnalyzer(
@@ -73,32 +56,32 @@ async def run_advanced_analysis(conv_id: str, request: ChatRequest):
         
         all_analyses = []
         
-        for doc in cad_docs:
-            doc_id = doc['id']
-            doc_name = doc['name']
-            
-            logger.info(f"Running advanced analysis for: {doc_name} with {selected_model}")
-            
-            # Find PNG
-            png_path = Path(f"cad_renders/{doc_id}_analysis.png")
-            
-            if not png_path.exists():
-                logger.warning(f"PNG not found for {doc_id}, skipping")
-                all_analyses.append(f"⚠️ **{doc_name}**: Analysis PNG not available. Please re-upload this file.")
-                continue
-            
-            try:
-                # Run comprehensive analysis
-                analysis_results = await analyzer.comprehensive_analysis(str(png_path), selected_model)
+        try:
+            for doc in cad_docs:
+                doc_id = doc['id']
+                doc_name = doc['name']
+                
+                logger.info(f"Running advanced analysis for: {doc_name} with {selected_model}")
                 
-                # Save analysis
-                analysis_path = Path(f"cad_manifests/{doc_id}_analysis.json")
-                with open(analysis_path, 'w') as f:
-                    json.dump(analysis_results, f, indent=2)
+                # Find PNG
+                png_path = Path(f"cad_renders/{doc_id}_analysis.png")
                 
-                # Format response
-                model_info = analyzer.MODELS[selected_model]
-                formatted = f"""
+                if not png_path.exists():
+                    logger.warning(f"PNG not found for {doc_id}, skipping")
+                    all_analyses.append(f"⚠️ **{doc_name}**: Analysis PNG not available. Please re-upload this file.")
+                    continue
+                
+                try:
+                    # Run comprehensive analysis
+                    analysis_results = await analyzer.comprehensive_analysis(str(png_path), selected_model)
+                    
+                    # Save analysis
+                    analysis_path = Path(f"cad_manifests/{doc_id}_analysis.json")
+                    analysis_path.write_bytes(orjson.dumps(analysis_results, option=ANALYSIS_JSON_OPTIONS))
+                    
+                    # Format response
+                    model_info = analyzer.MODELS[selected_model]
+                    formatted = f"""
 # 🔍 ADVANCED CAD ANALYSIS: {doc_name}
 
 **Model**: {model_info['name']} ({model_info['provider'].upper()})
@@ -106,11 +89,13 @@ async def run_advanced_analysis(conv_id: str, request: ChatRequest):
 
 {analyzer.format_for_rag(analysis_results)}
 """
-                all_analyses.append(formatted)
-                
-            except Exception as e:
-                logger.error(f"Error analyzing {doc_name}: {e}", exc_info=True)
-                all_analyses.append(f"❌ **{doc_name}**: Analysis failed - {str(e)}")
+                    all_analyses.append(formatted)
+                    
+                except Exception as e:
+                    logger.error(f"Error analyzing {doc_name}: {e}", exc_info=True)
+                    all_analyses.append(f"❌ **{doc_name}**: Analysis failed - {str(e)}")
+        finally:
+            await analyzer.aclose()
         
         if not all_analyses:
             combined_response = "⚠️ No analyses could be completed. Please ensure CAD files have been properly uploaded."
@@ -177,12 +162,38 @@ async def get_available_models():
 
 '''
 
-# Combine
-new_content = before_endpoint + new_endpoint + after_endpoint
+def top_level_functions(source: str):
+    """Top-level (async) function definitions in source, by name"""
+    return {
+        node.name: node
+        for node in ast.parse(source).body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    }
+
+# Locate the endpoints by name rather than by text search, so formatting
+# changes in routes.py don't break the rewrite
+existing = top_level_functions(content)
+if 'run_advanced_analysis' not in existing:
+    print("ERROR: Could not find advanced-analysis endpoint!")
+    sys.exit(1)
+
+# Every function new_endpoint defines is replaced, so re-running doesn't
+# duplicate /models; line spans include decorators (1-based, inclusive)
+spans = sorted(
+    (min([node.lineno] + [d.lineno for d in node.decorator_list]), node.end_lineno)
+    for name, node in existing.items()
+    if name in top_level_functions(new_endpoint)
+)
+
+lines = content.splitlines(keepends=True)
+insert_at = spans[0][0] - 1
+for start, end in reversed(spans):
+    del lines[start - 1:end]
+lines.insert(insert_at, new_endpoint.rstrip('\n') + '\n')
 
 # Write new file
 with open('app/api/routes.py', 'w') as f:
-    f.write(new_content)
+    f.write(''.join(lines))
 
 print("✅ Successfully updated routes.py!")
 print(f"   - Replaced advanced-analysis endpoint")
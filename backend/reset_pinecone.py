@@ -8,11 +8,36 @@ load_dotenv()
 pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
 index_name = os.getenv('PINECONE_INDEX_NAME', 'documind-index')
 
+# Give up waiting on Pinecone after this many seconds
+WAIT_TIMEOUT = 60
+
+
+def wait_until(condition, description):
+    """Poll condition() with backoff (0.5s growing to 3s) until it holds or WAIT_TIMEOUT passes"""
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    delay = 0.5
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(delay)
+        delay = min(delay * 1.5, 3)
+    print(f"⚠️  Still waiting for {description} after {WAIT_TIMEOUT}s; continuing")
+    return False
+
+
+def index_gone():
+    return index_name not in pc.list_indexes().names()
+
+
+def index_ready():
+    return getattr(pc.describe_index(index_name).status, 'ready', False)
+
+
 print(f"Deleting index: {index_name}")
 try:
     pc.delete_index(index_name)
-    print("Index deleted. Waiting 10 seconds...")
-    time.sleep(10)
+    print("Index deleted. Waiting for it to disappear...")
+    wait_until(index_gone, "index deletion")
 except Exception as e:
     print(f"Error deleting index: {e}")
 
@@ -28,6 +53,6 @@ pc.create_index(
 )
 
 print("Waiting for index to be ready...")
-time.sleep(10)
+wait_until(index_ready, "index readiness")
 
 print("✅ Index reset complete!")
@@ -2,26 +2,35 @@
 Automated tests for CAD parser functionality
 """
 import pytest
-import json
+import numpy as np
+import orjson
 import sys
 from pathlib import Path
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app.cad.parser import DXFParser
+from app.cad.parser import DXFParser, MANIFEST_REQUIRED_FIELDS
 from app.cad.entity_extractor import EntityExtractor
 from app.cad.converter import CADConverter
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_manifest():
-    """Load sample manifest for testing"""
+    """Load sample manifest once for the whole session (tests must not mutate it)"""
     manifest_path = Path("schema/manifest_example.json")
     if manifest_path.exists():
-        with open(manifest_path) as f:
-            return json.load(f)
+        return orjson.loads(manifest_path.read_bytes())
     return None
 
+def _first_failure(ok: np.ndarray):
+    """(entity index, coordinate index) of the first False in an (N, 4) check"""
+    row, col = np.argwhere(~ok)[0]
+    return int(row), int(col)
+
+def _first_non_numeric(entities, key: str) -> str:
+    """Id of the first entity whose bbox under key holds a non-number"""
+    return next(e["id"] for e in entities if not all(isinstance(x, (int, float)) for x in e[key]))
+
 def test_manifest_completeness(sample_manifest):
     """Test that manifest has all required fields"""
     if sample_manifest is None:
@@ -29,26 +38,20 @@ def test_manifest_completeness(sample_manifest):
     
     manifest = sample_manifest
     
-    # Required top-level fields
-    assert "file_id" in manifest, "Missing file_id"
-    assert "sheet_id" in manifest, "Missing sheet_id"
-    assert "conversion_status" in manifest, "Missing conversion_status"
-    assert "units" in manifest, "Missing units"
-    assert "scale" in manifest, "Missing scale"
+    # Required top-level fields (the same set DXFParser checks saved manifests against)
+    missing = MANIFEST_REQUIRED_FIELDS - manifest.keys()
+    assert not missing, f"Missing {', '.join(sorted(missing))}"
     
     # Extents
-    assert "extents" in manifest, "Missing extents"
     assert "min" in manifest["extents"], "Missing extents.min"
     assert "max" in manifest["extents"], "Missing extents.max"
     assert len(manifest["extents"]["min"]) == 2, "Invalid min coordinates"
     assert len(manifest["extents"]["max"]) == 2, "Invalid max coordinates"
     
     # Entities
-    assert "entities" in manifest, "Missing entities array"
     assert isinstance(manifest["entities"], list), "Entities must be array"
     
     # Statistics
-    assert "statistics" in manifest, "Missing statistics"
     assert "total_entities" in manifest["statistics"], "Missing total_entities"
     
     print("✓ Manifest completeness PASS")
@@ -75,10 +78,12 @@ def test_entity_structure(sample_manifest):
         # Bounding box structure
         assert len(entity["bbox_world"]) == 4, "Invalid bbox_world"
         assert len(entity["bbox_norm"]) == 4, "Invalid bbox_norm"
-        
-        # Normalized bbox should be in 0-1 range
-        for coord in entity["bbox_norm"]:
-            assert 0 <= coord <= 1, f"Normalized coordinate out of range: {coord}"
+    
+    # Normalized bbox should be in 0-1 range (checked as one (N, 4) array)
+    bbox_norm = np.array([entity["bbox_norm"] for entity in entities])
+    ok = (bbox_norm >= 0) & (bbox_norm <= 1)
+    assert ok.all(), \
+        f"Normalized coordinate out of range: {bbox_norm[_first_failure(ok)]}"
     
     print(f"✓ Entity structure PASS ({len(entities)} entities checked)")
 
@@ -191,23 +196,49 @@ def test_bbox_validity(sample_manifest):
     
     entities = sample_manifest["entities"]
     
-    for entity in entities:
-        bbox_world = entity["bbox_world"]
-        bbox_norm = entity["bbox_norm"]
-        
-        # Check types
-        assert all(isinstance(x, (int, float)) for x in bbox_world), \
-            f"Invalid world bbox types in {entity['id']}"
-        assert all(isinstance(x, (int, float)) for x in bbox_norm), \
-            f"Invalid norm bbox types in {entity['id']}"
-        
-        # Check normalized range
-        for i, coord in enumerate(bbox_norm):
-            assert -0.1 <= coord <= 1.1, \
-                f"Normalized coordinate {i} out of range in {entity['id']}: {coord}"
+    # Check types: any non-number (str, None, ...) makes numpy fall back to a non-numeric dtype
+    bbox_world = np.array([entity["bbox_world"] for entity in entities])
+    bbox_norm = np.array([entity["bbox_norm"] for entity in entities])
+    assert bbox_world.dtype.kind in "iuf", \
+        f"Invalid world bbox types in {_first_non_numeric(entities, 'bbox_world')}"
+    assert bbox_norm.dtype.kind in "iuf", \
+        f"Invalid norm bbox types in {_first_non_numeric(entities, 'bbox_norm')}"
+    
+    # Check normalized range
+    ok = (bbox_norm >= -0.1) & (bbox_norm <= 1.1)
+    if not ok.all():
+        row, i = _first_failure(ok)
+        pytest.fail(f"Normalized coordinate {i} out of range in {entities[row]['id']}: {bbox_norm[row, i]}")
     
     print("✓ Bounding box validity PASS")
 
+def test_streaming_without_tables(tmp_path, monkeypatch):
+    """Test that streaming extraction handles a DXF with no TABLES section"""
+    from ezdxf.addons import r12writer
+    import app.cad.entity_extractor as entity_extractor
+    
+    # r12writer (the usual writer for very large DXFs) emits only an ENTITIES section
+    dxf_path = tmp_path / "no_tables.dxf"
+    with r12writer(str(dxf_path)) as writer:
+        writer.add_line((0, 0), (10, 5), layer="WALLS")
+        writer.add_text("HELLO", (1, 1), height=2)
+    
+    # Force the streaming path regardless of file size
+    monkeypatch.setattr(entity_extractor, "STREAMING_THRESHOLD_BYTES", 0)
+    result = EntityExtractor().extract_all(str(dxf_path))
+    
+    assert result["layers"] == [], "Expected no layers without a TABLES section"
+    assert result["statistics"]["total_entities"] == 2, "Entities not streamed"
+    assert result["statistics"]["text_entities"] == 1, "TEXT entity not extracted"
+    
+    print("✓ Streaming without TABLES PASS")
+
 if __name__ == "__main__":
-    # Run tests with verbose output
-    pytest.main([__file__, "-v", "-s"])
+    # Run tests with verbose output, spread over all CPUs when pytest-xdist is installed
+    args = [__file__, "-v", "-s"]
+    try:
+        import xdist  # noqa: F401
+        args += ["-n", "auto"]
+    except ImportError:
+        pass
+    pytest.main(args)
@@ -3,7 +3,7 @@
 Quick test script for CAD processing
 """
 import sys
-import json
+import orjson
 from pathlib import Path
 
 # Add parent to path
@@ -30,8 +30,7 @@ def test_cad_pipeline():
     print("\n2. Loading sample manifest...")
     manifest_path = Path("schema/manifest_example.json")
     if manifest_path.exists():
-        with open(manifest_path) as f:
-            manifest = json.load(f)
+        manifest = orjson.loads(manifest_path.read_bytes())
         print(f"   ✓ Loaded sample manifest")
         print(f"   - File: {manifest['source_file']}")
         print(f"   - Status: {manifest['conversion_status']}")